@@ -0,0 +1,98 @@
+"""Codec between DynamoDB's wire format and plain dicts, without Decimal.
+
+boto3's resource API runs every attribute of every item through
+TypeDeserializer, turning each number into a Decimal that callers then
+convert back with int(). The files table only holds strings and integer
+sizes, so its items decode straight from the low-level client's
+{'S': ...} / {'N': ...} values: strings are taken as they are and numbers
+become ints (floats if they have a fraction or exponent).
+
+listing_entry goes one step further for the hot path and reads a listing
+row straight into the dict /files returns.
+"""
+
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+
+
+def decode_number(text):
+    """int for integral N values, float otherwise"""
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def decode_value(value):
+    """One AttributeValue as a plain Python value"""
+    if 'S' in value:
+        return value['S']
+    if 'N' in value:
+        return decode_number(value['N'])
+    if 'BOOL' in value:
+        return value['BOOL']
+    if 'NULL' in value:
+        return None
+    if 'SS' in value:
+        return set(value['SS'])
+    if 'NS' in value:
+        return {decode_number(number) for number in value['NS']}
+    if 'L' in value:
+        return [decode_value(element) for element in value['L']]
+    if 'M' in value:
+        return decode_item(value['M'])
+    if 'B' in value:
+        return value['B']
+    if 'BS' in value:
+        return set(value['BS'])
+    raise ValueError(f'Unknown attribute value: {value!r}')
+
+
+def decode_item(item):
+    """A low-level item (or key) as a plain dict"""
+    decoded = {}
+    for name, value in item.items():
+        # Strings are nearly every attribute; check them before the general case
+        text = value.get('S')
+        decoded[name] = text if text is not None else decode_value(value)
+    return decoded
+
+
+def encode_value(value):
+    """One plain Python value as an AttributeValue"""
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, float)):
+        return {'N': str(value)}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, (set, frozenset)):
+        if all(isinstance(element, str) for element in value):
+            return {'SS': sorted(value)}
+        return {'NS': [str(element) for element in value]}
+    if isinstance(value, (list, tuple)):
+        return {'L': [encode_value(element) for element in value]}
+    if isinstance(value, dict):
+        return {'M': encode_item(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    raise TypeError(f'Cannot encode {type(value).__name__} for DynamoDB')
+
+
+def encode_item(item):
+    """A plain dict as a low-level item (or key)"""
+    return {name: encode_value(value) for name, value in item.items()}
+
+
+def listing_entry(item):
+    """A files table listing row as the entry /files returns for it"""
+    content_type = item.get('content_type')
+    return {
+        'file_id': item['file_id']['S'],
+        'filename': item['filename']['S'],
+        'size': int(item['size']['N']),
+        'uploaded_at': item['uploaded_at']['S'],
+        'uploaded_by': item['username']['S'],  # Show who uploaded it
+        'content_type': content_type['S'] if content_type else DEFAULT_CONTENT_TYPE
+    }
@@ -1,61 +1,454 @@
 import json
-import boto3
 import hashlib
+import hmac
 import base64
 import os
-from datetime import datetime
-from decimal import Decimal
+import random
+import re
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+from presign import Presigner
+from dynamocodec import decode_item, encode_item, listing_entry
+from metrics import AwsCallRecorder, LatencyHistogram
+from search import filename_grams, match_rank, normalize, posting_key, query_grams
 
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
+
+class Lazy:
+    """Stand-in for a boto3 client, resource or table, built by factory on first attribute access.
+
+    Importing boto3 and building clients is most of a cold start, and
+    OPTIONS preflights, 404s and token checks need neither. The first build
+    holds a lock: local/serve.py's transfer threads use the storage backend
+    concurrently, and it must only be built once.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        target = self._target
+        if target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+                target = self._target
+        return getattr(target, name)
+
+
+# Every AWS call made through these clients is tallied per invocation and
+# logged with the response; AWS_TRACE_SAMPLE_RATE of invocations also log
+# each call in order
+AWS_TRACE_SAMPLE_RATE = float(os.environ.get('AWS_TRACE_SAMPLE_RATE', '0'))
+aws_calls = AwsCallRecorder()
+
+
+def _s3_client():
+    import boto3
+    from botocore.config import Config
+    # SigV4 so botocore's URLs and the fast presigner's are interchangeable
+    return aws_calls.instrument(boto3.client('s3', config=Config(signature_version='s3v4')))
+
+
+def _aws(kind, name):
+    import boto3
+    target = getattr(boto3, kind)(name)
+    aws_calls.instrument(target.meta.client if kind == 'resource' else target)
+    return target
+
+
+def _local_storage():
+    from localstore import LocalStorage
+    # Presigned URLs get their own key, derived from the active token signing key unless set
+    secret = os.environ.get('LOCAL_STORAGE_SECRET', '').encode() or hmac.new(
+        SIGNING_KEYS[ACTIVE_KEY_ID], b'local-storage-urls', hashlib.sha256
+    ).digest()
+    return LocalStorage(LOCAL_STORAGE_DIR, LOCAL_STORAGE_URL, secret, {
+        USERS_TABLE: ('username', {}),
+        FILES_TABLE: ('file_id', {
+            OWNER_INDEX: ('username', 'uploaded_at'),
+            'HashIndex': ('file_hash', None),
+            LISTING_INDEX: ('listing', 'uploaded_at'),
+        }),
+        META_TABLE: ('name', {}),
+        UPLOADS_TABLE: ('upload_id', {}),
+        BLOBS_TABLE: ('file_hash', {}),
+        SEARCH_TABLE: ('posting', {SEARCH_INDEX: ('gram', 'uploaded_at')}),
+    })
+
+
+# STORAGE_BACKEND=local keeps objects in files and items in SQLite under
+# LOCAL_STORAGE_DIR instead of S3 and DynamoDB (localstore.py), for serving
+# with local/serve.py without AWS. Presigned URLs then point at
+# LOCAL_STORAGE_URL, which serve.py answers.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'aws')
+LOCAL_STORAGE_DIR = os.environ.get('LOCAL_STORAGE_DIR', 'storage')
+LOCAL_STORAGE_URL = os.environ.get('LOCAL_STORAGE_URL', 'http://localhost:5000/_storage')
+
+if STORAGE_BACKEND == 'local':
+    local_storage = Lazy(_local_storage)
+    s3 = Lazy(lambda: local_storage.s3)
+    presigner = Lazy(lambda: local_storage.presigner)
+    dynamodb = Lazy(lambda: local_storage.dynamodb)
+    dynamodb_client = Lazy(lambda: local_storage.dynamodb_client)
+else:
+    s3 = Lazy(_s3_client)
+    presigner = Lazy(lambda: Presigner(s3))
+    dynamodb = Lazy(lambda: _aws('resource', 'dynamodb'))
+    # Files table reads go through a plain low-level client and dynamocodec, which
+    # skip the resource API's per-attribute Decimal deserialization (the
+    # resource's own meta.client has those transforms registered on it)
+    dynamodb_client = Lazy(lambda: _aws('client', 'dynamodb'))
+lambda_client = Lazy(lambda: _aws('client', 'lambda'))
 
 BUCKET_NAME = os.environ['BUCKET_NAME']
 USERS_TABLE = os.environ['USERS_TABLE']
 FILES_TABLE = os.environ['FILES_TABLE']
+META_TABLE = os.environ['META_TABLE']
+UPLOADS_TABLE = os.environ['UPLOADS_TABLE']
+BLOBS_TABLE = os.environ['BLOBS_TABLE']
+SEARCH_TABLE = os.environ['SEARCH_TABLE']
+
+users_table = Lazy(lambda: dynamodb.Table(USERS_TABLE))
+files_table = Lazy(lambda: dynamodb.Table(FILES_TABLE))
+meta_table = Lazy(lambda: dynamodb.Table(META_TABLE))
+uploads_table = Lazy(lambda: dynamodb.Table(UPLOADS_TABLE))
+blobs_table = Lazy(lambda: dynamodb.Table(BLOBS_TABLE))
+search_table = Lazy(lambda: dynamodb.Table(SEARCH_TABLE))
+
+# Session tokens are HMAC-signed and verified in-process. TOKEN_SIGNING_KEYS
+# is a comma-separated list of kid:secret pairs; the first key signs new
+# tokens and the others are still accepted, so keys can be rotated.
+TOKEN_TTL = int(os.environ.get('TOKEN_TTL', '43200'))
+TOKEN_REVOCATION = os.environ.get('TOKEN_REVOCATION', 'true').lower() == 'true'
+REVOCATION_CACHE_TTL = float(os.environ.get('REVOCATION_CACHE_TTL', '60'))
+REVOKED_TOKENS_KEY = 'revoked-tokens'
+
+
+def load_signing_keys(spec):
+    """Parse 'kid:secret,kid:secret' into an ordered {kid: secret} dict"""
+    keys = {}
+    for entry in spec.split(','):
+        kid, _, secret = entry.strip().partition(':')
+        if kid and secret:
+            keys[kid] = secret.encode()
+    if not keys:
+        raise ValueError('TOKEN_SIGNING_KEYS has no kid:secret entries')
+    return keys
+
+
+SIGNING_KEYS = load_signing_keys(os.environ['TOKEN_SIGNING_KEYS'])
+ACTIVE_KEY_ID = next(iter(SIGNING_KEYS))
+
+_revoked_tokens = {'value': None, 'checked_at': 0.0}
+
+# Archive listing is served newest-first from a GSI keyed on a constant
+# partition with uploaded_at as the sort key
+LISTING_INDEX = 'UploadedAtIndex'
+LISTING_PARTITION = 'archive'
+# /files?owner= lists one user's files, also newest first, from a GSI keyed
+# on username, so it costs what that user has rather than the archive
+OWNER_INDEX = 'UserIndex'
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# /search reads postings from the search table's GramIndex (see search.py),
+# kept up to date by upload-complete and delete. A query probes the first
+# page of up to SEARCH_PROBE_GRAMS of its grams and reads at most
+# SEARCH_MAX_CANDIDATES postings; past that, results cover the newest
+# candidates and say they are truncated. Ranked results are cached per
+# query and filters in warm containers, validated like listing pages.
+SEARCH_INDEX = 'GramIndex'
+SEARCH_PROBE_GRAMS = 4
+SEARCH_PROBE_SIZE = 200
+SEARCH_MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', '2000'))
+SEARCH_CACHE_MAX = 64
+SEARCH_ATTRIBUTES = ('file_id', 'filename', 'size', 'uploaded_at', 'username', 'content_type')
+
+# Multipart sizing: start from MULTIPART_PART_SIZE and double it until the
+# file fits in MULTIPART_TARGET_PARTS parts, within S3's part size limits.
+# Fewer, larger parts mean fewer requests and fewer URLs to sign.
+MULTIPART_THRESHOLD = int(os.environ.get('MULTIPART_THRESHOLD', 100 * 1024 * 1024))
+MULTIPART_PART_SIZE = int(os.environ.get('MULTIPART_PART_SIZE', 10 * 1024 * 1024))
+MULTIPART_TARGET_PARTS = int(os.environ.get('MULTIPART_TARGET_PARTS', '1000'))
+MAX_OBJECT_SIZE = 5 * 1024 ** 4  # S3 limit
+
+# Multipart part URLs are handed out in windows as the client progresses,
+# so the /upload response stays the same size whatever the file size
+PART_URL_WINDOW = int(os.environ.get('PART_URL_WINDOW', '64'))
+MAX_PART_NUMBER = 10000  # S3 limit
+
+# Content-addressed storage: files are stored once under blobs/<id>, and the
+# blobs table counts the file records pointing at each blob. A blob's id is
+# what S3 checked its bytes against: the whole-file SHA-256 for single PUTs,
+# and for multipart uploads the composite checksum S3 computes from the
+# verified part checksums (SHA-256 of the parts' digests, as "<hex>-<parts>").
+# Part sizes follow from the file size, so a client that hashes the parts
+# up front knows the id before uploading. Multipart uploads without one keep
+# their own object under file_id and are never handed out as duplicates. So
+# do files without a real hash (e.g. the browser's fallback hash) and
+# records created before blobs existed.
+BLOB_PREFIX = 'blobs/'
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+MULTIPART_BLOB_PATTERN = re.compile(r'^[0-9a-f]{64}-[1-9][0-9]{0,4}$')
+# Releasing a blob's last reference marks its record 'deleting' before the
+# object goes, and no acquire succeeds until the record is gone. A mark
+# older than Lambda's maximum run time was left by a failed release: the
+# next acquire drops it and, like any acquire, checks the object is there.
+BLOB_DELETE_TIMEOUT = 15 * 60
+
+# Batch endpoints take up to MAX_BATCH_ITEMS entries per request
+MAX_BATCH_ITEMS = 100
+# Download batches only read metadata and sign URLs, so they can be larger
+MAX_DOWNLOAD_BATCH = int(os.environ.get('MAX_DOWNLOAD_BATCH', '500'))
+BATCH_GET_SIZE = 100  # DynamoDB BatchGetItem limit
+S3_DELETE_BATCH_SIZE = 1000  # S3 DeleteObjects limit
+
+# Multipart uploads get a session record so an interrupted client can ask
+# which parts S3 already holds and resume. Sessions expire via DynamoDB TTL;
+# the bucket lifecycle rule aborts the matching S3 uploads.
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 7 * 24 * 3600))
+
+# Download URLs are signed as of the start of the current DOWNLOAD_URL_WINDOW
+# and stay valid DOWNLOAD_URL_TTL past its end, so every request for a file
+# within a window gets the same URL (cacheable by browsers and CDNs) and warm
+# containers reuse it instead of signing again. Entries are checked against
+# the archive version like listing pages, so deleted files drop out.
+DOWNLOAD_URL_TTL = 3600  # 1 hour for large files
+DOWNLOAD_URL_WINDOW = int(os.environ.get('DOWNLOAD_URL_WINDOW', 900))
+DOWNLOAD_URL_CACHE_MAX = 4096
+
+_download_urls = {}
+
+# Bundles are ZIPs of many files, streamed into S3 by a separate long-running
+# function (BUNDLE_FUNCTION). Without one (local dev) they are built inline.
+# Job records live in the meta table as 'bundle:<id>' and expire with the
+# bundle object (bucket lifecycle rule on BUNDLE_PREFIX).
+BUNDLE_FUNCTION = os.environ.get('BUNDLE_FUNCTION')
+BUNDLE_PREFIX = 'bundles/'
+BUNDLE_TTL = 24 * 3600
+# The bundler is killed at its timeout without a chance to mark the job
+# failed, so a job still 'running' after BUNDLE_TIMEOUT is reported as timed
+# out. local/bench_bundle.py's modelled S3 run streams about 50 GiB in 900s;
+# the cap leaves half of that as headroom for slower connections and retries.
+BUNDLE_TIMEOUT = int(os.environ.get('BUNDLE_TIMEOUT', 900))
+MAX_BUNDLE_BYTES = int(os.environ.get('MAX_BUNDLE_BYTES', 25 * 1024 ** 3))
+
+def _part_size_adjuster():
+    from s3transfer.utils import ChunksizeAdjuster
+    return ChunksizeAdjuster(max_parts=min(MULTIPART_TARGET_PARTS, MAX_PART_NUMBER))
+
+
+part_size_adjuster = Lazy(_part_size_adjuster)
+
+# Warm containers keep serialized listing pages, validated against an archive
+# version counter that upload-complete and delete bump. The counter itself is
+# re-read at most once per LISTING_CACHE_TTL seconds.
+ARCHIVE_VERSION_KEY = 'archive-version'
+LISTING_CACHE_TTL = float(os.environ.get('LISTING_CACHE_TTL', '5'))
+LISTING_CACHE_MAX_PAGES = 64
+
+# A listing page is the same for as long as the archive version is, so the
+# version is its ETag: a client revalidating with If-None-Match gets a 304
+# without any items being read or serialized. 'no-cache' lets browsers keep
+# pages but makes them revalidate every time.
+LISTING_CACHE_CONTROL = 'private, no-cache'
+
+# Each bump of the archive version also records what changed, as a
+# 'change:<version>' item in the meta table, so /files/changes can bring a
+# client from any version it has seen up to date with only those changes.
+# The records expire (meta table TTL) after CHANGES_RETENTION seconds; a
+# cursor older than that gets a 410 and the client lists /files again.
+CHANGE_KEY_PREFIX = 'change:'
+CHANGES_RETENTION = int(os.environ.get('CHANGES_RETENTION', str(7 * 24 * 3600)))
+CHANGES_PAGE_VERSIONS = 100
+# A version without its record yet is a write still in flight; once a later
+# change is this many seconds old, that writer has failed and it's skipped
+CHANGES_SETTLE = 30
+
+_archive_version = {'value': None, 'checked_at': 0.0}
+_listing_cache = {}
+_search_cache = {}
+
+
+# Routes are declared in ROUTES at the end of this module and dispatched with
+# one dict lookup on (method, path). Each route's handler is wrapped once, at
+# import, in the MIDDLEWARE pipeline: errors are mapped to JSON responses,
+# the bearer token is checked for routes that need it, and the JSON body and
+# query string are decoded, so handlers receive a request whose 'username',
+# 'claims', 'json' and 'query' are ready to use.
+#
+# Per-route latency histograms are kept in process and printed as one
+# structured 'route_latency' line at most every ROUTE_METRICS_INTERVAL seconds.
+ROUTE_METRICS_INTERVAL = float(os.environ.get('ROUTE_METRICS_INTERVAL', '60'))
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization,If-None-Match',
+    'Access-Control-Allow-Methods': 'GET,POST,OPTIONS',
+    'Access-Control-Expose-Headers': 'ETag'
+}
+
+_route_latency = {}
+# Fields handlers add to this invocation's 'request' log line (cache outcomes)
+_request_notes = {}
+_route_metrics = {'flushed_at': time.monotonic()}
+
+
+class HttpError(Exception):
+    """Raised to answer a request with an error status and {'error': message, **extra}"""
+
+    def __init__(self, status, message, **extra):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.extra = extra
+
+
+def map_errors(route, call):
+    """Turn HttpErrors into their responses and anything else into a 500"""
+    def handle(request, headers):
+        try:
+            return call(request, headers)
+        except HttpError as e:
+            return {'statusCode': e.status, 'headers': headers, 'body': json.dumps(dict({'error': e.message}, **e.extra))}
+        except Exception as e:
+            print(json.dumps({'unhandled_error': {'route': route['name'], 'type': type(e).__name__, 'message': str(e)}}))
+            return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+    return handle
+
+
+def authenticate(route, call):
+    """Reject requests without a valid bearer token on routes that need one"""
+    if not route['auth']:
+        return call
+    
+    def handle(request, headers):
+        claims = read_token_claims(request)
+        if not claims:
+            raise HttpError(401, 'Unauthorized')
+        request['claims'] = claims
+        request['username'] = claims['sub']
+        return call(request, headers)
+    return handle
+
 
-users_table = dynamodb.Table(USERS_TABLE)
-files_table = dynamodb.Table(FILES_TABLE)
+def decode_request(route, call):
+    """Parse the JSON body (for routes that take one) and default the query string to {}"""
+    def handle(request, headers):
+        request['query'] = request.get('queryStringParameters') or {}
+        if route['body']:
+            raw = request.get('body') or '{}'
+            if request.get('isBase64Encoded'):
+                raw = base64.b64decode(raw)
+            try:
+                body = json.loads(raw)
+            except ValueError:
+                raise HttpError(400, 'Invalid JSON body')
+            if not isinstance(body, dict):
+                raise HttpError(400, 'Request body must be a JSON object')
+            request['json'] = body
+        return call(request, headers)
+    return handle
+
+
+# Outermost first
+MIDDLEWARE = [map_errors, authenticate, decode_request]
+
+
+def build_routes(table):
+    """{(method, path): route} from (method, path, handler, options) rows, each handler wrapped in MIDDLEWARE"""
+    routes = {}
+    for method, path, handler, options in table:
+        route = {'name': f'{method} {path}', 'auth': options.get('auth', True), 'body': options.get('body', method == 'POST')}
+        call = handler
+        for middleware in reversed(MIDDLEWARE):
+            call = middleware(route, call)
+        route['call'] = call
+        routes[(method, path)] = route
+    return routes
+
+
+def record_route_latency(name, elapsed_ms, status):
+    """Add one request to its route's histogram and flush all of them once the interval is up"""
+    histogram = _route_latency.get(name)
+    if histogram is None:
+        histogram = _route_latency[name] = LatencyHistogram()
+    histogram.record(elapsed_ms, error=status >= 500)
+    
+    now = time.monotonic()
+    if now - _route_metrics['flushed_at'] >= ROUTE_METRICS_INTERVAL:
+        flush_route_latency(now)
+
+
+def flush_route_latency(now=None):
+    """Print every route's latency summary as one structured log line and start new histograms"""
+    now = time.monotonic() if now is None else now
+    if _route_latency:
+        print(json.dumps({'route_latency': {
+            'interval_s': round(now - _route_metrics['flushed_at'], 1),
+            'routes': {name: histogram.summary() for name, histogram in sorted(_route_latency.items())}
+        }}))
+    _route_latency.clear()
+    _route_metrics['flushed_at'] = now
 
 
 def lambda_handler(event, context):
     """Main Lambda handler routing requests"""
-    path = event.get('path', '')
     method = event.get('httpMethod', '')
-    
-    # CORS headers
-    headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-        'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
-    }
+    headers = dict(CORS_HEADERS)
     
     if method == 'OPTIONS':
         return {'statusCode': 200, 'headers': headers, 'body': ''}
     
-    try:
-        if path == '/login' and method == 'POST':
-            return handle_login(event, headers)
-        elif path == '/files' and method == 'GET':
-            return handle_list_files(event, headers)
-        elif path == '/upload' and method == 'POST':
-            return handle_upload(event, headers)
-        elif path == '/upload-complete' and method == 'POST':
-            return handle_upload_complete(event, headers)
-        elif path == '/check-duplicate' and method == 'POST':
-            return handle_check_duplicate(event, headers)
-        elif path == '/download' and method == 'GET':
-            return handle_download(event, headers)
-        elif path == '/delete' and method == 'POST':
-            return handle_delete(event, headers)
-        else:
-            return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Not found'})}
-    except Exception as e:
-        return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+    route = ROUTES.get((method, event.get('path', '')))
+    if not route:
+        return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Not found'})}
+    
+    started = time.perf_counter()
+    _request_notes.clear()
+    aws_calls.start(trace=random.random() < AWS_TRACE_SAMPLE_RATE)
+    # Middleware annotates its own copy, never the caller's event
+    response = route['call'](dict(event), headers)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    log_request(route['name'], response['statusCode'], elapsed_ms, context)
+    record_route_latency(route['name'], elapsed_ms, response['statusCode'])
+    return response
+
+
+def log_request(name, status, elapsed_ms, context):
+    """One structured line per invocation: status, time, and where the time went in AWS calls"""
+    aws = aws_calls.summary()
+    line = {
+        'route': name,
+        'status': status,
+        'ms': round(elapsed_ms, 3),
+        # Time outside AWS calls: signing, hashing, JSON encoding
+        'local_ms': round(max(elapsed_ms - aws['ms'], 0), 3),
+        'aws': aws
+    }
+    line.update(_request_notes)
+    _request_notes.clear()
+    request_id = getattr(context, 'aws_request_id', None)
+    if request_id:
+        line['request_id'] = request_id
+    trace = aws_calls.trace()
+    if trace is not None:
+        line['trace'] = trace
+    print(json.dumps({'request': line}))
+
+
+def note_request(**fields):
+    """Add fields to this invocation's 'request' log line"""
+    _request_notes.update(fields)
 
 
 def handle_login(event, headers):
     """Authenticate user"""
-    body = json.loads(event.get('body', '{}'))
+    body = event['json']
     username = body.get('username')
     password = body.get('password')
     
@@ -72,84 +465,525 @@ def handle_login(event, headers):
     if not user or user['password_hash'] != password_hash:
         return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Invalid credentials'})}
     
-    # Simple token (in production, use JWT)
-    token = base64.b64encode(f"{username}:{password_hash}".encode()).decode()
+    token = issue_token(username)
     
     return {
         'statusCode': 200,
         'headers': headers,
-        'body': json.dumps({'token': token, 'username': username})
+        'body': json.dumps({'token': token, 'username': username, 'expires_in': TOKEN_TTL})
+    }
+
+
+def b64url_encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def b64url_decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def sign_payload(payload, key):
+    return b64url_encode(hmac.new(key, payload.encode(), hashlib.sha256).digest())
+
+
+def issue_token(username):
+    """Create a signed session token for username"""
+    now = int(time.time())
+    claims = {
+        'sub': username,
+        'iat': now,
+        'exp': now + TOKEN_TTL,
+        'jti': secrets.token_urlsafe(12),
+        'kid': ACTIVE_KEY_ID
     }
+    payload = b64url_encode(json.dumps(claims, separators=(',', ':')).encode())
+    return f"{payload}.{sign_payload(payload, SIGNING_KEYS[ACTIVE_KEY_ID])}"
+
+
+def decode_token(token):
+    """Return the claims of a correctly signed, unexpired token, else None"""
+    try:
+        payload, signature = token.split('.')
+        claims = json.loads(b64url_decode(payload))
+        key = SIGNING_KEYS.get(claims.get('kid'))
+        if not key or not hmac.compare_digest(signature, sign_payload(payload, key)):
+            return None
+        if claims['exp'] <= time.time():
+            return None
+        return claims
+    except Exception:
+        return None
+
 
+def get_revoked_tokens():
+    """Revoked token ids ({jti: exp}), re-read from DynamoDB once the local copy is older than the TTL"""
+    now = time.monotonic()
+    if _revoked_tokens['value'] is not None and now - _revoked_tokens['checked_at'] < REVOCATION_CACHE_TTL:
+        return _revoked_tokens['value']
+    
+    response = meta_table.get_item(Key={'name': REVOKED_TOKENS_KEY})
+    item = response.get('Item') or {}
+    
+    revoked = {}
+    for entry in item.get('tokens', set()):
+        jti, _, exp = entry.rpartition(':')
+        revoked[jti] = int(exp)
+    
+    _revoked_tokens['value'] = revoked
+    _revoked_tokens['checked_at'] = now
+    return revoked
+
+
+def revoke_token(claims):
+    """Add a token to the shared revocation list, pruning entries that have expired anyway"""
+    meta_table.update_item(
+        Key={'name': REVOKED_TOKENS_KEY},
+        UpdateExpression='ADD tokens :entry',
+        ExpressionAttributeValues={':entry': {f"{claims['jti']}:{claims['exp']}"}}
+    )
+    
+    revoked = get_revoked_tokens()
+    expired = {f"{jti}:{exp}" for jti, exp in revoked.items() if exp <= time.time()}
+    if expired:
+        meta_table.update_item(
+            Key={'name': REVOKED_TOKENS_KEY},
+            UpdateExpression='DELETE tokens :expired',
+            ExpressionAttributeValues={':expired': expired}
+        )
+        for entry in expired:
+            revoked.pop(entry.rpartition(':')[0], None)
+    revoked[claims['jti']] = claims['exp']
 
-def verify_token(event):
-    """Verify authentication token"""
-    headers = event.get('headers', {})
+
+def read_token_claims(event):
+    """Claims of the bearer token on the request, or None if it is missing, invalid or revoked"""
+    headers = event.get('headers') or {}
     # API Gateway may lowercase headers
     auth_header = headers.get('Authorization') or headers.get('authorization', '')
     if not auth_header.startswith('Bearer '):
         return None
     
-    token = auth_header[7:]
-    try:
-        decoded = base64.b64decode(token).decode()
-        username, password_hash = decoded.split(':', 1)
-        
-        response = users_table.get_item(Key={'username': username})
-        user = response.get('Item')
-        
-        if user and user['password_hash'] == password_hash:
-            return username
-    except:
-        pass
+    claims = decode_token(auth_header[7:])
+    if not claims:
+        return None
+    if TOKEN_REVOCATION and claims['jti'] in get_revoked_tokens():
+        return None
+    return claims
+
+
+def handle_logout(event, headers):
+    """Revoke the caller's session token"""
+    if TOKEN_REVOCATION:
+        revoke_token(event['claims'])
     
-    return None
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({'status': 'success'})
+    }
+
+
+def encode_cursor(last_key):
+    """Turn a low-level DynamoDB LastEvaluatedKey into an opaque pagination cursor"""
+    return base64.urlsafe_b64encode(json.dumps(decode_item(last_key), separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor, attribute='listing', value=LISTING_PARTITION):
+    """Turn a pagination cursor back into a low-level ExclusiveStartKey within the partition attribute = value.
+
+    The key must be exactly what the index returns as LastEvaluatedKey
+    (table key, index range key, partition), all strings; anything else
+    raises ValueError instead of reaching DynamoDB.
+    """
+    key = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    if (
+        not isinstance(key, dict)
+        or set(key) != {'file_id', 'uploaded_at', attribute}
+        or not all(isinstance(part, str) for part in key.values())
+        or key[attribute] != value
+    ):
+        raise ValueError('Invalid cursor')
+    return encode_item(key)
+
+
+def get_archive_version():
+    """Current archive version, re-read from DynamoDB once the local copy is older than the TTL"""
+    now = time.monotonic()
+    if _archive_version['value'] is not None and now - _archive_version['checked_at'] < LISTING_CACHE_TTL:
+        return _archive_version['value']
+    
+    response = meta_table.get_item(Key={'name': ARCHIVE_VERSION_KEY}, ConsistentRead=True)
+    item = response.get('Item')
+    
+    _archive_version['value'] = int(item['version']) if item else 0
+    _archive_version['checked_at'] = now
+    return _archive_version['value']
+
+
+def bump_archive_version(changes):
+    """Invalidate listing caches everywhere after the archive changed, and log the changes under the new version"""
+    response = meta_table.update_item(
+        Key={'name': ARCHIVE_VERSION_KEY},
+        UpdateExpression='ADD version :one',
+        ExpressionAttributeValues={':one': 1},
+        ReturnValues='UPDATED_NEW'
+    )
+    _listing_cache.clear()
+    _search_cache.clear()
+    version = int(response['Attributes']['version'])
+    _archive_version['value'] = version
+    _archive_version['checked_at'] = time.monotonic()
+    
+    # Written even when empty: a missing version reads as a write in flight
+    now = int(time.time())
+    meta_table.put_item(Item={
+        'name': f'{CHANGE_KEY_PREFIX}{version}',
+        'changes': changes,
+        'changed_at': now,
+        'expires_at': now + CHANGES_RETENTION
+    })
+
+
+def file_added(record):
+    """Change log entry for a file record that was written"""
+    return {
+        'op': 'add',
+        'file_id': record['file_id'],
+        'file': {
+            'file_id': record['file_id'],
+            'filename': record['filename'],
+            'size': record['size'],
+            'uploaded_at': record['uploaded_at'],
+            'uploaded_by': record['username'],
+            'content_type': record['content_type']
+        }
+    }
+
+
+def file_removed(file_id):
+    """Change log entry (tombstone) for a file record that was deleted"""
+    return {'op': 'remove', 'file_id': file_id}
+
+
+def listing_etag(version):
+    """Strong validator for listing pages at an archive version"""
+    return f'"archive-{version}"'
+
+
+def etag_matches(event, etag):
+    """Whether the request's If-None-Match names etag (or *)"""
+    headers = event.get('headers') or {}
+    # API Gateway may lowercase headers
+    condition = headers.get('If-None-Match') or headers.get('if-none-match')
+    if not condition:
+        return False
+    # If-None-Match compares weakly
+    candidates = [candidate.strip() for candidate in condition.split(',')]
+    return '*' in candidates or any(candidate.removeprefix('W/') == etag for candidate in candidates)
 
 
 def handle_list_files(event, headers):
-    """List all files (shared archive)"""
-    username = verify_token(event)
-    if not username:
-        return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Unauthorized'})}
-    
-    # Scan all files (shared archive - everyone sees everything)
-    response = files_table.scan()
-    
-    files = []
-    for item in response.get('Items', []):
-        files.append({
-            'file_id': item['file_id'],
-            'filename': item['filename'],
-            'size': int(item['size']),
-            'uploaded_at': item['uploaded_at'],
-            'uploaded_by': item['username'],  # Show who uploaded it
-            'content_type': item.get('content_type', 'application/octet-stream')
-        })
+    """List one page of files (shared archive, or one owner's with ?owner=), newest first"""
+    params = event['query']
+    try:
+        limit = int(params.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Invalid limit'})}
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    cursor = params.get('cursor')
+    owner = params.get('owner')
+    
+    # Read the version before the items so a concurrent write can only
+    # cause an extra miss, never a stale page cached under a new version
+    version = get_archive_version()
+    page_headers = dict(headers, **{'ETag': listing_etag(version), 'Cache-Control': LISTING_CACHE_CONTROL})
+    if etag_matches(event, page_headers['ETag']):
+        note_request(listing_cache='not_modified')
+        return {'statusCode': 304, 'headers': page_headers, 'body': ''}
+    
+    cache_key = (owner, limit, cursor)
+    cached = _listing_cache.get(cache_key)
+    if cached and cached['version'] == version:
+        note_request(listing_cache='hit')
+        return {'statusCode': 200, 'headers': dict(page_headers, **{'X-Listing-Cache': 'hit'}), 'body': cached['body']}
+    note_request(listing_cache='miss')
+    
+    # One Query per page; the index returns items already sorted by upload date
+    partition = ('username', owner) if owner else ('listing', LISTING_PARTITION)
+    query = {
+        'TableName': FILES_TABLE,
+        'IndexName': OWNER_INDEX if owner else LISTING_INDEX,
+        'KeyConditionExpression': f'{partition[0]} = :partition',
+        'ExpressionAttributeValues': {':partition': {'S': partition[1]}},
+        'ProjectionExpression': 'file_id, filename, #size, uploaded_at, username, content_type',
+        'ExpressionAttributeNames': {'#size': 'size'},
+        'ScanIndexForward': False,
+        'Limit': limit
+    }
+    
+    if cursor:
+        try:
+            query['ExclusiveStartKey'] = decode_cursor(cursor, *partition)
+        except Exception:
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Invalid cursor'})}
+    
+    response = dynamodb_client.query(**query)
+    files = [listing_entry(item) for item in response.get('Items', [])]
+    
+    last_key = response.get('LastEvaluatedKey')
+    body = json.dumps({
+        'files': files,
+        'next_cursor': encode_cursor(last_key) if last_key else None
+    })
     
-    # Sort by upload date (newest first)
-    files.sort(key=lambda x: x['uploaded_at'], reverse=True)
+    if len(_listing_cache) >= LISTING_CACHE_MAX_PAGES:
+        _listing_cache.pop(next(iter(_listing_cache)))
+    _listing_cache[cache_key] = {'version': version, 'body': body}
     
     return {
         'statusCode': 200,
-        'headers': headers,
-        'body': json.dumps({'files': files})
+        'headers': dict(page_headers, **{'X-Listing-Cache': 'miss'}),
+        'body': body
+    }
+
+
+def encode_changes_cursor(version, at):
+    """Opaque /files/changes cursor: the archive version a client has seen, and since when its changes are kept"""
+    return base64.urlsafe_b64encode(json.dumps({'v': version, 'at': at}, separators=(',', ':')).encode()).decode()
+
+
+def decode_changes_cursor(cursor):
+    """(version, at) back from a /files/changes cursor"""
+    position = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    if not isinstance(position, dict) or not isinstance(position.get('v'), int) or not isinstance(position.get('at'), int):
+        raise ValueError('Invalid cursor')
+    return position['v'], position['at']
+
+
+def handle_list_changes(event, headers):
+    """Files added and removed since a cursor, oldest first, with the cursor to continue from"""
+    since = event['query'].get('since')
+    version = get_archive_version()
+    now = int(time.time())
+    # Back-date fresh cursors past the version cache and settle window, so
+    # changes written meanwhile can't expire before the cursor does
+    fresh_at = now - int(LISTING_CACHE_TTL) - CHANGES_SETTLE
+    
+    if not since:
+        # Where a sync starts: take a cursor, then list /files, then follow it
+        body = {'changes': [], 'cursor': encode_changes_cursor(version, fresh_at), 'has_more': False}
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(body)}
+    
+    try:
+        seen, at = decode_changes_cursor(since)
+    except Exception:
+        raise HttpError(400, 'Invalid cursor')
+    if now - at > CHANGES_RETENTION:
+        raise HttpError(410, 'Cursor expired, list /files again', resync=True)
+    if seen >= version:
+        # Nothing new, or a version this container hasn't seen yet
+        body = {'changes': [], 'cursor': encode_changes_cursor(seen, max(at, fresh_at)), 'has_more': False}
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(body)}
+    
+    last = min(version, seen + CHANGES_PAGE_VERSIONS)
+    records = {
+        item['name']: item
+        for item in batch_get_items(
+            META_TABLE,
+            [{'name': f'{CHANGE_KEY_PREFIX}{number}'} for number in range(seen + 1, last + 1)],
+            ConsistentRead=True
+        )
+    }
+    logged = [records.get(f'{CHANGE_KEY_PREFIX}{number}') for number in range(seen + 1, last + 1)]
+    
+    # Compact as we go: a file's last change is the one that counts, in the
+    # order of that change
+    latest = {}
+    position = seen
+    for index, record in enumerate(logged):
+        if record is None:
+            settled = any(later and later['changed_at'] < now - CHANGES_SETTLE for later in logged[index + 1:])
+            if not settled:
+                break
+        else:
+            for change in record['changes']:
+                latest.pop(change['file_id'], None)
+                latest[change['file_id']] = change
+            at = record['changed_at']
+        position = seen + index + 1
+    
+    if position == version:
+        at = max(at, fresh_at)
+    body = {
+        'changes': list(latest.values()),
+        'cursor': encode_changes_cursor(position, at),
+        'has_more': position == last < version
+    }
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps(body)}
+
+
+def search_postings(record):
+    """The search table items that index one file record"""
+    entry = {name: record[name] for name in SEARCH_ATTRIBUTES if name in record}
+    return [
+        dict(entry, posting=posting_key(gram, record['file_id']), gram=gram)
+        for gram in filename_grams(record['filename'])
+    ]
+
+
+def index_files(records):
+    """Add file records to the search index"""
+    with search_table.batch_writer(overwrite_by_pkeys=['posting']) as batch:
+        for record in records:
+            for posting in search_postings(record):
+                batch.put_item(Item=posting)
+
+
+def unindex_files(items):
+    """Remove files (with file_id and filename) from the search index"""
+    with search_table.batch_writer(overwrite_by_pkeys=['posting']) as batch:
+        for item in items:
+            for gram in filename_grams(item['filename']):
+                batch.delete_item(Key={'posting': posting_key(gram, item['file_id'])})
+
+
+def search_candidates(query):
+    """Postings, newest first, of the sparsest gram probed for a normalized query.
+
+    Returns (low-level items, complete, grams probed); complete is False when
+    the list was cut off at SEARCH_MAX_CANDIDATES.
+    """
+    request = {
+        'TableName': SEARCH_TABLE,
+        'IndexName': SEARCH_INDEX,
+        'KeyConditionExpression': 'gram = :gram',
+        'ProjectionExpression': 'file_id, filename, #size, uploaded_at, username, content_type',
+        'ExpressionAttributeNames': {'#size': 'size'},
+        'ScanIndexForward': False,
+    }
+    sparsest = None
+    grams = query_grams(query, SEARCH_PROBE_GRAMS)
+    for probed, gram in enumerate(grams, 1):
+        response = dynamodb_client.query(
+            ExpressionAttributeValues={':gram': {'S': gram}}, Limit=SEARCH_PROBE_SIZE, **request
+        )
+        items, last_key = response.get('Items', []), response.get('LastEvaluatedKey')
+        if not last_key or not items:
+            # The whole list: every match is in it
+            return items, True, probed
+        # The page reaching furthest back in time belongs to the rarest gram
+        reach = items[-1]['uploaded_at']['S']
+        if sparsest is None or reach < sparsest[0]:
+            sparsest = (reach, gram, items, last_key)
+    
+    _, gram, items, last_key = sparsest
+    while last_key and len(items) < SEARCH_MAX_CANDIDATES:
+        response = dynamodb_client.query(
+            ExpressionAttributeValues={':gram': {'S': gram}}, Limit=SEARCH_MAX_CANDIDATES - len(items),
+            ExclusiveStartKey=last_key, **request
+        )
+        items.extend(response.get('Items', []))
+        last_key = response.get('LastEvaluatedKey')
+    return items, not last_key, len(grams)
+
+
+def handle_search(event, headers):
+    """Search the archive by filename substring, ranked then newest first, one page at a time.
+
+    Optional filters: uploader, content_type (exact, or a type like 'video/'),
+    min_size and max_size in bytes. The cursor is an offset into the results.
+    """
+    params = event['query']
+    query = normalize(params.get('q', ''))
+    if not query:
+        raise HttpError(400, 'Missing q')
+    try:
+        limit = max(1, min(int(params.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+        offset = max(0, int(params.get('cursor') or 0))
+        min_size = int(params['min_size']) if params.get('min_size') else None
+        max_size = int(params['max_size']) if params.get('max_size') else None
+    except ValueError:
+        raise HttpError(400, 'limit, cursor, min_size and max_size must be integers')
+    uploader = params.get('uploader') or None
+    content_type = params.get('content_type') or None
+    
+    # Read the version before the postings, as for listing pages
+    version = get_archive_version()
+    cache_key = (query, uploader, content_type, min_size, max_size)
+    cached = _search_cache.get(cache_key)
+    if not cached or cached['version'] != version:
+        items, complete, probed = search_candidates(query)
+        ranked = []
+        for item in items:
+            entry = listing_entry(item)
+            rank = match_rank(entry['filename'], query)
+            if rank is None:
+                continue
+            if uploader and entry['uploaded_by'] != uploader:
+                continue
+            if content_type and entry['content_type'] != content_type and not (
+                    content_type.endswith('/') and entry['content_type'].startswith(content_type)):
+                continue
+            if (min_size is not None and entry['size'] < min_size) or (max_size is not None and entry['size'] > max_size):
+                continue
+            ranked.append((rank, entry))
+        # Stable, so each rank stays newest first
+        ranked.sort(key=lambda match: match[0])
+        
+        cached = {'version': version, 'files': [entry for _, entry in ranked], 'truncated': not complete}
+        if len(_search_cache) >= SEARCH_CACHE_MAX:
+            _search_cache.pop(next(iter(_search_cache)))
+        _search_cache[cache_key] = cached
+        print(json.dumps({'search': {
+            'grams_probed': probed, 'candidates': len(items), 'matches': len(ranked), 'truncated': not complete
+        }}))
+        cache_status = 'miss'
+    else:
+        cache_status = 'hit'
+    
+    files = cached['files']
+    end = offset + limit
+    return {
+        'statusCode': 200,
+        'headers': dict(headers, **{'X-Search-Cache': cache_status}),
+        'body': json.dumps({
+            'files': files[offset:end],
+            'total': len(files),
+            'truncated': cached['truncated'],
+            'next_cursor': str(end) if end < len(files) else None
+        })
     }
 
 
 def handle_upload(event, headers):
     """Generate presigned URLs for direct S3 upload (simple or multipart)"""
-    username = verify_token(event)
-    if not username:
-        return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Unauthorized'})}
-    
-    body = json.loads(event.get('body', '{}'))
+    username = event['username']
+    body = event['json']
     files = body.get('files', [])
     
     if not files:
         return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'No files provided'})}
     
-    # Multipart threshold: 100MB
-    MULTIPART_THRESHOLD = 100 * 1024 * 1024
+    # Check the whole batch first, so a bad entry can't leave multipart
+    # uploads already created for the ones before it
+    for file_info in files:
+        filename = file_info.get('filename')
+        if not filename:
+            continue
+        
+        if file_info.get('size', 0) > MAX_OBJECT_SIZE:
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'File too large: {filename}'})}
+        
+        # S3 verifies the bytes against this hash, so it has to be a real SHA-256
+        file_hash = file_info.get('file_hash')
+        if not file_hash or not SHA256_PATTERN.match(file_hash):
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'file_hash must be a SHA-256 hex digest: {filename}'})}
+        
+        multipart_checksum = file_info.get('multipart_checksum')
+        if multipart_checksum is not None and not (
+            isinstance(multipart_checksum, str) and MULTIPART_BLOB_PATTERN.match(multipart_checksum)
+        ):
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'multipart_checksum must be "<SHA-256 hex>-<parts>": {filename}'})}
     
     upload_urls = []
     
@@ -157,42 +991,62 @@ def handle_upload(event, headers):
         filename = file_info.get('filename')
         content_type = file_info.get('content_type', 'application/octet-stream')
         file_size = file_info.get('size', 0)
+        file_hash = file_info.get('file_hash')
         
         if not filename:
             continue
         
         # Generate unique file ID
         file_id = f"{username}/{datetime.utcnow().isoformat()}_{filename}"
+        if file_size <= MULTIPART_THRESHOLD:
+            blob_key = storage_key(file_id, file_hash)
+        else:
+            part_size = choose_part_size(file_size)
+            num_parts = (file_size + part_size - 1) // part_size
+            # Large files go on the blob named by their composite checksum,
+            # if the client computed it over the parts this upload uses
+            if file_info.get('multipart_checksum') and file_info.get('part_size') == part_size:
+                blob_key = f"{BLOB_PREFIX}{file_info['multipart_checksum']}"
+            else:
+                blob_key = file_id
+        
+        # Content already stored: the client only needs to call /upload-complete
+        if blob_key != file_id and blob_exists(blob_id(blob_key)):
+            upload_urls.append({
+                'filename': filename,
+                'file_id': file_id,
+                'upload_type': 'duplicate',
+                'content_type': content_type
+            })
+            continue
         
-        # Use multipart upload for large files
+        # Use multipart upload for large files; finalize_upload checks the
+        # parts add up to the blob's name before completing onto it
         if file_size > MULTIPART_THRESHOLD:
             # Initiate multipart upload
             multipart = s3.create_multipart_upload(
                 Bucket=BUCKET_NAME,
-                Key=file_id,
-                ContentType=content_type
+                Key=blob_key,
+                ContentType=content_type,
+                ChecksumAlgorithm='SHA256'
             )
             
             upload_id = multipart['UploadId']
             
-            # Calculate part size (10MB chunks)
-            part_size = 10 * 1024 * 1024
-            num_parts = (file_size + part_size - 1) // part_size
-            
-            # Generate presigned URLs for each part
-            part_urls = []
-            for part_num in range(1, num_parts + 1):
-                part_url = s3.generate_presigned_url(
-                    'upload_part',
-                    Params={
-                        'Bucket': BUCKET_NAME,
-                        'Key': file_id,
-                        'UploadId': upload_id,
-                        'PartNumber': part_num
-                    },
-                    ExpiresIn=3600
-                )
-                part_urls.append(part_url)
+            uploads_table.put_item(Item={
+                'upload_id': upload_id,
+                'file_id': file_id,
+                'blob_key': blob_key,
+                'username': username,
+                'filename': filename,
+                'size': file_size,
+                'content_type': content_type,
+                'part_size': part_size,
+                'num_parts': num_parts,
+                'checksum_algorithm': 'SHA256',
+                'created_at': datetime.utcnow().isoformat(),
+                'expires_at': int(time.time()) + UPLOAD_SESSION_TTL
+            })
             
             upload_urls.append({
                 'filename': filename,
@@ -200,17 +1054,24 @@ def handle_upload(event, headers):
                 'upload_type': 'multipart',
                 'upload_id': upload_id,
                 'part_size': part_size,
-                'part_urls': part_urls,
+                'num_parts': num_parts,
+                # Part URLs are signed with each part's checksum, so they all
+                # come from /upload-parts once the client has hashed the parts
+                'part_urls': [],
+                'part_url_window': PART_URL_WINDOW,
+                'checksum_algorithm': 'SHA256',
                 'content_type': content_type
             })
         else:
-            # Simple upload for smaller files
-            presigned_url = s3.generate_presigned_url(
+            # Simple upload for smaller files; S3 rejects bytes that don't match the checksum
+            checksum = sha256_base64(file_hash)
+            presigned_url = presigner.generate_presigned_url(
                 'put_object',
                 Params={
                     'Bucket': BUCKET_NAME,
-                    'Key': file_id,
-                    'ContentType': content_type
+                    'Key': blob_key,
+                    'ContentType': content_type,
+                    'ChecksumSHA256': checksum
                 },
                 ExpiresIn=3600
             )
@@ -220,6 +1081,7 @@ def handle_upload(event, headers):
                 'file_id': file_id,
                 'upload_type': 'simple',
                 'upload_url': presigned_url,
+                'checksum_sha256': checksum,
                 'content_type': content_type
             })
     
@@ -230,27 +1092,298 @@ def handle_upload(event, headers):
     }
 
 
+def storage_key(file_id, file_hash):
+    """S3 key holding a file's bytes: its blob if the hash is a real SHA-256, else its own key"""
+    if file_hash and SHA256_PATTERN.match(file_hash):
+        return f"{BLOB_PREFIX}{file_hash}"
+    return file_id
+
+
+def blob_id(blob_key):
+    """A blob's key in the blobs table, from its object key"""
+    return blob_key[len(BLOB_PREFIX):]
+
+
+def is_blob_id(value):
+    """Whether value can name a blob: a SHA-256 or a multipart composite checksum"""
+    return isinstance(value, str) and bool(SHA256_PATTERN.match(value) or MULTIPART_BLOB_PATTERN.match(value))
+
+
+def sha256_base64(file_hash):
+    """Hex SHA-256 as the base64 value S3 uses for x-amz-checksum-sha256"""
+    return base64.b64encode(bytes.fromhex(file_hash)).decode('ascii')
+
+
+def blob_checksum(blob):
+    """The ChecksumSHA256 S3 reports for a blob's object, from the blob's id"""
+    digest, _, parts = blob.partition('-')
+    return f"{sha256_base64(digest)}-{parts}" if parts else sha256_base64(digest)
+
+
+def composite_blob_id(checksums):
+    """Blob id of a multipart object from its parts' base64 SHA-256s, as S3 composes them"""
+    digest = hashlib.sha256(b''.join(base64.b64decode(checksum) for checksum in checksums)).hexdigest()
+    return f"{digest}-{len(checksums)}"
+
+
+def is_sha256_base64(checksum):
+    try:
+        return len(base64.b64decode(checksum, validate=True)) == 32
+    except (TypeError, ValueError):
+        return False
+
+
+def blob_exists(file_hash):
+    """Whether a blob is stored and referenced; one being deleted doesn't count"""
+    response = blobs_table.get_item(Key={'file_hash': file_hash})
+    item = response.get('Item')
+    return bool(item) and item['ref_count'] > 0 and 'deleting' not in item
+
+
+def acquire_blob(file_hash, blob_key, size, file_id):
+    """Count file_id as a reference to a blob, then make sure its bytes are really there.
+
+    Returns the blob's HEAD response, including S3's stored checksum, and
+    raises HttpError(409) while the blob is being deleted.
+
+    Each blob keeps the set of file_ids referencing it next to the count, and
+    both updates are conditional on membership, so a retried or concurrent
+    acquire/release for the same file never counts twice. The count is also
+    conditional on the blob not being marked 'deleting' by release_blob,
+    which only deletes the object once marked and the record after that: an
+    acquire either counts before the mark, so the release leaves the blob
+    alone, or after the record is gone, and then the HEAD sees whether the
+    object survived.
+    """
+    for _ in range(2):
+        try:
+            blobs_table.update_item(
+                Key={'file_hash': file_hash},
+                UpdateExpression='ADD ref_count :one, refs :ref SET blob_key = :key, #size = :size',
+                ConditionExpression='NOT contains(refs, :file_id) AND attribute_not_exists(deleting)',
+                ExpressionAttributeNames={'#size': 'size'},
+                ExpressionAttributeValues={':one': 1, ':ref': {file_id}, ':file_id': file_id, ':key': blob_key, ':size': size}
+            )
+            break
+        except blobs_table.meta.client.exceptions.ConditionalCheckFailedException:
+            item = blobs_table.get_item(Key={'file_hash': file_hash}, ConsistentRead=True).get('Item')
+            if item and file_id in item.get('refs', ()):
+                # Already counted
+                break
+            if item and 'deleting' in item:
+                if time.time() - int(item['deleting']) < BLOB_DELETE_TIMEOUT:
+                    raise HttpError(409, 'Stored copy is being deleted, upload the file again')
+                drop_blob_record(file_hash, item['deleting'])
+            # The record changed in between; count again
+    else:
+        raise HttpError(409, 'Stored copy is being deleted, upload the file again')
+    try:
+        return s3.head_object(Bucket=BUCKET_NAME, Key=blob_key, ChecksumMode='ENABLED')
+    except Exception:
+        release_blob(file_hash, blob_key, file_id)
+        raise
+
+
+def release_blob(file_hash, blob_key, file_id):
+    """Drop file_id's reference to a blob, deleting the object and then the record at zero"""
+    try:
+        response = blobs_table.update_item(
+            Key={'file_hash': file_hash},
+            UpdateExpression='ADD ref_count :minus_one DELETE refs :ref',
+            ConditionExpression='contains(refs, :file_id)',
+            ExpressionAttributeValues={':minus_one': -1, ':ref': {file_id}, ':file_id': file_id},
+            ReturnValues='UPDATED_NEW'
+        )
+    except blobs_table.meta.client.exceptions.ConditionalCheckFailedException:
+        # Already released
+        return
+    if response['Attributes']['ref_count'] > 0:
+        return
+    
+    marked = int(time.time())
+    try:
+        blobs_table.update_item(
+            Key={'file_hash': file_hash},
+            UpdateExpression='SET deleting = :marked',
+            ConditionExpression='attribute_not_exists(refs) AND attribute_not_exists(deleting)',
+            ExpressionAttributeValues={':marked': marked}
+        )
+    except blobs_table.meta.client.exceptions.ConditionalCheckFailedException:
+        # Referenced again in the meantime, or already being deleted
+        return
+    s3.delete_object(Bucket=BUCKET_NAME, Key=blob_key)
+    drop_blob_record(file_hash, marked)
+
+
+def drop_blob_record(file_hash, marked):
+    """Delete a blob record marked 'deleting' at `marked`, letting acquires in again"""
+    try:
+        blobs_table.delete_item(
+            Key={'file_hash': file_hash},
+            ConditionExpression='deleting = :marked',
+            ExpressionAttributeValues={':marked': marked}
+        )
+    except blobs_table.meta.client.exceptions.ConditionalCheckFailedException:
+        # Already dropped
+        pass
+
+
+def load_upload_session(upload_id):
+    """Multipart upload session, or None if unknown or expired (TTL deletion is lazy)"""
+    response = uploads_table.get_item(Key={'upload_id': upload_id})
+    session = response.get('Item')
+    if not session or session['expires_at'] <= time.time():
+        return None
+    return session
+
+
+def choose_part_size(file_size):
+    """Part size for a multipart upload of file_size bytes"""
+    return part_size_adjuster.adjust_chunksize(MULTIPART_PART_SIZE, file_size)
+
+
+def presign_part_urls(key, upload_id, first_part, count, checksums=None):
+    """Presigned upload_part URLs for parts first_part .. first_part + count - 1"""
+    return presigner.presign_parts(
+        BUCKET_NAME, key, upload_id, range(first_part, first_part + count), expires_in=3600, checksums=checksums
+    )
+
+
+def handle_upload_parts(event, headers):
+    """Issue the next window of presigned part URLs for a multipart upload"""
+    username = event['username']
+    body = event['json']
+    upload_id = body.get('upload_id')
+    
+    if not upload_id:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing upload_id'})}
+    
+    session = load_upload_session(upload_id)
+    if not session:
+        return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Upload not found'})}
+    
+    if session['username'] != username:
+        return {'statusCode': 403, 'headers': headers, 'body': json.dumps({'error': 'Access denied'})}
+    
+    try:
+        first_part = int(body.get('first_part', 1))
+        count = int(body.get('count', PART_URL_WINDOW))
+    except (TypeError, ValueError):
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Invalid part range'})}
+    
+    if first_part < 1 or first_part > MAX_PART_NUMBER or count < 1:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Invalid part range'})}
+    count = min(count, PART_URL_WINDOW, MAX_PART_NUMBER - first_part + 1)
+    
+    # Checksummed uploads need one base64 SHA-256 per part; S3 rejects parts without them
+    checksums = None
+    if session.get('checksum_algorithm'):
+        checksums = body.get('checksums')
+        if not isinstance(checksums, list) or not checksums:
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing part checksums'})}
+        if len(checksums) > count or not all(is_sha256_base64(checksum) for checksum in checksums):
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Invalid part checksums'})}
+        count = len(checksums)
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({
+            'file_id': session['file_id'],
+            'upload_id': upload_id,
+            'first_part': first_part,
+            'part_urls': presign_part_urls(session['blob_key'], upload_id, first_part, count, checksums)
+        })
+    }
+
+
+def list_uploaded_parts(key, upload_id):
+    """All parts S3 holds for a multipart upload, following ListParts pagination"""
+    parts = []
+    kwargs = {'Bucket': BUCKET_NAME, 'Key': key, 'UploadId': upload_id}
+    while True:
+        response = s3.list_parts(**kwargs)
+        for part in response.get('Parts', []):
+            entry = {'PartNumber': part['PartNumber'], 'ETag': part['ETag'], 'Size': part['Size']}
+            if 'ChecksumSHA256' in part:
+                entry['ChecksumSHA256'] = part['ChecksumSHA256']
+            parts.append(entry)
+        if not response.get('IsTruncated'):
+            return parts
+        kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+
+
+def handle_upload_status(event, headers):
+    """Report which parts of a multipart upload are already stored, so the client can resume"""
+    username = event['username']
+    body = event['json']
+    upload_id = body.get('upload_id')
+    
+    if not upload_id:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing upload_id'})}
+    
+    session = load_upload_session(upload_id)
+    if not session:
+        return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Upload not found'})}
+    
+    if session['username'] != username:
+        return {'statusCode': 403, 'headers': headers, 'body': json.dumps({'error': 'Access denied'})}
+    
+    try:
+        parts = list_uploaded_parts(session['blob_key'], upload_id)
+    except s3.exceptions.NoSuchUpload:
+        return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Upload not found'})}
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({
+            'filename': session['filename'],
+            'file_id': session['file_id'],
+            'upload_type': 'multipart',
+            'upload_id': upload_id,
+            'size': int(session['size']),
+            'part_size': int(session['part_size']),
+            'num_parts': int(session['num_parts']),
+            'part_url_window': PART_URL_WINDOW,
+            'checksum_algorithm': session.get('checksum_algorithm'),
+            'content_type': session['content_type'],
+            'parts': parts
+        })
+    }
+
+
 def handle_check_duplicate(event, headers):
     """Check if file hash already exists"""
-    username = verify_token(event)
-    if not username:
-        return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Unauthorized'})}
-    
-    body = json.loads(event.get('body', '{}'))
+    body = event['json']
     file_hash = body.get('file_hash')
     
     if not file_hash:
         return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing file_hash'})}
     
-    # Check for duplicate
-    response = files_table.query(
-        IndexName='HashIndex',
-        KeyConditionExpression='file_hash = :hash',
-        ExpressionAttributeValues={':hash': file_hash}
-    )
+    # Old clients sent filename-based fallback hashes, which collide across
+    # different files; only real SHA-256 digests and multipart composite
+    # checksums count as duplicates
+    if not is_blob_id(file_hash):
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'duplicate': False})}
+    
+    if SHA256_PATTERN.match(file_hash):
+        # Check for duplicate; only files on a shared blob had their bytes
+        # checked against the hash (multipart uploads carry it unchecked)
+        response = files_table.query(
+            IndexName='HashIndex',
+            KeyConditionExpression='file_hash = :hash',
+            ExpressionAttributeValues={':hash': file_hash}
+        )
+        verified = [item for item in response.get('Items', []) if item.get('blob_key') == storage_key(None, file_hash)]
+    else:
+        # Records don't carry composite checksums; the blob lists its files
+        blob = blobs_table.get_item(Key={'file_hash': file_hash}).get('Item') or {}
+        refs = sorted(blob.get('refs', ())) if 'deleting' not in blob else []
+        verified = [item for item in (get_file(ref, ProjectionExpression='file_id, filename') for ref in refs[:1]) if item]
     
-    if response.get('Items'):
-        existing = response['Items'][0]
+    if verified:
+        existing = verified[0]
         return {
             'statusCode': 200,
             'headers': headers,
@@ -270,114 +1403,357 @@ def handle_check_duplicate(event, headers):
     }
 
 
-def handle_upload_complete(event, headers):
-    """Store metadata after successful S3 upload"""
-    username = verify_token(event)
-    if not username:
-        return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Unauthorized'})}
+def get_file(file_id, **options):
+    """A files table record as a plain dict (sizes as ints), or None"""
+    response = dynamodb_client.get_item(TableName=FILES_TABLE, Key={'file_id': {'S': file_id}}, **options)
+    item = response.get('Item')
+    return decode_item(item) if item else None
+
+
+def batch_get_items(table_name, keys, **options):
+    """BatchGetItem for any number of keys, retrying unprocessed keys with backoff"""
+    unique_keys = [
+        encode_item(key) for key in {json.dumps(key, sort_keys=True): key for key in keys}.values()
+    ]
+    items = []
+    for start in range(0, len(unique_keys), BATCH_GET_SIZE):
+        request = {table_name: dict(options, Keys=unique_keys[start:start + BATCH_GET_SIZE])}
+        attempt = 0
+        while request:
+            response = dynamodb_client.batch_get_item(RequestItems=request)
+            items.extend(decode_item(item) for item in response['Responses'].get(table_name, []))
+            request = response.get('UnprocessedKeys')
+            if request:
+                time.sleep(min(0.05 * 2 ** attempt, 1))
+                attempt += 1
+    return items
+
+
+def handle_check_duplicate_batch(event, headers):
+    """Check many file hashes at once"""
+    body = event['json']
+    file_hashes = body.get('file_hashes', [])
     
-    body = json.loads(event.get('body', '{}'))
-    file_id = body.get('file_id')
-    filename = body.get('filename')
-    file_hash = body.get('file_hash')
-    file_size = body.get('size')
-    content_type = body.get('content_type', 'application/octet-stream')
-    upload_id = body.get('upload_id')
-    parts = body.get('parts')
+    if not file_hashes:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing file_hashes'})}
+    
+    if len(file_hashes) > MAX_BATCH_ITEMS:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'At most {MAX_BATCH_ITEMS} hashes per request'})}
+    
+    # Only real SHA-256 hashes and composite checksums can match a stored blob
+    blob_hashes = [h for h in file_hashes if is_blob_id(h)]
+    stored = {
+        item['file_hash']
+        for item in batch_get_items(
+            BLOBS_TABLE, [{'file_hash': h} for h in blob_hashes], ProjectionExpression='file_hash, ref_count, deleting'
+        )
+        if item.get('ref_count', 0) > 0 and 'deleting' not in item
+    }
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({'results': [{'file_hash': h, 'duplicate': h in stored} for h in file_hashes]})
+    }
+
+
+def finalize_upload(username, file_info):
+    """Check an uploaded file's bytes are in S3 and build its metadata record.
+
+    Returns (record, None) on success or (None, (status_code, error)).
+    """
+    file_id = file_info.get('file_id')
+    filename = file_info.get('filename')
+    file_hash = file_info.get('file_hash')
+    file_size = file_info.get('size')
+    content_type = file_info.get('content_type', 'application/octet-stream')
+    upload_id = file_info.get('upload_id')
+    parts = file_info.get('parts')
+    multipart_checksum = file_info.get('multipart_checksum')
     
     if not all([file_id, filename, file_hash, file_size]):
-        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing required fields'})}
+        return None, (400, 'Missing required fields')
+    
+    # Records can only be created under the caller's own name
+    if not file_id.startswith(f"{username}/"):
+        return None, (403, 'Access denied')
+    
+    # Duplicates of large files name their blob by its composite checksum
+    if isinstance(multipart_checksum, str) and MULTIPART_BLOB_PATTERN.match(multipart_checksum):
+        blob_key = f"{BLOB_PREFIX}{multipart_checksum}"
+    else:
+        blob_key = storage_key(file_id, file_hash)
+    multipart = bool(upload_id and parts)
     
     # Complete multipart upload if applicable
-    if upload_id and parts:
+    if multipart:
+        session = load_upload_session(upload_id)
+        if not session or session['username'] != username or session['file_id'] != file_id:
+            return None, (404, 'Upload not found')
+        blob_key = session['blob_key']
+        # Only composite checksums are checked before completing; sessions
+        # that went to a SHA-256 blob predate that and have to start over
+        shared = blob_key != file_id
+        if shared and not (session.get('checksum_algorithm') and MULTIPART_BLOB_PATTERN.match(blob_id(blob_key))):
+            return None, (409, 'Upload must be started again')
         try:
+            if session.get('checksum_algorithm'):
+                # Complete from what S3 verified rather than the client's list
+                parts = [
+                    {key: part[key] for key in ('PartNumber', 'ETag', 'ChecksumSHA256') if key in part}
+                    for part in list_uploaded_parts(blob_key, upload_id)
+                ]
+                if len(parts) != session['num_parts']:
+                    return None, (400, f"Upload has {len(parts)} of {session['num_parts']} parts")
+                # The parts S3 verified have to add up to the blob's name, or
+                # other files' duplicates would be handed these bytes
+                if shared and composite_blob_id([part['ChecksumSHA256'] for part in parts]) != blob_id(blob_key):
+                    s3.abort_multipart_upload(Bucket=BUCKET_NAME, Key=blob_key, UploadId=upload_id)
+                    uploads_table.delete_item(Key={'upload_id': upload_id})
+                    return None, (400, 'Uploaded content does not match multipart_checksum')
             s3.complete_multipart_upload(
                 Bucket=BUCKET_NAME,
-                Key=file_id,
+                Key=blob_key,
                 UploadId=upload_id,
                 MultipartUpload={'Parts': parts}
             )
+            uploads_table.delete_item(Key={'upload_id': upload_id})
         except Exception as e:
-            return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': f'Failed to complete multipart upload: {str(e)}'})}
-    else:
-        # Verify file exists in S3 for simple uploads
-        try:
-            s3.head_object(Bucket=BUCKET_NAME, Key=file_id)
-        except Exception as e:
-            return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': f'File not found in S3: {str(e)}'})}
+            return None, (500, f'Failed to complete multipart upload: {str(e)}')
     
-    # Store metadata
-    files_table.put_item(Item={
+    # Shared blobs (uploads named by their checksum, and duplicates that were
+    # never re-uploaded) are reference counted; acquire_blob also checks the
+    # bytes exist
+    try:
+        if blob_key != file_id:
+            head = acquire_blob(blob_id(blob_key), blob_key, int(file_size), file_id)
+        else:
+            head = s3.head_object(Bucket=BUCKET_NAME, Key=file_id, ChecksumMode='ENABLED')
+    except HttpError as e:
+        return None, (e.status, e.message)
+    except Exception as e:
+        return None, (500, f'File not found in S3: {str(e)}')
+    
+    # S3 checked the bytes against the checksum signed into the upload URLs,
+    # which must be the one the blob is named by: the whole-object SHA-256
+    # for single PUTs, a composite ("<digest>-<parts>") over the verified
+    # part checksums for multipart objects. For the latter, the record's
+    # file_hash stays unchecked. Objects uploaded before checksums have none.
+    checksum = head.get('ChecksumSHA256')
+    if blob_key != file_id and checksum and checksum != blob_checksum(blob_id(blob_key)):
+        release_blob(blob_id(blob_key), blob_key, file_id)
+        claimed = 'multipart_checksum' if MULTIPART_BLOB_PATTERN.match(blob_id(blob_key)) else 'file_hash'
+        return None, (400, f'Uploaded content does not match {claimed}')
+    
+    # Listings, bundles and their ranged reads use the recorded size, so it
+    # has to be the object's
+    if head['ContentLength'] != int(file_size):
+        if blob_key != file_id:
+            release_blob(blob_id(blob_key), blob_key, file_id)
+        elif multipart:
+            s3.delete_object(Bucket=BUCKET_NAME, Key=file_id)
+        return None, (400, 'Uploaded content does not match size')
+    
+    record = {
         'file_id': file_id,
         'username': username,
         'filename': filename,
         'file_hash': file_hash,
+        'blob_key': blob_key,
         'size': int(file_size),
         'content_type': content_type,
-        'uploaded_at': datetime.utcnow().isoformat()
-    })
+        'uploaded_at': datetime.utcnow().isoformat(),
+        'listing': LISTING_PARTITION
+    }
+    if checksum:
+        record['checksum_sha256'] = checksum
+    return record, None
+
+
+def handle_upload_complete(event, headers):
+    """Store metadata after successful S3 upload"""
+    username = event['username']
+    body = event['json']
+    
+    record, error = finalize_upload(username, body)
+    if error:
+        status_code, message = error
+        return {'statusCode': status_code, 'headers': headers, 'body': json.dumps({'error': message})}
+    
+    # Store metadata
+    files_table.put_item(Item=record)
+    index_files([record])
+    bump_archive_version([file_added(record)])
     
     return {
         'statusCode': 200,
         'headers': headers,
-        'body': json.dumps({'status': 'success', 'file_id': file_id})
+        'body': json.dumps({'status': 'success', 'file_id': record['file_id']})
+    }
+
+
+def handle_upload_complete_batch(event, headers):
+    """Store metadata for many uploaded files with one BatchWriteItem pass"""
+    username = event['username']
+    body = event['json']
+    files = body.get('files', [])
+    
+    if not files:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'No files provided'})}
+    
+    if len(files) > MAX_BATCH_ITEMS:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'At most {MAX_BATCH_ITEMS} files per request'})}
+    
+    results = []
+    records = []
+    for file_info in files:
+        record, error = finalize_upload(username, file_info)
+        if error:
+            results.append({'file_id': file_info.get('file_id'), 'status': 'error', 'error': error[1]})
+        else:
+            records.append(record)
+            results.append({'file_id': record['file_id'], 'status': 'success'})
+    
+    if records:
+        with files_table.batch_writer(overwrite_by_pkeys=['file_id']) as batch:
+            for record in records:
+                batch.put_item(Item=record)
+        index_files(records)
+        bump_archive_version([file_added(record) for record in records])
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({'results': results})
     }
 
 
 def handle_download(event, headers):
     """Handle file download (shared archive - anyone can download)"""
-    username = verify_token(event)
-    if not username:
-        return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Unauthorized'})}
-    
-    file_id = event.get('queryStringParameters', {}).get('file_id')
+    file_id = event['query'].get('file_id')
     if not file_id:
         return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing file_id'})}
     
-    # Get file metadata (no ownership check - shared archive)
-    response = files_table.get_item(Key={'file_id': file_id})
-    file_item = response.get('Item')
+    # Read the version before the item, as for listing pages
+    version = get_archive_version()
+    window = download_window()
+    cached = cached_download(file_id, version, window)
+    note_request(download_cache='hit' if cached else 'miss')
+    if not cached:
+        # Get file metadata (no ownership check - shared archive)
+        file_item = get_file(file_id, ProjectionExpression='file_id, filename, blob_key')
+        
+        if not file_item:
+            return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'File not found'})}
+        cached = cache_download(file_item, version, window)
     
-    if not file_item:
-        return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'File not found'})}
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({'download_url': cached['url'], 'filename': cached['filename']})
+    }
+
+
+def download_window():
+    """Start (epoch seconds) of the current download URL window"""
+    now = int(time.time())
+    return now - now % DOWNLOAD_URL_WINDOW
+
+
+def download_url(file_item, window=None):
+    """Presigned GET for a file record, saved under its original filename"""
+    window = download_window() if window is None else window
     
-    # Generate presigned URL (valid for 1 hour for large downloads)
     # URL-encode filename to handle non-ASCII characters
     import urllib.parse
     encoded_filename = urllib.parse.quote(file_item["filename"])
     
-    url = s3.generate_presigned_url(
+    return presigner.generate_presigned_url(
         'get_object',
         Params={
             'Bucket': BUCKET_NAME,
-            'Key': file_id,
+            'Key': file_item.get('blob_key', file_item['file_id']),
             'ResponseContentDisposition': f'attachment; filename*=UTF-8\'\'{encoded_filename}'
         },
-        ExpiresIn=3600  # 1 hour for large files
+        ExpiresIn=DOWNLOAD_URL_WINDOW + DOWNLOAD_URL_TTL,
+        now=datetime.fromtimestamp(window, timezone.utc)
     )
+
+
+def cached_download(file_id, version, window):
+    """This window's {'url', 'filename'} for file_id if the warm container already signed it"""
+    entry = _download_urls.get((BUCKET_NAME, file_id))
+    if entry and entry['version'] == version and entry['window'] == window:
+        return entry
+    return None
+
+
+def cache_download(file_item, version, window):
+    """Sign file_item's URL for this window and remember it"""
+    if len(_download_urls) >= DOWNLOAD_URL_CACHE_MAX:
+        _download_urls.pop(next(iter(_download_urls)))
+    entry = {
+        'version': version,
+        'window': window,
+        'url': download_url(file_item, window),
+        'filename': file_item['filename']
+    }
+    _download_urls[(BUCKET_NAME, file_item['file_id'])] = entry
+    return entry
+
+
+def handle_download_batch(event, headers):
+    """Presigned download URLs for many files in one call"""
+    body = event['json']
+    file_ids = list(dict.fromkeys(body.get('file_ids', [])))
+    
+    if not file_ids:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing file_ids'})}
+    
+    if len(file_ids) > MAX_DOWNLOAD_BATCH:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'At most {MAX_DOWNLOAD_BATCH} files per request'})}
+    
+    version = get_archive_version()
+    window = download_window()
+    downloads = {}
+    for file_id in file_ids:
+        cached = cached_download(file_id, version, window)
+        if cached:
+            downloads[file_id] = cached
+    note_request(download_cache_hits=len(downloads), download_cache_misses=len(file_ids) - len(downloads))
+    
+    # Only files this container hasn't signed yet need their records (no ownership check - shared archive)
+    for item in batch_get_items(
+        FILES_TABLE,
+        [{'file_id': file_id} for file_id in file_ids if file_id not in downloads],
+        ProjectionExpression='file_id, filename, blob_key'
+    ):
+        downloads[item['file_id']] = cache_download(item, version, window)
     
     return {
         'statusCode': 200,
         'headers': headers,
-        'body': json.dumps({'download_url': url, 'filename': file_item['filename']})
+        'body': json.dumps({
+            'downloads': [
+                {'file_id': file_id, 'filename': downloads[file_id]['filename'], 'download_url': downloads[file_id]['url']}
+                for file_id in file_ids if file_id in downloads
+            ],
+            'missing': [file_id for file_id in file_ids if file_id not in downloads]
+        })
     }
 
 
 def handle_delete(event, headers):
     """Handle file deletion"""
-    username = verify_token(event)
-    if not username:
-        return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Unauthorized'})}
-    
-    body = json.loads(event.get('body', '{}'))
+    username = event['username']
+    body = event['json']
     file_id = body.get('file_id')
     
     if not file_id:
         return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing file_id'})}
     
     # Verify file ownership
-    response = files_table.get_item(Key={'file_id': file_id})
-    file_item = response.get('Item')
+    file_item = get_file(file_id)
     
     if not file_item:
         return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'File not found'})}
@@ -385,12 +1761,23 @@ def handle_delete(event, headers):
     if file_item['username'] != username:
         return {'statusCode': 403, 'headers': headers, 'body': json.dumps({'error': 'Access denied'})}
     
+    blob_key = file_item.get('blob_key', file_id)
+    
     try:
-        # Delete from S3
-        s3.delete_object(Bucket=BUCKET_NAME, Key=file_id)
+        # Delete metadata from DynamoDB; only the request that actually
+        # removed the record releases the bytes
+        response = files_table.delete_item(Key={'file_id': file_id}, ReturnValues='ALL_OLD')
+        removed = 'Attributes' in response
+        if removed:
+            unindex_files([response['Attributes']])
+        bump_archive_version([file_removed(file_id)] if removed else [])
         
-        # Delete metadata from DynamoDB
-        files_table.delete_item(Key={'file_id': file_id})
+        # Delete from S3 (shared blobs only once nothing references them)
+        if removed:
+            if blob_key != file_id:
+                release_blob(blob_id(blob_key), blob_key, file_id)
+            else:
+                s3.delete_object(Bucket=BUCKET_NAME, Key=file_id)
         
         return {
             'statusCode': 200,
@@ -403,3 +1790,274 @@ def handle_delete(event, headers):
             'headers': headers,
             'body': json.dumps({'error': f'Failed to delete file: {str(e)}'})
         }
+
+
+def handle_delete_batch(event, headers):
+    """Delete many of the caller's files: BatchWriteItem for records, DeleteObjects for bytes"""
+    username = event['username']
+    body = event['json']
+    file_ids = list(dict.fromkeys(body.get('file_ids', [])))
+    
+    if not file_ids:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing file_ids'})}
+    
+    if len(file_ids) > MAX_BATCH_ITEMS:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'At most {MAX_BATCH_ITEMS} files per request'})}
+    
+    items = {
+        item['file_id']: item
+        for item in batch_get_items(
+            FILES_TABLE,
+            [{'file_id': file_id} for file_id in file_ids],
+            ProjectionExpression='file_id, username, filename, file_hash, blob_key'
+        )
+    }
+    
+    results = []
+    deletable = []
+    for file_id in file_ids:
+        item = items.get(file_id)
+        if not item:
+            results.append({'file_id': file_id, 'status': 'error', 'error': 'File not found'})
+        elif item['username'] != username:
+            results.append({'file_id': file_id, 'status': 'error', 'error': 'Access denied'})
+        else:
+            deletable.append(item)
+            results.append({'file_id': file_id, 'status': 'success'})
+    
+    if deletable:
+        # Delete metadata first so nothing points at bytes that are gone
+        with files_table.batch_writer() as batch:
+            for item in deletable:
+                batch.delete_item(Key={'file_id': item['file_id']})
+        unindex_files(deletable)
+        bump_archive_version([file_removed(item['file_id']) for item in deletable])
+        
+        own_keys = [item['file_id'] for item in deletable if item.get('blob_key', item['file_id']) == item['file_id']]
+        for start in range(0, len(own_keys), S3_DELETE_BATCH_SIZE):
+            response = s3.delete_objects(
+                Bucket=BUCKET_NAME,
+                Delete={'Objects': [{'Key': key} for key in own_keys[start:start + S3_DELETE_BATCH_SIZE]], 'Quiet': True}
+            )
+            for error in response.get('Errors', []):
+                print(json.dumps({'delete_error': error}))
+        
+        # Shared blobs go away with their last reference (release is idempotent per file)
+        for item in deletable:
+            if item.get('blob_key', item['file_id']) != item['file_id']:
+                release_blob(blob_id(item['blob_key']), item['blob_key'], item['file_id'])
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({'results': results})
+    }
+
+
+def handle_bundle(event, headers):
+    """Start building a ZIP of many files; the client polls /bundle-status for the URL"""
+    username = event['username']
+    body = event['json']
+    file_ids = list(dict.fromkeys(body.get('file_ids', [])))
+    bundle_name = body.get('name') or 'bundle.zip'
+    if not bundle_name.lower().endswith('.zip'):
+        bundle_name += '.zip'
+    
+    if not file_ids:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing file_ids'})}
+    
+    if len(file_ids) > MAX_BATCH_ITEMS:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'At most {MAX_BATCH_ITEMS} files per bundle'})}
+    
+    # No ownership check - shared archive
+    items = {
+        item['file_id']: item
+        for item in batch_get_items(
+            FILES_TABLE,
+            [{'file_id': file_id} for file_id in file_ids],
+            ProjectionExpression='file_id, filename, blob_key, #size, uploaded_at',
+            ExpressionAttributeNames={'#size': 'size'}
+        )
+    }
+    missing = [file_id for file_id in file_ids if file_id not in items]
+    if missing:
+        return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'File not found', 'missing': missing})}
+    
+    total_size = sum(item['size'] for item in items.values())
+    if total_size > MAX_BUNDLE_BYTES:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Bundle too large'})}
+    
+    job = {
+        'name': f"bundle:{secrets.token_urlsafe(12)}",
+        'username': username,
+        'status': 'pending',
+        'bundle_name': bundle_name,
+        'files': [
+            {
+                'filename': items[file_id]['filename'],
+                'key': items[file_id].get('blob_key', file_id),
+                'size': items[file_id]['size'],
+                'uploaded_at': items[file_id].get('uploaded_at')
+            }
+            for file_id in file_ids
+        ],
+        'total_size': total_size,
+        'created_at': datetime.utcnow().isoformat(),
+        'expires_at': int(time.time()) + BUNDLE_TTL
+    }
+    meta_table.put_item(Item=job)
+    
+    if BUNDLE_FUNCTION:
+        lambda_client.invoke(
+            FunctionName=BUNDLE_FUNCTION,
+            InvocationType='Event',
+            Payload=json.dumps({'bundle_id': job['name']})
+        )
+        return {'statusCode': 202, 'headers': headers, 'body': json.dumps(bundle_status(job))}
+    
+    build_bundle(job)
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps(bundle_status(load_bundle_job(job['name'])))}
+
+
+def load_bundle_job(bundle_id):
+    if not bundle_id or not bundle_id.startswith('bundle:'):
+        return None
+    return meta_table.get_item(Key={'name': bundle_id}, ConsistentRead=True).get('Item')
+
+
+def bundle_status(job):
+    """Client-facing view of a bundle job"""
+    status = {
+        'bundle_id': job['name'],
+        'status': job['status'],
+        'files': len(job['files']),
+        'total_size': int(job['total_size'])
+    }
+    if job['status'] == 'ready':
+        status['size'] = int(job['size'])
+        status['download_url'] = download_url({'file_id': job['bundle_key'], 'filename': job['bundle_name']})
+    elif job['status'] == 'failed':
+        status['error'] = job.get('error')
+    elif job['status'] == 'running' and time.time() - int(job.get('started_at', time.time())) > BUNDLE_TIMEOUT:
+        # Killed at the timeout, before it could record the failure
+        status['status'] = 'failed'
+        status['error'] = 'Bundle timed out'
+    return status
+
+
+def handle_bundle_status(event, headers):
+    """Report a bundle job's progress, with a download URL once it is ready"""
+    username = event['username']
+    bundle_id = event['query'].get('bundle_id')
+    if not bundle_id:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing bundle_id'})}
+    
+    job = load_bundle_job(bundle_id)
+    if not job:
+        return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Bundle not found'})}
+    
+    if job['username'] != username:
+        return {'statusCode': 403, 'headers': headers, 'body': json.dumps({'error': 'Access denied'})}
+    
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps(bundle_status(job))}
+
+
+def build_bundle(job):
+    """Stream a bundle job's files into a ZIP object, reading each file in ranged chunks.
+
+    Memory stays at roughly one read chunk plus one upload part whatever the
+    bundle size. Throughput and peak RSS are logged and kept on the job.
+    """
+    # Claim the job so a retried async invocation doesn't build it twice
+    try:
+        meta_table.update_item(
+            Key={'name': job['name']},
+            UpdateExpression='SET #status = :running, started_at = :now',
+            ConditionExpression='#status = :pending',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':running': 'running', ':pending': 'pending', ':now': int(time.time())}
+        )
+    except meta_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return
+    
+    from zipstream import S3MultipartSink, ZipStreamWriter, iter_object
+    
+    bundle_key = f"{BUNDLE_PREFIX}{job['username']}/{job['name'].split(':', 1)[1]}.zip"
+    started = time.monotonic()
+    sink = S3MultipartSink(s3, BUCKET_NAME, bundle_key, ContentType='application/zip')
+    try:
+        writer = ZipStreamWriter(sink)
+        for entry in job['files']:
+            modified = datetime.fromisoformat(entry['uploaded_at']) if entry.get('uploaded_at') else None
+            writer.add(entry['filename'], iter_object(s3, BUCKET_NAME, entry['key'], int(entry['size'])), modified)
+        size = writer.close()
+        sink.close()
+    except Exception as e:
+        sink.abort()
+        meta_table.update_item(
+            Key={'name': job['name']},
+            UpdateExpression='SET #status = :failed, #error = :error',
+            ExpressionAttributeNames={'#status': 'status', '#error': 'error'},
+            ExpressionAttributeValues={':failed': 'failed', ':error': str(e)}
+        )
+        raise
+    
+    elapsed_ms = max(int((time.monotonic() - started) * 1000), 1)
+    try:
+        import resource
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:  # Windows local dev: no peak RSS reporting
+        peak_rss_kb = 0
+    print(json.dumps({'bundle': {
+        'bundle_id': job['name'],
+        'files': len(job['files']),
+        'bytes': size,
+        'elapsed_ms': elapsed_ms,
+        'mb_per_s': round(size / 1024 ** 2 / (elapsed_ms / 1000), 1),
+        'peak_rss_mb': round(peak_rss_kb / 1024, 1)
+    }}))
+    
+    meta_table.update_item(
+        Key={'name': job['name']},
+        UpdateExpression='SET #status = :ready, bundle_key = :key, #size = :size, elapsed_ms = :elapsed, peak_rss_kb = :rss',
+        ExpressionAttributeNames={'#status': 'status', '#size': 'size'},
+        ExpressionAttributeValues={':ready': 'ready', ':key': bundle_key, ':size': size, ':elapsed': elapsed_ms, ':rss': peak_rss_kb}
+    )
+
+
+def bundle_handler(event, context):
+    """Entry point of the bundle worker function, invoked asynchronously by /bundle"""
+    started = time.perf_counter()
+    aws_calls.start(trace=random.random() < AWS_TRACE_SAMPLE_RATE)
+    status = 500
+    try:
+        job = load_bundle_job(event.get('bundle_id'))
+        if job and job['status'] == 'pending':
+            build_bundle(job)
+        status = 200
+    finally:
+        log_request('bundle_handler', status, (time.perf_counter() - started) * 1000, context)
+
+
+# (method, path, handler, options): 'auth' defaults to True, and 'body'
+# (decode a JSON body) to True for POST routes
+ROUTES = build_routes([
+    ('POST', '/login', handle_login, {'auth': False}),
+    ('POST', '/logout', handle_logout, {'body': False}),
+    ('GET', '/files', handle_list_files, {}),
+    ('GET', '/files/changes', handle_list_changes, {}),
+    ('GET', '/search', handle_search, {}),
+    ('POST', '/upload', handle_upload, {}),
+    ('POST', '/upload-parts', handle_upload_parts, {}),
+    ('POST', '/upload-status', handle_upload_status, {}),
+    ('POST', '/upload-complete', handle_upload_complete, {}),
+    ('POST', '/upload-complete-batch', handle_upload_complete_batch, {}),
+    ('POST', '/check-duplicate', handle_check_duplicate, {}),
+    ('POST', '/check-duplicate-batch', handle_check_duplicate_batch, {}),
+    ('GET', '/download', handle_download, {}),
+    ('POST', '/download-batch', handle_download_batch, {}),
+    ('POST', '/bundle', handle_bundle, {}),
+    ('GET', '/bundle-status', handle_bundle_status, {}),
+    ('POST', '/delete', handle_delete, {}),
+    ('POST', '/delete-batch', handle_delete_batch, {}),
+])
@@ -0,0 +1,774 @@
+"""Filesystem + SQLite stand-ins for S3 and DynamoDB, for running without AWS.
+
+With STORAGE_BACKEND=local, handler.py takes its S3 client, presigner and
+DynamoDB resource/client from LocalStorage instead of boto3, so the same
+code serves an on-prem deployment (local/serve.py) at local-disk speed:
+
+  s3               DiskS3: each object is one file; sizes and checksums in SQLite
+  dynamodb         Table(name) is a SqliteTable, behaving like a boto3 resource Table
+  dynamodb_client  the low-level get_item/query/batch_get_item, in wire format
+  presigner        LocalPresigner: HMAC-signed URLs to serve.py's storage route
+
+Items are stored as their DynamoDB JSON, so sets and numbers round-trip
+exactly and the low-level client returns rows without re-encoding them.
+Every GSI's key attributes are copied into indexed columns, so index
+queries are SQLite index range scans in the index's sort order.
+
+Expressions are evaluated for the forms handler.py uses (SET/ADD/DELETE/
+REMOVE updates; =, contains, attribute_(not_)exists, NOT and AND conditions;
+equality key conditions); anything else raises NotImplementedError so a new
+query shape fails loudly instead of returning wrong results. local/fakeaws.py
+evaluates expressions with the same functions.
+
+One SQLite file holds every table, in WAL mode so serve.py's forked workers
+can share it: each process opens its own connection, and conditional writes
+run in an immediate transaction so they are atomic across processes.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+from urllib.parse import quote, urlencode, urlsplit
+
+from dynamocodec import decode_item, encode_item
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class NoSuchUpload(Exception):
+    pass
+
+
+class BadDigest(Exception):
+    """Uploaded bytes don't match the SHA-256 the URL was signed for"""
+
+
+EXCEPTIONS = SimpleNamespace(
+    ConditionalCheckFailedException=ConditionalCheckFailedException, NoSuchKey=NoSuchKey, NoSuchUpload=NoSuchUpload
+)
+
+CLAUSE = re.compile(r'\b(SET|ADD|DELETE|REMOVE)\b')
+FUNCTION = re.compile(r'^(contains|attribute_exists|attribute_not_exists)\((.*)\)$')
+COPY_CHUNK = 1024 * 1024
+
+
+# Expressions
+
+def attribute_name(token, names):
+    token = token.strip()
+    return (names or {}).get(token, token)
+
+
+def projection(expression, names):
+    """Attribute names of a ProjectionExpression, or None for all"""
+    return [attribute_name(token, names) for token in expression.split(',')] if expression else None
+
+
+def project(item, attributes):
+    if attributes is None:
+        return dict(item)
+    return {name: item[name] for name in attributes if name in item}
+
+
+def check_condition(item, expression, names, values):
+    """Evaluate a ConditionExpression against an item (None if it doesn't exist)"""
+    expression = expression.strip()
+    conjuncts = re.split(r'\s+AND\s+', expression, flags=re.IGNORECASE)
+    if len(conjuncts) > 1:
+        return all(check_condition(item, conjunct, names, values) for conjunct in conjuncts)
+    if expression.upper().startswith('NOT '):
+        return not check_condition(item, expression[4:], names, values)
+    match = FUNCTION.match(expression)
+    if match:
+        function, args = match.group(1), [arg.strip() for arg in match.group(2).split(',')]
+        attribute = item.get(attribute_name(args[0], names)) if item else None
+        if function == 'contains':
+            return attribute is not None and values[args[1]] in attribute
+        return (attribute is not None) == (function == 'attribute_exists')
+    if ' OR ' in expression.upper() or '=' not in expression:
+        raise NotImplementedError(f'Condition not modelled: {expression}')
+    left, right = expression.split('=')
+    return bool(item) and item.get(attribute_name(left, names)) == values[right.strip()]
+
+
+def apply_update(item, expression, names, values):
+    """Apply an UpdateExpression to item in place; returns the names of the attributes it touched"""
+    updated = []
+    parts = CLAUSE.split(expression)
+    for clause, body in zip(parts[1::2], parts[2::2]):
+        for action in filter(None, (action.strip() for action in body.split(','))):
+            if clause == 'SET':
+                left, right = action.split('=')
+                name = attribute_name(left, names)
+                item[name] = values[right.strip()]
+            elif clause == 'REMOVE':
+                name = attribute_name(action, names)
+                item.pop(name, None)
+            else:
+                path, value_ref = action.split()
+                name, value = attribute_name(path, names), values[value_ref]
+                if clause == 'ADD':
+                    if isinstance(value, set):
+                        item[name] = item.get(name, set()) | value
+                    else:
+                        item[name] = item.get(name, 0) + value
+                else:  # DELETE from a set; empty sets are removed
+                    remaining = item.get(name, set()) - value
+                    if remaining:
+                        item[name] = remaining
+                    else:
+                        item.pop(name, None)
+            updated.append(name)
+    return updated
+
+
+def key_condition(expression, names, values):
+    """(attribute, value) of an equality KeyConditionExpression"""
+    if ' AND ' in expression.upper() or '=' not in expression:
+        raise NotImplementedError(f'Key condition not modelled: {expression}')
+    left, right = expression.split('=')
+    return attribute_name(left, names), values[right.strip()]
+
+
+# SQLite
+
+def _identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class Database:
+    """One SQLite file shared by all tables; a connection per process, used by one thread at a time"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self):
+        # Connections must not cross a fork
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._pid = os.getpid()
+        return self._connection
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        """Immediate transaction: holds the write lock from the first read, across processes"""
+        with self.lock:
+            connection = self.connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+
+class SqliteTable:
+    """A DynamoDB table keyed on one hash key, with optional GSIs, as a boto3 resource Table.
+
+    indexes maps index name -> (hash attribute, range attribute or None).
+    Items missing an index's key attributes are left out of it, as in a
+    sparse GSI. Index queries return items ordered by the range attribute
+    (then the table key) and page with LastEvaluatedKey.
+    """
+
+    def __init__(self, database, name, key, indexes=None):
+        self.name = name
+        self.key = key
+        self.indexes = indexes or {}
+        self.meta = SimpleNamespace(client=SimpleNamespace(exceptions=EXCEPTIONS))
+        self._db = database
+        self._table = _identifier(name)
+        self._attributes = sorted({
+            attribute for hash_attr, range_attr in self.indexes.values() for attribute in (hash_attr, range_attr) if attribute
+        })
+        self._columns = {attribute: _identifier(f'ix_{attribute}') for attribute in self._attributes}
+        self._create()
+
+    def _create(self):
+        with self._db.transaction() as connection:
+            connection.execute(f'CREATE TABLE IF NOT EXISTS {self._table} (pk TEXT PRIMARY KEY, item TEXT NOT NULL)')
+            existing = {row[1] for row in connection.execute(f'PRAGMA table_info({self._table})')}
+            added = [attribute for attribute in self._attributes if f'ix_{attribute}' not in existing]
+            for attribute in added:
+                connection.execute(f'ALTER TABLE {self._table} ADD COLUMN {self._columns[attribute]}')
+            if added:
+                # Backfill index columns added since the items were written
+                rows = connection.execute(f'SELECT pk, item FROM {self._table}').fetchall()
+                assignments = ', '.join(f'{self._columns[attribute]} = ?' for attribute in added)
+                connection.executemany(
+                    f'UPDATE {self._table} SET {assignments} WHERE pk = ?',
+                    [
+                        [self._index_value(decode_item(json.loads(item)).get(attribute)) for attribute in added] + [pk]
+                        for pk, item in rows
+                    ]
+                )
+            for hash_attr, range_attr in self.indexes.values():
+                # Named by their columns, so an index whose key changes gets a new SQLite index
+                columns = [self._columns[hash_attr]] + ([self._columns[range_attr]] if range_attr else []) + ['pk']
+                index_name = _identifier(f"{self.name}:{hash_attr},{range_attr or ''}")
+                connection.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {self._table} ({', '.join(columns)})")
+
+    @staticmethod
+    def _index_value(value):
+        return value if isinstance(value, (str, int, float)) and not isinstance(value, bool) else None
+
+    def _row(self, item):
+        return [item[self.key], json.dumps(encode_item(item), separators=(',', ':'))] + [
+            self._index_value(item.get(attribute)) for attribute in self._attributes
+        ]
+
+    def _write(self, connection, items):
+        columns = ', '.join(['pk', 'item'] + [self._columns[attribute] for attribute in self._attributes])
+        placeholders = ', '.join('?' * (2 + len(self._attributes)))
+        connection.executemany(
+            f'INSERT OR REPLACE INTO {self._table} ({columns}) VALUES ({placeholders})', [self._row(item) for item in items]
+        )
+
+    def _read(self, connection, key):
+        row = connection.execute(f'SELECT item FROM {self._table} WHERE pk = ?', (key,)).fetchone()
+        return decode_item(json.loads(row[0])) if row else None
+
+    def load(self, items):
+        """Bulk insert in one transaction"""
+        with self._db.transaction() as connection:
+            self._write(connection, items)
+
+    # Table API
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, ConsistentRead=False):
+        item = self.get_wire_item(Key[self.key])
+        if item is None:
+            return {}
+        return {'Item': project(decode_item(item), projection(ProjectionExpression, ExpressionAttributeNames))}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None):
+        with self._db.transaction() as connection:
+            if ConditionExpression:
+                old = self._read(connection, Item[self.key])
+                if not check_condition(old, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+                    raise ConditionalCheckFailedException(ConditionExpression)
+            self._write(connection, [Item])
+        return {}
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE'):
+        with self._db.transaction() as connection:
+            old = self._read(connection, Key[self.key])
+            if ConditionExpression and not check_condition(old, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+                raise ConditionalCheckFailedException(ConditionExpression)
+            if old is None:
+                return {}
+            connection.execute(f'DELETE FROM {self._table} WHERE pk = ?', (Key[self.key],))
+        return {'Attributes': old} if ReturnValues == 'ALL_OLD' else {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE'):
+        names, values = ExpressionAttributeNames, ExpressionAttributeValues or {}
+        with self._db.transaction() as connection:
+            old = self._read(connection, Key[self.key])
+            if ConditionExpression and not check_condition(old, ConditionExpression, names, values):
+                raise ConditionalCheckFailedException(ConditionExpression)
+            item = dict(old) if old else dict(Key)
+            updated = apply_update(item, UpdateExpression, names, values)
+            self._write(connection, [item])
+        if ReturnValues == 'UPDATED_NEW':
+            return {'Attributes': {name: item[name] for name in updated if name in item}}
+        if ReturnValues == 'ALL_NEW':
+            return {'Attributes': item}
+        return {}
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, IndexName=None, ExpressionAttributeNames=None,
+              ProjectionExpression=None, ScanIndexForward=True, Limit=None, ExclusiveStartKey=None):
+        attributes = projection(ProjectionExpression, ExpressionAttributeNames)
+        items, last_key = self.query_wire_items(
+            KeyConditionExpression, ExpressionAttributeValues, IndexName, ExpressionAttributeNames,
+            ScanIndexForward, Limit, ExclusiveStartKey
+        )
+        response = {'Items': [project(decode_item(item), attributes) for item in items], 'Count': len(items)}
+        if last_key:
+            response['LastEvaluatedKey'] = last_key
+        return response
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return _BatchWriter(self)
+
+    # Wire-format reads, shared with the low-level client
+
+    def get_wire_item(self, key):
+        rows = self._db.execute(f'SELECT item FROM {self._table} WHERE pk = ?', (key,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def get_wire_items(self, keys):
+        items = []
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self._db.execute(
+                f"SELECT item FROM {self._table} WHERE pk IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            items.extend(json.loads(row[0]) for row in rows)
+        return items
+
+    def query_wire_items(self, expression, values, index_name=None, names=None, forward=True, limit=None, start_key=None):
+        """(wire-format items, LastEvaluatedKey or None) for an equality key condition"""
+        attribute, value = key_condition(expression, names, values)
+        if index_name is None:
+            if attribute != self.key:
+                raise NotImplementedError(f'{self.name} is keyed on {self.key}, not {attribute}')
+            item = self.get_wire_item(value)
+            return ([item] if item else []), None
+
+        hash_attr, range_attr = self.indexes[index_name]
+        if attribute != hash_attr:
+            raise NotImplementedError(f'{index_name} is keyed on {hash_attr}, not {attribute}')
+        order = ([self._columns[range_attr]] if range_attr else []) + ['pk']
+        where = [f'{self._columns[hash_attr]} = ?']
+        params = [value]
+        if range_attr:
+            where.append(f'{self._columns[range_attr]} IS NOT NULL')
+        if start_key:
+            start = ([start_key[range_attr]] if range_attr else []) + [start_key[self.key]]
+            where.append(f"({', '.join(order)}) {'>' if forward else '<'} ({', '.join('?' * len(order))})")
+            params.extend(start)
+        sql = (
+            f"SELECT item FROM {self._table} WHERE {' AND '.join(where)} "
+            f"ORDER BY {', '.join(column + ('' if forward else ' DESC') for column in order)}"
+        )
+        if limit:
+            # One extra row says whether there is another page
+            sql += ' LIMIT ?'
+            params.append(limit + 1)
+        rows = self._db.execute(sql, params)
+        items = [json.loads(row[0]) for row in rows[:limit]] if limit else [json.loads(row[0]) for row in rows]
+        if not limit or len(rows) <= limit:
+            return items, None
+        last = decode_item(items[-1])
+        last_key = {self.key: last[self.key], hash_attr: last[hash_attr]}
+        if range_attr:
+            last_key[range_attr] = last[range_attr]
+        return items, last_key
+
+
+class _BatchWriter:
+    """Writes everything put or deleted inside the with block in one transaction"""
+
+    def __init__(self, table):
+        self._table = table
+        self._puts = {}
+        self._deletes = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        table = self._table
+        with table._db.transaction() as connection:
+            if self._deletes:
+                connection.executemany(f'DELETE FROM {table._table} WHERE pk = ?', [(key,) for key in self._deletes])
+            table._write(connection, list(self._puts.values()))
+        return False
+
+    def put_item(self, Item):
+        self._deletes.discard(Item[self._table.key])
+        self._puts[Item[self._table.key]] = Item
+
+    def delete_item(self, Key):
+        self._puts.pop(Key[self._table.key], None)
+        self._deletes.add(Key[self._table.key])
+
+
+class SqliteDynamoResource:
+    def __init__(self, tables):
+        self.tables = tables
+        self.meta = SimpleNamespace(client=SimpleNamespace(exceptions=EXCEPTIONS))
+
+    def Table(self, name):
+        return self.tables[name]
+
+
+class SqliteDynamoClient:
+    """The low-level calls handler.py makes, in wire format, over SqliteTables"""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.exceptions = EXCEPTIONS
+
+    def get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None, ConsistentRead=False):
+        table = self.tables[TableName]
+        item = table.get_wire_item(decode_item(Key)[table.key])
+        if item is None:
+            return {}
+        return {'Item': project(item, projection(ProjectionExpression, ExpressionAttributeNames))}
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, IndexName=None,
+              ExpressionAttributeNames=None, ProjectionExpression=None, ScanIndexForward=True, Limit=None,
+              ExclusiveStartKey=None):
+        items, last_key = self.tables[TableName].query_wire_items(
+            KeyConditionExpression, decode_item(ExpressionAttributeValues), IndexName, ExpressionAttributeNames,
+            ScanIndexForward, Limit, decode_item(ExclusiveStartKey) if ExclusiveStartKey else None
+        )
+        attributes = projection(ProjectionExpression, ExpressionAttributeNames)
+        response = {'Items': [project(item, attributes) for item in items], 'Count': len(items)}
+        if last_key:
+            response['LastEvaluatedKey'] = encode_item(last_key)
+        return response
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        for table_name, request in RequestItems.items():
+            table = self.tables[table_name]
+            attributes = projection(request.get('ProjectionExpression'), request.get('ExpressionAttributeNames'))
+            keys = [decode_item(key)[table.key] for key in request['Keys']]
+            responses[table_name] = [project(item, attributes) for item in table.get_wire_items(keys)]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+# Objects
+
+def composite_checksum(checksums):
+    """S3's checksum of a multipart object: SHA-256 of the parts' digests, then -<part count>"""
+    digest = hashlib.sha256(b''.join(base64.b64decode(checksum) for checksum in checksums)).digest()
+    return f'{base64.b64encode(digest).decode()}-{len(checksums)}'
+
+
+def _copy(source, destination):
+    """Append one open file to another, in the kernel where the platform allows"""
+    try:
+        while os.copy_file_range(source.fileno(), destination.fileno(), COPY_CHUNK * 64):
+            pass
+    except (AttributeError, OSError):
+        shutil.copyfileobj(source, destination, COPY_CHUNK)
+
+
+class _Body:
+    """A byte range of an object file, read like a botocore StreamingBody"""
+
+    def __init__(self, path, start, length):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._remaining = length
+
+    def read(self, amt=None):
+        size = self._remaining if amt is None else min(amt, self._remaining)
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        if not self._remaining:
+            self._file.close()
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+class DiskS3:
+    """The S3 calls handler.py makes, over one file per object under root.
+
+    Files are named by the SHA-256 of their key, so any key maps to a short,
+    safe path. Sizes, checksums and content types are kept in SQLite next to
+    the tables. Writes go to a temporary file first and are renamed into place.
+    """
+
+    def __init__(self, database, root):
+        self.exceptions = EXCEPTIONS
+        self._db = database
+        self._objects = os.path.join(root, 'objects')
+        self._parts = os.path.join(root, 'parts')
+        os.makedirs(self._objects, exist_ok=True)
+        os.makedirs(self._parts, exist_ok=True)
+        with database.transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS _objects '
+                '(key TEXT PRIMARY KEY, size INTEGER, checksum TEXT, content_type TEXT, etag TEXT, modified REAL)'
+            )
+            connection.execute('CREATE TABLE IF NOT EXISTS _uploads (upload_id TEXT PRIMARY KEY, key TEXT, content_type TEXT)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS _parts (upload_id TEXT, part_number INTEGER, size INTEGER, etag TEXT, '
+                'checksum TEXT, PRIMARY KEY (upload_id, part_number))'
+            )
+
+    def object_path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self._objects, digest[:2], digest)
+
+    def _part_path(self, upload_id, part_number):
+        return os.path.join(self._parts, upload_id, str(part_number))
+
+    def _receive(self, path, source, length, checksum):
+        """Copy length bytes from source into path via a temporary file; returns their base64 SHA-256"""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        handle, temporary = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(handle, 'wb') as target:
+                remaining = length
+                while remaining:
+                    data = source.read(min(remaining, COPY_CHUNK))
+                    if not data:
+                        raise BadDigest(f'Body ended {remaining} bytes short')
+                    digest.update(data)
+                    target.write(data)
+                    remaining -= len(data)
+            actual = base64.b64encode(digest.digest()).decode()
+            if checksum and checksum != actual:
+                raise BadDigest('Body does not match x-amz-checksum-sha256')
+            os.replace(temporary, path)
+            return actual
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def _record(self, connection, key, size, checksum, content_type, etag):
+        connection.execute(
+            'INSERT OR REPLACE INTO _objects (key, size, checksum, content_type, etag, modified) VALUES (?, ?, ?, ?, ?, ?)',
+            (key, size, checksum, content_type, etag, time.time())
+        )
+
+    # What a client's PUT to a presigned URL does (local/serve.py)
+
+    def receive_object(self, key, source, length, checksum=None, content_type=None):
+        actual = self._receive(self.object_path(key), source, length, checksum)
+        etag = f'"{base64.b64decode(actual)[:16].hex()}"'
+        with self._db.transaction() as connection:
+            self._record(connection, key, length, actual, content_type or 'binary/octet-stream', etag)
+        return etag
+
+    def receive_part(self, upload_id, part_number, source, length, checksum=None):
+        if not self._db.execute('SELECT 1 FROM _uploads WHERE upload_id = ?', (upload_id,)):
+            raise NoSuchUpload(upload_id)
+        actual = self._receive(self._part_path(upload_id, part_number), source, length, checksum)
+        etag = f'"{base64.b64decode(actual)[:16].hex()}"'
+        with self._db.transaction() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO _parts (upload_id, part_number, size, etag, checksum) VALUES (?, ?, ?, ?, ?)',
+                (upload_id, part_number, length, etag, actual)
+            )
+        return etag
+
+    def open_object(self, key):
+        """(path, size, content type, ETag) for serving an object, or raises NoSuchKey"""
+        rows = self._db.execute('SELECT size, content_type, etag FROM _objects WHERE key = ?', (key,))
+        if not rows:
+            raise NoSuchKey(key)
+        size, content_type, etag = rows[0]
+        return self.object_path(key), size, content_type, etag
+
+    # S3 API
+
+    def head_object(self, Bucket, Key, ChecksumMode=None):
+        rows = self._db.execute('SELECT size, checksum, content_type, etag FROM _objects WHERE key = ?', (Key,))
+        if not rows:
+            raise NoSuchKey(Key)
+        size, checksum, content_type, etag = rows[0]
+        response = {'ContentLength': size, 'ContentType': content_type, 'ETag': etag}
+        if ChecksumMode == 'ENABLED' and checksum:
+            response['ChecksumSHA256'] = checksum
+        return response
+
+    def get_object(self, Bucket, Key, Range=None):
+        path, size, content_type, etag = self.open_object(Key)
+        start, end = 0, size - 1
+        if Range:
+            first, last = Range.split('=', 1)[1].split('-')
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        return {'Body': _Body(path, start, end - start + 1), 'ContentLength': end - start + 1,
+                'ContentType': content_type, 'ETag': etag}
+
+    def delete_object(self, Bucket, Key):
+        with self._db.transaction() as connection:
+            connection.execute('DELETE FROM _objects WHERE key = ?', (Key,))
+            try:
+                os.unlink(self.object_path(Key))
+            except FileNotFoundError:
+                pass
+        return {}
+
+    def delete_objects(self, Bucket, Delete):
+        for entry in Delete['Objects']:
+            self.delete_object(Bucket=Bucket, Key=entry['Key'])
+        return {} if Delete.get('Quiet') else {'Deleted': [{'Key': entry['Key']} for entry in Delete['Objects']]}
+
+    def create_multipart_upload(self, Bucket, Key, ContentType=None, ChecksumAlgorithm=None):
+        upload_id = secrets.token_urlsafe(24)
+        os.makedirs(os.path.join(self._parts, upload_id))
+        self._db.execute(
+            'INSERT INTO _uploads (upload_id, key, content_type) VALUES (?, ?, ?)',
+            (upload_id, Key, ContentType or 'binary/octet-stream')
+        )
+        return {'UploadId': upload_id, 'Key': Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        data = Body if isinstance(Body, (bytes, bytearray)) else Body.read()
+        return {'ETag': self.receive_part(UploadId, PartNumber, _Chunks(data), len(data))}
+
+    def list_parts(self, Bucket, Key, UploadId, PartNumberMarker=0, MaxParts=1000):
+        if not self._db.execute('SELECT 1 FROM _uploads WHERE upload_id = ?', (UploadId,)):
+            raise NoSuchUpload(UploadId)
+        rows = self._db.execute(
+            'SELECT part_number, etag, size, checksum FROM _parts WHERE upload_id = ? AND part_number > ? '
+            'ORDER BY part_number LIMIT ?',
+            (UploadId, PartNumberMarker, MaxParts + 1)
+        )
+        parts = [
+            {'PartNumber': number, 'ETag': etag, 'Size': size, 'ChecksumSHA256': checksum}
+            for number, etag, size, checksum in rows[:MaxParts]
+        ]
+        response = {'Parts': parts, 'IsTruncated': len(rows) > MaxParts}
+        if response['IsTruncated']:
+            response['NextPartNumberMarker'] = parts[-1]['PartNumber']
+        return response
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        uploads = self._db.execute('SELECT content_type FROM _uploads WHERE upload_id = ?', (UploadId,))
+        if not uploads:
+            raise NoSuchUpload(UploadId)
+        stored = {
+            number: (etag, size, checksum)
+            for number, etag, size, checksum in self._db.execute(
+                'SELECT part_number, etag, size, checksum FROM _parts WHERE upload_id = ?', (UploadId,)
+            )
+        }
+        requested = MultipartUpload['Parts']
+        for part in requested:
+            if part['PartNumber'] not in stored or stored[part['PartNumber']][0] != part['ETag']:
+                raise ValueError(f"InvalidPart: part {part['PartNumber']}")
+
+        path = self.object_path(Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+        try:
+            with os.fdopen(handle, 'wb') as target:
+                for part in requested:
+                    with open(self._part_path(UploadId, part['PartNumber']), 'rb') as source:
+                        _copy(source, target)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        size = sum(stored[part['PartNumber']][1] for part in requested)
+        checksum = composite_checksum([stored[part['PartNumber']][2] for part in requested])
+        # As S3 does: MD5 of the parts' binary ETags, then -<part count>
+        part_etags = b''.join(bytes.fromhex(stored[part['PartNumber']][0].strip('"')) for part in requested)
+        etag = f'"{hashlib.md5(part_etags).hexdigest()}-{len(requested)}"'
+        with self._db.transaction() as connection:
+            self._record(connection, Key, size, checksum, uploads[0][0], etag)
+        self.abort_multipart_upload(Bucket=Bucket, Key=Key, UploadId=UploadId)
+        return {'Key': Key, 'ETag': etag, 'ChecksumSHA256': checksum}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        with self._db.transaction() as connection:
+            connection.execute('DELETE FROM _parts WHERE upload_id = ?', (UploadId,))
+            connection.execute('DELETE FROM _uploads WHERE upload_id = ?', (UploadId,))
+        shutil.rmtree(os.path.join(self._parts, UploadId), ignore_errors=True)
+        return {}
+
+
+class _Chunks:
+    """bytes read like a file, for upload_part bodies"""
+
+    def __init__(self, data):
+        self._data = memoryview(data)
+        self._position = 0
+
+    def read(self, size):
+        chunk = self._data[self._position:self._position + size]
+        self._position += len(chunk)
+        return bytes(chunk)
+
+
+# URLs
+
+class LocalPresigner:
+    """Presigned-URL stand-in: HMAC-signed URLs under base_url, checked by verify() in local/serve.py.
+
+    A URL signed with a ChecksumSHA256 carries it, and the upload is refused
+    unless the body has that digest, as S3 does with a signed checksum header.
+    """
+
+    METHODS = {'get_object': 'GET', 'put_object': 'PUT', 'upload_part': 'PUT'}
+
+    def __init__(self, base_url, secret):
+        self.base_url = base_url.rstrip('/')
+        self.path_prefix = urlsplit(self.base_url).path + '/'
+        self._secret = secret
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, now=None):
+        params = Params or {}
+        query = {}
+        if ClientMethod == 'upload_part':
+            query['uploadId'] = params['UploadId']
+            query['partNumber'] = str(params['PartNumber'])
+        if params.get('ResponseContentDisposition'):
+            query['response-content-disposition'] = params['ResponseContentDisposition']
+        if params.get('ChecksumSHA256'):
+            query['checksum-sha256'] = params['ChecksumSHA256']
+        query['expires'] = str(int((now.timestamp() if now else time.time()) + ExpiresIn))
+        query['signature'] = self._signature(self.METHODS[ClientMethod], params['Key'], query)
+        return f"{self.base_url}/{quote(params['Key'], safe='/~')}?{urlencode(query)}"
+
+    def presign_parts(self, bucket, key, upload_id, part_numbers, expires_in=3600, now=None, checksums=None):
+        urls = []
+        for index, part_number in enumerate(part_numbers):
+            params = {'Bucket': bucket, 'Key': key, 'UploadId': upload_id, 'PartNumber': part_number}
+            if checksums is not None:
+                params['ChecksumSHA256'] = checksums[index]
+            urls.append(self.generate_presigned_url('upload_part', Params=params, ExpiresIn=expires_in, now=now))
+        return urls
+
+    def _signature(self, method, key, query):
+        canonical = '\n'.join([method, key] + [f'{name}={query[name]}' for name in sorted(query) if name != 'signature'])
+        digest = hmac.new(self._secret, canonical.encode('utf-8'), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+    def verify(self, method, key, query):
+        """True if query (a dict of a request's parameters) is an unexpired URL signed for method and key"""
+        try:
+            expires = int(query.get('expires', ''))
+        except ValueError:
+            return False
+        expected = self._signature(method, key, query)
+        return expires >= time.time() and hmac.compare_digest(expected, query.get('signature', ''))
+
+
+class LocalStorage:
+    """S3, DynamoDB and presigner stand-ins over one directory.
+
+    tables maps table name -> (key attribute, {index name: (hash attribute, range attribute or None)}).
+    """
+
+    def __init__(self, root, base_url, secret, tables):
+        os.makedirs(root, exist_ok=True)
+        self.database = Database(os.path.join(root, 'metadata.db'))
+        self.tables = {
+            name: SqliteTable(self.database, name, key, indexes) for name, (key, indexes) in tables.items()
+        }
+        self.dynamodb = SqliteDynamoResource(self.tables)
+        self.dynamodb_client = SqliteDynamoClient(self.tables)
+        self.s3 = DiskS3(self.database, root)
+        self.presigner = LocalPresigner(base_url, secret)
@@ -0,0 +1,203 @@
+"""In-process latency histograms and per-invocation AWS call recording.
+
+Latencies are counted in log-scale buckets, BUCKETS_PER_OCTAVE per doubling,
+so any percentile read back is within about 9% of the true value while
+a route's histogram stays a small dict of counts however many requests it
+sees. Buckets are reported with their upper bounds in milliseconds, so
+lines from different containers can be summed bucket by bucket.
+
+AwsCallRecorder hooks botocore's event system on each client it is given
+and tallies every S3, DynamoDB or Lambda call made during an invocation:
+wall time (including retries and their backoff), attempts, bytes sent and
+received, and throttled attempts. Per-call state rides in botocore's request
+context, which is shared by all attempts of one call.
+"""
+import math
+import threading
+import time
+
+BUCKETS_PER_OCTAVE = 8
+MIN_MS = 0.01
+
+
+class LatencyHistogram:
+    """Counts of latencies in log-scale buckets, with exact count, total and max"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms, error=False):
+        index = math.ceil(math.log2(max(ms, MIN_MS)) * BUCKETS_PER_OCTAVE)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.errors += error
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    @staticmethod
+    def upper_bound(index):
+        return 2 ** (index / BUCKETS_PER_OCTAVE)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples (capped at the max seen)"""
+        rank = max(math.ceil(fraction * self.count), 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.upper_bound(index), self.max_ms)
+        return self.max_ms
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0,
+            'p50_ms': round(self.percentile(0.5), 3),
+            'p90_ms': round(self.percentile(0.9), 3),
+            'p99_ms': round(self.percentile(0.99), 3),
+            'max_ms': round(self.max_ms, 3),
+            'buckets': [[round(self.upper_bound(index), 3), self.buckets[index]] for index in sorted(self.buckets)]
+        }
+
+
+# Error codes S3, DynamoDB and Lambda use when they are throttling the caller
+THROTTLING_CODES = frozenset({
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled',
+    'RequestThrottledException', 'TooManyRequestsException', 'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded', 'SlowDown',
+})
+
+
+def _body_size(body, headers):
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    length = headers.get('Content-Length') or headers.get('content-length')
+    if length:
+        return int(length)
+    # Upload bodies arrive as seekable streams (S3 wraps bytes in BytesIO); measure without reading
+    if hasattr(body, 'seek') and hasattr(body, 'tell'):
+        try:
+            position = body.tell()
+            size = body.seek(0, 2) - position
+            body.seek(position)
+            return size
+        except (OSError, ValueError):
+            pass
+    return 0
+
+
+class AwsCallRecorder:
+    """Tally of the AWS calls made by instrumented clients since the last start()"""
+
+    def __init__(self):
+        # Calls can finish on other threads (e.g. a bundle's background part uploads)
+        self._lock = threading.Lock()
+        self.start(trace=False)
+
+    def start(self, trace):
+        """Forget the previous invocation's calls; trace=True also keeps every call for trace()"""
+        self._started = time.perf_counter()
+        self._trace = [] if trace else None
+        self.calls = 0
+        self.ms = 0.0
+        self.retries = 0
+        self.throttles = 0
+        self.errors = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.operations = {}
+
+    def instrument(self, client):
+        """Register the recorder on a botocore client's events; returns the client"""
+        events = client.meta.events
+        events.register('before-call', self._before_call)
+        events.register('response-received', self._response_received)
+        events.register('after-call', self._after_call)
+        events.register('after-call-error', self._after_call_error)
+        return client
+
+    def _before_call(self, model, params, context, **kwargs):
+        context['aws_call'] = {
+            'operation': f'{model.service_model.service_name}.{model.name}',
+            'started': time.perf_counter(),
+            'attempts': 0,
+            'throttles': 0,
+            # Every attempt sends the same body
+            'body_size': _body_size(params.get('body'), params.get('headers') or {}),
+            'bytes_in': 0,
+        }
+
+    def _response_received(self, response_dict, parsed_response, context, **kwargs):
+        # Once per attempt, including ones that failed to connect
+        call = context.get('aws_call')
+        if not call:
+            return
+        call['attempts'] += 1
+        if response_dict is None:
+            return
+        # Streaming bodies (S3 GetObject) are unread here; their length is in the headers
+        call['bytes_in'] += _body_size(response_dict.get('body'), response_dict.get('headers') or {})
+        if (parsed_response or {}).get('Error', {}).get('Code') in THROTTLING_CODES:
+            call['throttles'] += 1
+
+    def _after_call(self, http_response, parsed, context, **kwargs):
+        error = parsed.get('Error', {}).get('Code') if http_response.status_code >= 300 else None
+        self._finish(context, http_response.status_code, error)
+
+    def _after_call_error(self, exception, context, **kwargs):
+        self._finish(context, None, type(exception).__name__)
+
+    def _finish(self, context, status, error):
+        call = context.pop('aws_call', None)
+        if not call:
+            return
+        ms = (time.perf_counter() - call['started']) * 1000
+        attempts = max(call['attempts'], 1)
+        retries = attempts - 1
+        bytes_out = call['body_size'] * attempts
+        
+        with self._lock:
+            self.calls += 1
+            self.ms += ms
+            self.retries += retries
+            self.throttles += call['throttles']
+            self.errors += error is not None
+            self.bytes_out += bytes_out
+            self.bytes_in += call['bytes_in']
+            count, total_ms = self.operations.get(call['operation'], (0, 0.0))
+            self.operations[call['operation']] = (count + 1, total_ms + ms)
+        
+            if self._trace is not None:
+                self._trace.append({
+                    'operation': call['operation'],
+                    'at_ms': round((call['started'] - self._started) * 1000, 3),
+                    'ms': round(ms, 3),
+                    'status': status,
+                    'error': error,
+                    'retries': retries,
+                    'throttles': call['throttles'],
+                    'bytes_out': bytes_out,
+                    'bytes_in': call['bytes_in'],
+                })
+
+    def summary(self):
+        """Compact totals for a response log line, with {operation: [count, ms]}"""
+        return {
+            'calls': self.calls,
+            'ms': round(self.ms, 3),
+            'retries': self.retries,
+            'throttles': self.throttles,
+            'errors': self.errors,
+            'bytes_out': self.bytes_out,
+            'bytes_in': self.bytes_in,
+            'operations': {name: [count, round(ms, 3)] for name, (count, ms) in self.operations.items()},
+        }
+
+    def trace(self):
+        """Every call since start(trace=True), in order, or None when not tracing"""
+        return self._trace
@@ -0,0 +1,177 @@
+"""Bulk SigV4 presigner for S3 URLs.
+
+botocore runs the full request-building pipeline (parameter validation,
+serialization, endpoint rules, event hooks) for every generate_presigned_url
+call. A multipart upload needs hundreds of part URLs per request, so this
+module signs them directly: the SigV4 signing key is derived once per
+day/region/service and cached, and only the canonical request and signature
+are computed per URL.
+
+The output is byte-for-byte what an s3v4-configured botocore client returns
+(local/bench_presign.py checks this). Anything the fast path does not model
+is handed back to botocore.
+"""
+import hashlib
+import hmac
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+
+ALGORITHM = 'AWS4-HMAC-SHA256'
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+SERVICE = 's3'
+
+# Operation -> (HTTP method, {param: (query key or header name, location)}),
+# in the order botocore serializes them
+OPERATIONS = {
+    'put_object': ('PUT', {'ContentType': ('content-type', 'header'), 'ChecksumSHA256': ('x-amz-checksum-sha256', 'header')}),
+    'upload_part': ('PUT', {
+        'UploadId': ('uploadId', 'query'),
+        'PartNumber': ('partNumber', 'query'),
+        'ChecksumSHA256': ('x-amz-checksum-sha256', 'header'),
+    }),
+    'get_object': ('GET', {'ResponseContentDisposition': ('response-content-disposition', 'query')}),
+}
+
+
+def _quote(value):
+    return quote(str(value), safe='-_.~')
+
+
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+
+class Presigner:
+    """Drop-in replacement for client.generate_presigned_url on an s3v4 S3 client"""
+
+    def __init__(self, client):
+        self._client = client
+        self._region = client.meta.region_name
+        self._endpoints = {}
+        self._signing_keys = {}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, now=None):
+        params = Params or {}
+        if not self._supports(ClientMethod, params):
+            return self._client.generate_presigned_url(ClientMethod, Params=params, ExpiresIn=ExpiresIn)
+        return self._sign(ClientMethod, params, ExpiresIn, self._context(now))
+
+    def presign_parts(self, bucket, key, upload_id, part_numbers, expires_in=3600, now=None, checksums=None):
+        """upload_part URLs for many parts, sharing credentials, timestamp and signing key.
+
+        checksums, if given, holds each part's base64 SHA-256 in part_numbers
+        order; it is signed into the URL so S3 rejects any other bytes.
+        """
+        part_params = []
+        for index, part_num in enumerate(part_numbers):
+            params = {'Bucket': bucket, 'Key': key, 'UploadId': upload_id, 'PartNumber': part_num}
+            if checksums is not None:
+                params['ChecksumSHA256'] = checksums[index]
+            part_params.append(params)
+
+        if not self._endpoint(bucket):
+            return [
+                self._client.generate_presigned_url('upload_part', Params=params, ExpiresIn=expires_in)
+                for params in part_params
+            ]
+        context = self._context(now)
+        return [self._sign('upload_part', params, expires_in, context) for params in part_params]
+
+    def _supports(self, client_method, params):
+        operation = OPERATIONS.get(client_method)
+        if not operation or 'Bucket' not in params or 'Key' not in params:
+            return False
+        if set(params) - {'Bucket', 'Key'} - set(operation[1]):
+            return False
+        return self._endpoint(params['Bucket']) is not None
+
+    def _endpoint(self, bucket):
+        """(base URL, canonical path prefix, host) for a bucket, or None if the client is not s3v4.
+
+        Endpoint resolution (virtual-hosted vs path style, custom endpoints)
+        is left to botocore: one throwaway URL per bucket tells us the layout.
+        """
+        if bucket not in self._endpoints:
+            probe = self._client.generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': '_'}, ExpiresIn=1)
+            parts = urlsplit(probe)
+            if 'X-Amz-Algorithm=' not in parts.query or not parts.path.endswith('/_'):
+                self._endpoints[bucket] = None
+            else:
+                prefix = parts.path[:-1]
+                host = parts.hostname
+                if parts.port is not None and parts.port != {'http': 80, 'https': 443}.get(parts.scheme):
+                    host = f'{host}:{parts.port}'
+                self._endpoints[bucket] = (f'{parts.scheme}://{parts.netloc}{prefix}', prefix, host)
+        return self._endpoints[bucket]
+
+    def _context(self, now):
+        credentials = self._client._get_credentials().get_frozen_credentials()
+        now = now or datetime.now(timezone.utc)
+        datestamp = now.strftime('%Y%m%d')
+        scope = f'{datestamp}/{self._region}/{SERVICE}/aws4_request'
+        return {
+            'credentials': credentials,
+            'amz_date': now.strftime('%Y%m%dT%H%M%SZ'),
+            'scope': scope,
+            'credential': _quote(f'{credentials.access_key}/{scope}'),
+            'signing_key': self._signing_key(credentials.secret_key, datestamp),
+        }
+
+    def _signing_key(self, secret_key, datestamp):
+        cache_key = (secret_key, datestamp, self._region)
+        key = self._signing_keys.get(cache_key)
+        if key is None:
+            if len(self._signing_keys) > 4:
+                self._signing_keys.clear()
+            key = _hmac(('AWS4' + secret_key).encode('utf-8'), datestamp)
+            key = _hmac(key, self._region)
+            key = _hmac(key, SERVICE)
+            key = _hmac(key, 'aws4_request')
+            self._signing_keys[cache_key] = key
+        return key
+
+    def _sign(self, client_method, params, expires_in, context):
+        method, fields = OPERATIONS[client_method]
+        base_url, prefix, host = self._endpoint(params['Bucket'])
+        path = quote(params['Key'], safe='/~')
+
+        headers = {'host': host}
+        operation_query = []
+        for name, (target, location) in fields.items():
+            if name not in params:
+                continue
+            if location == 'header':
+                headers[target] = ' '.join(str(params[name]).split())
+            else:
+                operation_query.append((target, _quote(params[name])))
+        signed_headers = ';'.join(sorted(headers))
+
+        auth_query = [
+            ('X-Amz-Algorithm', ALGORITHM),
+            ('X-Amz-Credential', context['credential']),
+            ('X-Amz-Date', context['amz_date']),
+            ('X-Amz-Expires', str(expires_in)),
+            ('X-Amz-SignedHeaders', _quote(signed_headers)),
+        ]
+        if context['credentials'].token is not None:
+            auth_query.append(('X-Amz-Security-Token', _quote(context['credentials'].token)))
+
+        query = operation_query + auth_query
+        canonical_request = '\n'.join([
+            method,
+            prefix + path,
+            '&'.join(f'{k}={v}' for k, v in sorted(query)),
+            ''.join(f'{name}:{headers[name]}\n' for name in sorted(headers)),
+            signed_headers,
+            UNSIGNED_PAYLOAD,
+        ])
+        string_to_sign = '\n'.join([
+            ALGORITHM,
+            context['amz_date'],
+            context['scope'],
+            hashlib.sha256(canonical_request.encode('utf-8')).hexdigest(),
+        ])
+        signature = hmac.new(context['signing_key'], string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+        query_string = '&'.join(f'{k}={v}' for k, v in query)
+        return f'{base_url}{path}?{query_string}&X-Amz-Signature={signature}'
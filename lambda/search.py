@@ -0,0 +1,70 @@
+"""Filename search over an n-gram index kept next to the files table.
+
+Every file has one posting per distinct gram of its casefolded filename:
+each trigram ('t:abc'), plus the first one and two characters of each word
+('p:a', 'p:ab') so that queries shorter than a trigram still have a key to
+look up. A posting repeats the file's listing attributes, so a search never
+reads the files table, and the search table's GramIndex returns a gram's
+postings newest first.
+
+Any one of a query's posting lists holds every match: a filename containing
+the query contains each of its grams, and the posting carries the filename
+to check the whole query against. The handler probes the first page of a
+few of the query's grams and reads on from the sparsest, the one whose page
+reaches furthest back in time; a list that ends within its first page is
+complete, and no further probes are needed.
+"""
+import re
+
+GRAM = 3
+PREFIX_LENGTHS = (1, 2)
+WORD_SEPARATORS = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    """Query and filename text as the index compares it"""
+    return ' '.join(text.split()).casefold()
+
+
+def filename_grams(filename):
+    """Every gram a filename is indexed under"""
+    name = normalize(filename)
+    grams = {f't:{name[index:index + GRAM]}' for index in range(len(name) - GRAM + 1)}
+    for word in WORD_SEPARATORS.split(name):
+        grams.update(f'p:{word[:length]}' for length in PREFIX_LENGTHS if len(word) >= length)
+    return grams
+
+
+def posting_key(gram, file_id):
+    """Search table key of one file's posting under one gram"""
+    return f'{gram}#{file_id}'
+
+
+def query_grams(query, limit):
+    """At most limit grams to probe for a normalized query, spread across it from first to last"""
+    if len(query) < GRAM:
+        return [f'p:{query}']
+    grams = list(dict.fromkeys(query[index:index + GRAM] for index in range(len(query) - GRAM + 1)))
+    if len(grams) > limit:
+        grams = [grams[round(step * (len(grams) - 1) / (limit - 1))] for step in range(limit)]
+    return [f't:{gram}' for gram in grams]
+
+
+def match_rank(filename, query):
+    """How a filename matches a normalized query, lower is better, or None if it doesn't.
+
+    0: the whole name, 1: the start of the name, 2: the start of a word,
+    3: elsewhere. Queries shorter than a trigram only match word starts,
+    which is all the prefix grams index.
+    """
+    name = normalize(filename)
+    position = name.find(query)
+    if position < 0:
+        return None
+    if name == query:
+        return 0
+    if position == 0:
+        return 1
+    if re.search(r'(?<![^\W_])' + re.escape(query), name):
+        return 2
+    return 3 if len(query) >= GRAM else None
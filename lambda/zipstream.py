@@ -0,0 +1,186 @@
+"""Streaming ZIP64 writer for bundling archive files.
+
+Entries are written in store mode (movies don't compress) with a data
+descriptor after each file, so nothing needs to be known up front: file
+bytes go straight from a chunk iterator to a sink while the CRC-32 is
+computed on the way through. Only the central directory (a few dozen bytes
+per entry) is kept in memory, so memory use does not depend on file sizes.
+
+Every archive is written as ZIP64, so there are no 4 GiB or 65535-entry
+limits. S3MultipartSink streams the archive into an S3 object one part at a
+time, uploading each part in the background while the next one fills, so
+reading the source objects overlaps with writing the archive; iter_object
+reads source objects in ranged chunks.
+"""
+import re
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ZIP64_LIMIT = 0xFFFFFFFF
+VERSION = 45  # 4.5: ZIP64
+VERSION_MADE_BY = (3 << 8) | VERSION  # Unix host, so EXTERNAL_ATTR holds a file mode
+FLAGS = 0x0008 | 0x0800  # data descriptor follows; UTF-8 names
+EXTERNAL_ATTR = 0o100644 << 16  # regular file, rw-r--r--
+
+# Entry names are reduced to one path component (see safe_name)
+DRIVE_PREFIX = re.compile(r'^[A-Za-z]:')
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_PART_SIZE = 16 * 1024 * 1024  # S3 parts must be at least 5 MiB
+
+
+def _dos_datetime(when):
+    when = max(when, datetime(1980, 1, 1))
+    return (
+        (when.hour << 11) | (when.minute << 5) | (when.second // 2),
+        ((when.year - 1980) << 9) | (when.month << 5) | when.day,
+    )
+
+
+def safe_name(name):
+    """The last path component of name, without a drive prefix, so no entry extracts outside the target"""
+    name = DRIVE_PREFIX.sub('', name.replace('\\', '/').rsplit('/', 1)[-1]).replace('\x00', '').strip()
+    return name if name not in ('', '.', '..') else 'file'
+
+
+class ZipStreamWriter:
+    """Write a store-mode ZIP64 archive to sink, which only needs a write(bytes) method"""
+
+    def __init__(self, sink):
+        self._sink = sink
+        self._offset = 0
+        self._entries = []
+        self._names = set()
+
+    def _write(self, data):
+        self._sink.write(data)
+        self._offset += len(data)
+
+    def unique_name(self, name):
+        """name, or 'name (2).ext' style if an entry already has it"""
+        candidate = name
+        stem, dot, ext = name.rpartition('.')
+        if not dot:
+            stem, ext = name, ''
+        counter = 2
+        while candidate in self._names:
+            candidate = f'{stem} ({counter}).{ext}' if dot else f'{stem} ({counter})'
+            counter += 1
+        return candidate
+
+    def add(self, name, chunks, modified=None):
+        """Add an entry whose content is the concatenation of chunks; returns the name used"""
+        name = self.unique_name(safe_name(name))
+        self._names.add(name)
+        encoded = name.encode('utf-8')
+        dos_time, dos_date = _dos_datetime(modified or datetime.utcnow())
+        header_offset = self._offset
+
+        # Sizes and CRC are unknown yet: zero here, real values in the descriptor
+        extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+        self._write(struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, VERSION, FLAGS, 0, dos_time, dos_date,
+            0, ZIP64_LIMIT, ZIP64_LIMIT, len(encoded), len(extra)
+        ) + encoded + extra)
+
+        crc = 0
+        size = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            self._write(chunk)
+
+        self._write(struct.pack('<IIQQ', 0x08074b50, crc, size, size))
+        self._entries.append((encoded, dos_time, dos_date, crc, size, header_offset))
+        return name
+
+    def close(self):
+        """Write the central directory and end records; returns the archive size"""
+        directory_offset = self._offset
+        for encoded, dos_time, dos_date, crc, size, header_offset in self._entries:
+            # Values that don't fit 32 bits move to the ZIP64 extra field, in this order
+            zip64 = [value for value in (size, size, header_offset) if value >= ZIP64_LIMIT]
+            extra = struct.pack(f'<HH{len(zip64)}Q', 0x0001, 8 * len(zip64), *zip64) if zip64 else b''
+            self._write(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, VERSION_MADE_BY, VERSION, FLAGS, 0, dos_time, dos_date, crc,
+                min(size, ZIP64_LIMIT), min(size, ZIP64_LIMIT), len(encoded), len(extra), 0, 0, 0,
+                EXTERNAL_ATTR, min(header_offset, ZIP64_LIMIT)
+            ) + encoded + extra)
+        directory_size = self._offset - directory_offset
+
+        count = len(self._entries)
+        zip64_end_offset = self._offset
+        self._write(struct.pack(
+            '<IQHHIIQQQQ', 0x06064b50, 44, VERSION, VERSION, 0, 0, count, count, directory_size, directory_offset
+        ))
+        self._write(struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1))
+        self._write(struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            min(directory_size, ZIP64_LIMIT), min(directory_offset, ZIP64_LIMIT), 0
+        ))
+        return self._offset
+
+
+def iter_object(client, bucket, key, size, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield an S3 object's bytes with one ranged GET per chunk"""
+    for start in range(0, size, chunk_size):
+        end = min(start + chunk_size, size) - 1
+        response = client.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end}')
+        yield response['Body'].read()
+
+
+class S3MultipartSink:
+    """Buffer writes into parts of part_size and upload each as soon as it fills.
+
+    One part at a time uploads on a background thread while the caller fills
+    the next, so at most two parts are held in memory.
+    """
+
+    def __init__(self, client, bucket, key, part_size=DEFAULT_PART_SIZE, **create_args):
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._part_size = part_size
+        self._buffer = bytearray()
+        self._parts = []
+        self._uploading = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._upload_id = client.create_multipart_upload(Bucket=bucket, Key=key, **create_args)['UploadId']
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self._part_size:
+            self._upload_part(bytes(self._buffer[:self._part_size]))
+            del self._buffer[:self._part_size]
+
+    def _upload_part(self, body):
+        self._wait()
+        part_number = len(self._parts) + 1
+        self._uploading = (part_number, self._executor.submit(
+            self._client.upload_part,
+            Bucket=self._bucket, Key=self._key, UploadId=self._upload_id, PartNumber=part_number, Body=body
+        ))
+
+    def _wait(self):
+        """Finish the part in flight, if any, raising its error"""
+        if self._uploading:
+            part_number, future = self._uploading
+            self._uploading = None
+            self._parts.append({'PartNumber': part_number, 'ETag': future.result()['ETag']})
+
+    def close(self):
+        if self._buffer or not (self._parts or self._uploading):
+            self._upload_part(bytes(self._buffer))
+            self._buffer.clear()
+        self._wait()
+        self._executor.shutdown()
+        self._client.complete_multipart_upload(
+            Bucket=self._bucket, Key=self._key, UploadId=self._upload_id, MultipartUpload={'Parts': self._parts}
+        )
+
+    def abort(self):
+        # Let the part in flight finish first, or it could land after the abort
+        self._executor.shutdown()
+        self._client.abort_multipart_upload(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id)
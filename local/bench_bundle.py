@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Stream ZIP bundles through an in-memory S3 stand-in and report throughput
+and peak RSS. The small bundle is unpacked with zipfile and compared
+byte for byte; larger ones only keep the archive's tail, so the source
+objects and the output never sit in memory and any growth in peak RSS
+comes from the streaming path itself. The largest bundle crosses the
+4 GiB ZIP64 limits.
+
+The in-memory runs only measure CPU cost. The modelled run adds S3's
+per-request latency and single-connection throughput to every ranged GET
+and part upload, which is what bounds a real bundler, and reports how much
+fits in the bundler function's timeout; handler.MAX_BUNDLE_BYTES is set
+from it with headroom.
+"""
+import hashlib
+import io
+import os
+import resource
+import sys
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda'))
+
+from zipstream import DEFAULT_CHUNK_SIZE, S3MultipartSink, ZipStreamWriter, iter_object
+
+MiB = 1024 * 1024
+GiB = 1024 * MiB
+BLOCK = MiB  # DEFAULT_CHUNK_SIZE is a multiple, so every ranged read starts on a block
+TAIL = 4 * MiB
+
+# Modelled S3 as seen from Lambda: time to first byte, and throughput of one connection
+S3_LATENCY = 0.03
+S3_STREAM_RATE = 90 * MiB
+BUNDLE_TIMEOUT = 900  # the bundler function's timeout (terraform/main.tf)
+
+
+class FakeS3:
+    """get_object with Range over generated objects, and multipart uploads into a recorder"""
+
+    def __init__(self, keep_output, modelled=False):
+        self.sizes = {}
+        self.keep_output = keep_output
+        self.modelled = modelled
+        self.output = bytearray()
+        self.output_size = 0
+
+    def _transfer(self, length):
+        if self.modelled:
+            time.sleep(S3_LATENCY + length / S3_STREAM_RATE)
+
+    def put(self, key, size):
+        self.sizes[key] = size
+
+    def content(self, key, size):
+        return (self._block(key) * (size // BLOCK + 1))[:size]
+
+    def _block(self, key):
+        seed = hashlib.sha256(key.encode()).digest()
+        return (seed * (BLOCK // len(seed)))[:BLOCK]
+
+    def get_object(self, Bucket, Key, Range):
+        start, end = (int(value) for value in Range[len('bytes='):].split('-'))
+        length = end - start + 1
+        self._transfer(length)
+        block = self._block(Key)
+        return {'Body': io.BytesIO(block * (length // BLOCK) + block[:length % BLOCK])}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        return {'UploadId': 'bench'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._transfer(len(Body))
+        self.output_size += len(Body)
+        self.output += Body
+        if not self.keep_output:
+            del self.output[:max(len(self.output) - TAIL, 0)]
+        return {'ETag': f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, **kwargs):
+        pass
+
+    def abort_multipart_upload(self, **kwargs):
+        pass
+
+
+class TailFile(io.RawIOBase):
+    """Seekable view of an archive of which only the last bytes were kept (enough for zipfile to read the directory)"""
+
+    def __init__(self, tail, size):
+        self._tail = bytes(tail)
+        self._size = size
+        self._position = 0
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self._size}[whence]
+        self._position = base + offset
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def read(self, n=-1):
+        start = self._position - (self._size - len(self._tail))
+        if start < 0:
+            raise IOError('read before the kept tail')
+        end = len(self._tail) if n < 0 else start + n
+        data = self._tail[start:end]
+        self._position += len(data)
+        return data
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(file_sizes, verify, modelled=False):
+    client = FakeS3(keep_output=verify, modelled=modelled)
+    for index, size in enumerate(file_sizes):
+        client.put(f'blobs/{index}', size)
+
+    start = time.perf_counter()
+    sink = S3MultipartSink(client, 'bench', 'bundles/bench.zip')
+    writer = ZipStreamWriter(sink)
+    for index, size in enumerate(file_sizes):
+        writer.add(f'file {index}.mkv', iter_object(client, 'bench', f'blobs/{index}', size))
+    archive_size = writer.close()
+    sink.close()
+    elapsed = time.perf_counter() - start
+
+    assert archive_size == client.output_size
+    archive = zipfile.ZipFile(io.BytesIO(bytes(client.output)) if verify else TailFile(client.output, archive_size))
+    infos = archive.infolist()
+    assert [info.file_size for info in infos] == list(file_sizes)
+    if verify:
+        assert archive.testzip() is None
+        for index, info in enumerate(infos):
+            assert archive.read(info) == client.content(f'blobs/{index}', file_sizes[index])
+    return archive_size, elapsed, max(info.header_offset for info in infos)
+
+
+if __name__ == '__main__':
+    # Verified last: it keeps the whole archive in memory
+    runs = [
+        ('40 files, 1 GiB', [25 * MiB + 3] * 39 + [24 * MiB], False),
+        ('8 files, 6 GiB (ZIP64)', [768 * MiB + 1] * 8, False),
+        ('40 files, 64 MiB, verified', [1 * MiB + 17 * index for index in range(39)] + [24 * MiB], True),
+    ]
+    print(f"Read chunk {DEFAULT_CHUNK_SIZE // MiB} MiB; baseline peak RSS {peak_rss_mb():.0f} MiB\n")
+    for label, file_sizes, verify in runs:
+        archive_size, elapsed, last_offset = run(file_sizes, verify)
+        print(
+            f"{label:28} {archive_size / MiB:8.0f} MiB in {elapsed:6.2f}s  "
+            f"{archive_size / MiB / elapsed:7.0f} MiB/s  peak RSS {peak_rss_mb():5.0f} MiB  "
+            f"last entry at offset {last_offset / MiB:.0f} MiB"
+        )
+
+    archive_size, elapsed, _ = run([64 * MiB + 5] * 16, False, modelled=True)
+    print(
+        f"\nModelled S3 ({S3_LATENCY * 1000:.0f} ms per request, {S3_STREAM_RATE / MiB:.0f} MiB/s per connection): "
+        f"{archive_size / MiB:.0f} MiB in {elapsed:.2f}s, {archive_size / MiB / elapsed:.0f} MiB/s, "
+        f"{archive_size / elapsed * BUNDLE_TIMEOUT / GiB:.0f} GiB in the {BUNDLE_TIMEOUT}s bundler timeout"
+    )
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Compare turning files table Query pages into /files entries the resource
+API's way (boto3's TransformationInjector deserializing every attribute
+into Decimals, then int() on each size) against dynamocodec.listing_entry
+on the low-level client's output. Pages are generated JSON bodies, parsed
+with json.loads in both paths, so only the decoding differs. Runs offline.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda'))
+
+import botocore.session
+from boto3.dynamodb.transform import TransformationInjector
+
+from dynamocodec import listing_entry
+
+
+def make_pages(count, page_size):
+    """Query response bodies as DynamoDB sends them, newest first"""
+    pages = []
+    for start in range(0, count, page_size):
+        items = []
+        for index in range(start, min(start + page_size, count)):
+            item = {
+                'file_id': {'S': f'user{index % 50}/2026-01-01T00:00:00.{index:06d}_movie {index}.mkv'},
+                'filename': {'S': f'movie {index}.mkv'},
+                'size': {'N': str(700 * 1024 * 1024 + index * 4099)},
+                'uploaded_at': {'S': f'2026-01-01T00:00:00.{index:06d}'},
+                'username': {'S': f'user{index % 50}'},
+            }
+            if index % 4:
+                item['content_type'] = {'S': 'video/x-matroska'}
+            items.append(item)
+        pages.append(json.dumps({'Items': items, 'Count': len(items), 'ScannedCount': len(items)}))
+    return pages
+
+
+def resource_api(pages, injector, operation):
+    files = []
+    for page in pages:
+        response = json.loads(page)
+        injector.inject_attribute_value_output(response, operation)
+        for item in response.get('Items', []):
+            files.append({
+                'file_id': item['file_id'],
+                'filename': item['filename'],
+                'size': int(item['size']),
+                'uploaded_at': item['uploaded_at'],
+                'uploaded_by': item['username'],
+                'content_type': item.get('content_type', 'application/octet-stream')
+            })
+    return files
+
+
+def low_level_codec(pages):
+    files = []
+    for page in pages:
+        response = json.loads(page)
+        files.extend(listing_entry(item) for item in response.get('Items', []))
+    return files
+
+
+def parse_only(pages):
+    return [json.loads(page) for page in pages]
+
+
+def measure(label, function, count, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    best = min(timings)
+    print(f"{label:24} {best * 1000:8.1f} ms  {count / best / 1000:8.0f}k items/s  peak alloc {peak / 2 ** 20:6.1f} MiB")
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    pages = make_pages(args.items, args.page_size)
+    operation = botocore.session.get_session().get_service_model('dynamodb').operation_model('Query')
+    injector = TransformationInjector()
+
+    print(f"{args.items} items in pages of {args.page_size}, best of {args.runs}\n")
+    _, parse_time = measure('json.loads only', lambda: parse_only(pages), args.items, args.runs)
+    expected, resource_time = measure(
+        'resource API', lambda: resource_api(pages, injector, operation), args.items, args.runs
+    )
+    actual, codec_time = measure('client + dynamocodec', lambda: low_level_codec(pages), args.items, args.runs)
+
+    # Same entries, same JSON body
+    assert actual == expected
+    assert json.dumps(actual) == json.dumps(expected)
+    print(
+        f"\n✓ Identical output; {resource_time / codec_time:.1f}x faster overall, "
+        f"{(resource_time - parse_time) / (codec_time - parse_time):.1f}x faster past parsing"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+"""
+Benchmark every endpoint of lambda_handler offline, against the in-memory
+AWS stand-ins in fakeaws.py, with an archive seeded at several sizes.
+
+Each size runs in a fresh interpreter: the archive is seeded, every bench
+user logs in, and a weighted mix of client actions (listing pages, per-user
+listings, searches, change feed syncs,
+downloads, duplicate checks, simple and multipart uploads, deletes, bundles) drives
+API Gateway-shaped events through lambda_handler. Latency is measured
+around each call; a second, shorter pass runs under tracemalloc to measure
+allocations per request. Results go to a JSON file named after the commit,
+and --compare prints the change against an earlier one.
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+LOCAL_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(LOCAL_DIR, 'bench-results')
+
+ENV = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'BUCKET_NAME': 'bench-files',
+    'USERS_TABLE': 'bench-users',
+    'FILES_TABLE': 'bench-files',
+    'META_TABLE': 'bench-meta',
+    'UPLOADS_TABLE': 'bench-uploads',
+    'BLOBS_TABLE': 'bench-blobs',
+    'SEARCH_TABLE': 'bench-search',
+    'TOKEN_SIGNING_KEYS': 'bench:bench-signing-key',
+}
+
+USERS = [f'user{index:02d}' for index in range(50)]
+PASSWORD = 'bench'
+CONTENT_TYPES = ['video/mp4', 'video/x-matroska', 'video/quicktime', 'application/pdf', 'image/jpeg']
+MiB = 1024 * 1024
+# Only the newest files get search postings (about 18 each); the in-memory
+# fakes can't hold an index of the largest archives. Search cost is bounded
+# by SEARCH_MAX_CANDIDATES, so the newest files are what queries reach anyway.
+SEARCH_SEED_FILES = 20000
+
+# Relative frequency of each client action
+MIX = {
+    'list_first_page': 30,
+    'list_next_page': 10,
+    'list_own_files': 4,
+    'search': 8,
+    'sync_changes': 8,
+    'download': 22,
+    'download_batch': 5,
+    'check_duplicate': 3,
+    'check_duplicate_batch': 6,
+    'upload_simple': 8,
+    'upload_multipart': 2,
+    'delete': 5,
+    'delete_batch': 2,
+    'bundle': 2,
+    'login': 5,
+}
+
+# Valid base64 SHA-256 values for multipart part checksums
+PART_CHECKSUMS = [base64.b64encode(hashlib.sha256(str(index).encode()).digest()).decode() for index in range(64)]
+
+
+def seed(handler, fakes, count):
+    """count files from USERS, one blob each, uploaded a minute apart"""
+    started = datetime(2020, 1, 1)
+    files, blobs = [], []
+    for index in range(count):
+        username = USERS[index % len(USERS)]
+        file_hash = hashlib.sha256(index.to_bytes(8, 'big')).hexdigest()
+        uploaded_at = (started + timedelta(minutes=index)).isoformat()
+        filename = f'movie {index}.mkv'
+        file_id = f'{username}/{uploaded_at}_{filename}'
+        blob_key = handler.BLOB_PREFIX + file_hash
+        size = 50 * MiB + index * 7919 % (4096 * MiB)
+        files.append({
+            'file_id': file_id, 'username': username, 'filename': filename, 'file_hash': file_hash,
+            'blob_key': blob_key, 'size': size, 'content_type': CONTENT_TYPES[index % len(CONTENT_TYPES)],
+            'uploaded_at': uploaded_at, 'listing': handler.LISTING_PARTITION,
+        })
+        blobs.append({'file_hash': file_hash, 'blob_key': blob_key, 'size': size, 'ref_count': 1, 'refs': {file_id}})
+    # Objects from before checksums were required: no stored SHA-256
+    fakes.s3.objects.update((item['blob_key'], (item['size'], None)) for item in files)
+    fakes.tables[handler.FILES_TABLE].load(files)
+    fakes.tables[handler.BLOBS_TABLE].load(blobs)
+    fakes.tables[handler.SEARCH_TABLE].load(
+        posting for item in files[-SEARCH_SEED_FILES:] for posting in handler.search_postings(item)
+    )
+    password_hash = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    fakes.tables[handler.USERS_TABLE].load({'username': user, 'password_hash': password_hash} for user in USERS)
+    return [item['file_id'] for item in files], [item['file_hash'] for item in files]
+
+
+class Client:
+    """Plays a browser client: builds API Gateway events, times lambda_handler, keeps state between actions"""
+
+    def __init__(self, handler, fakes, file_ids, file_hashes, rng):
+        self.handler = handler
+        self.fakes = fakes
+        self.file_ids = file_ids
+        self.file_hashes = file_hashes
+        self.rng = rng
+        self.tokens = {}
+        self.uploaded = {user: [] for user in USERS}
+        self.cursors = []
+        self.etags = {}
+        self.changes_cursors = {}
+        self.latencies = {}
+        self.statuses = {}
+        self.recorder = None
+        self.last_headers = {}
+        self._next_hash = 0
+
+    def send(self, method, path, username=None, body=None, query=None, extra_headers=None):
+        headers = {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'Host': 'api.bench.local',
+            'User-Agent': 'Mozilla/5.0 (bench)',
+            'X-Forwarded-For': '203.0.113.7',
+        }
+        if username:
+            headers['Authorization'] = f'Bearer {self.tokens[username]}'
+        headers.update(extra_headers or {})
+        event = {
+            'resource': path,
+            'path': path,
+            'httpMethod': method,
+            'headers': headers,
+            'queryStringParameters': query,
+            'body': json.dumps(body) if body is not None else None,
+            'isBase64Encoded': False,
+            'requestContext': {'stage': 'prod', 'httpMethod': method, 'path': f'/prod{path}'},
+        }
+        name = f'{method} {path}'
+        if self.recorder:
+            response = self.recorder(name, event)
+        else:
+            started = time.perf_counter()
+            response = self.handler.lambda_handler(event, None)
+            self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+        statuses = self.statuses.setdefault(name, {})
+        statuses[response['statusCode']] = statuses.get(response['statusCode'], 0) + 1
+        self.last_headers = response['headers']
+        return response['statusCode'], json.loads(response['body']) if response['body'] else None
+
+    def user(self):
+        return self.rng.choice(USERS)
+
+    def new_hash(self):
+        self._next_hash += 1
+        return hashlib.sha256(b'new' + self._next_hash.to_bytes(8, 'big')).hexdigest()
+
+    # Actions
+
+    def login(self, username=None):
+        username = username or self.user()
+        _, body = self.send('POST', '/login', body={'username': username, 'password': PASSWORD})
+        self.tokens[username] = body['token']
+
+    def list_first_page(self):
+        """Revalidated with the user's last ETag, as a browser does"""
+        username = self.user()
+        conditional = {'If-None-Match': self.etags[username]} if self.etags.get(username) else None
+        status, body = self.send('GET', '/files', username, query={'limit': '100'}, extra_headers=conditional)
+        self.etags[username] = self.last_headers.get('ETag')
+        if status == 304:
+            return
+        if body.get('next_cursor') and len(self.cursors) < 1000:
+            self.cursors.append(body['next_cursor'])
+
+    def list_next_page(self):
+        if not self.cursors:
+            return self.list_first_page()
+        _, body = self.send('GET', '/files', self.user(), query={'limit': '100', 'cursor': self.rng.choice(self.cursors)})
+        if body.get('next_cursor') and len(self.cursors) < 1000:
+            self.cursors.append(body['next_cursor'])
+
+    def list_own_files(self):
+        """A user's own uploads, first page then sometimes the next"""
+        username = self.user()
+        _, body = self.send('GET', '/files', username, query={'limit': '100', 'owner': username})
+        if body.get('next_cursor') and self.rng.random() < 0.3:
+            self.send('GET', '/files', username, query={'limit': '100', 'owner': username, 'cursor': body['next_cursor']})
+
+    def sync_changes(self):
+        """Follow the change feed from the user's last cursor, as the web UI does after its own writes"""
+        username = self.user()
+        since = self.changes_cursors.get(username)
+        while True:
+            status, body = self.send('GET', '/files/changes', username, query={'since': since} if since else None)
+            if status != 200:
+                self.changes_cursors.pop(username, None)
+                return
+            since = self.changes_cursors[username] = body['cursor']
+            if not body['has_more']:
+                return
+
+    def search(self):
+        """Part of a recent file's name, sometimes filtered, then the second page if there is one"""
+        number = str(len(self.file_ids) - 1 - self.rng.randrange(min(len(self.file_ids), SEARCH_SEED_FILES)))
+        query = {'q': f'movie {number[:self.rng.randint(1, len(number))]}', 'limit': '50'}
+        if self.rng.random() < 0.3:
+            query['content_type'] = 'video/'
+        if self.rng.random() < 0.2:
+            query['uploader'] = self.user()
+        username = self.user()
+        _, body = self.send('GET', '/search', username, query=query)
+        if body.get('next_cursor'):
+            self.send('GET', '/search', username, query=dict(query, cursor=body['next_cursor']))
+
+    def download(self):
+        self.send('GET', '/download', self.user(), query={'file_id': self.rng.choice(self.file_ids)})
+
+    def download_batch(self):
+        self.send('POST', '/download-batch', self.user(), body={'file_ids': self.rng.sample(self.file_ids, 25)})
+
+    def check_duplicate(self):
+        file_hash = self.rng.choice(self.file_hashes) if self.rng.random() < 0.5 else self.new_hash()
+        self.send('POST', '/check-duplicate', self.user(), body={'file_hash': file_hash})
+
+    def check_duplicate_batch(self):
+        hashes = self.rng.sample(self.file_hashes, 25) + [self.new_hash() for _ in range(25)]
+        self.send('POST', '/check-duplicate-batch', self.user(), body={'file_hashes': hashes})
+
+    def upload_simple(self):
+        """Three files, one of them already stored: /upload, PUT to S3, /upload-complete-batch"""
+        username = self.user()
+        files = []
+        for index in range(3):
+            if index == 0:
+                # The same content, so the same size as the stored blob
+                file_hash = self.rng.choice(self.file_hashes)
+                size = self.fakes.s3.objects[self.handler.BLOB_PREFIX + file_hash][0]
+            else:
+                file_hash, size = self.new_hash(), self.rng.randint(1, 90) * MiB
+            files.append({
+                'filename': f'clip {self._next_hash}-{index}.mp4', 'size': size,
+                'file_hash': file_hash, 'content_type': 'video/mp4',
+            })
+        _, body = self.send('POST', '/upload', username, body={'files': files})
+        completed = []
+        for info, upload in zip(files, body['upload_urls']):
+            if upload['upload_type'] == 'simple':
+                key = self.handler.storage_key(upload['file_id'], info['file_hash'])
+                self.fakes.s3.put(key, info['size'], upload['checksum_sha256'])
+            completed.append(dict(info, file_id=upload['file_id']))
+        _, body = self.send('POST', '/upload-complete-batch', username, body={'files': completed})
+        self.uploaded[username].extend(completed)
+
+    def upload_multipart(self):
+        """A 2 GiB file: /upload, part URLs window by window, /upload-status, /upload-complete"""
+        username = self.user()
+        info = {'filename': f'film {self._next_hash}.mkv', 'size': 2048 * MiB, 'file_hash': self.new_hash(),
+                'content_type': 'video/x-matroska'}
+        _, body = self.send('POST', '/upload', username, body={'files': [info]})
+        upload = body['upload_urls'][0]
+        upload_id, num_parts, part_size = upload['upload_id'], upload['num_parts'], upload['part_size']
+        for first_part in range(1, num_parts + 1, upload['part_url_window']):
+            count = min(upload['part_url_window'], num_parts - first_part + 1)
+            self.send('POST', '/upload-parts', username, body={
+                'upload_id': upload_id, 'first_part': first_part, 'checksums': PART_CHECKSUMS[:count]
+            })
+            for part_number in range(first_part, first_part + count):
+                size = min(part_size, info['size'] - (part_number - 1) * part_size)
+                self.fakes.s3.put_part(upload_id, part_number, size, PART_CHECKSUMS[(part_number - first_part) % 64])
+        self.send('POST', '/upload-status', username, body={'upload_id': upload_id})
+        parts = [{'PartNumber': number} for number in range(1, num_parts + 1)]
+        completed = dict(info, file_id=upload['file_id'], upload_id=upload_id, parts=parts)
+        status, _ = self.send('POST', '/upload-complete', username, body=completed)
+        if status == 200:
+            self.uploaded[username].append(completed)
+
+    def delete(self):
+        username = self.user()
+        if not self.uploaded[username]:
+            return self.upload_simple()
+        entry = self.uploaded[username].pop()
+        self.send('POST', '/delete', username, body={'file_id': entry['file_id']})
+
+    def delete_batch(self):
+        username = self.user()
+        entries = self.uploaded[username][-5:]
+        if not entries:
+            return self.upload_simple()
+        del self.uploaded[username][-5:]
+        self.send('POST', '/delete-batch', username, body={'file_ids': [entry['file_id'] for entry in entries]})
+
+    def bundle(self):
+        username = self.user()
+        _, body = self.send('POST', '/bundle', username, body={'file_ids': self.rng.sample(self.file_ids, 5)})
+        self.send('GET', '/bundle-status', username, query={'bundle_id': body['bundle_id']})
+
+    def run(self, requests):
+        """Perform actions from MIX until at least `requests` requests were sent"""
+        actions = list(MIX)
+        weights = [MIX[action] for action in actions]
+        sent = lambda: sum(sum(statuses.values()) for statuses in self.statuses.values())
+        start = sent()
+        while sent() - start < requests:
+            getattr(self, self.rng.choices(actions, weights)[0])()
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def run_scale(files, requests, alloc_requests, seed_value):
+    """One archive size, in this process; returns its results"""
+    os.environ.update(ENV)
+    sys.path.insert(0, LOCAL_DIR)
+    import fakeaws
+    import handler
+
+    fakes = fakeaws.install(handler)
+    handler.BUNDLE_FUNCTION = 'bench-bundler'
+    started = time.perf_counter()
+    file_ids, file_hashes = seed(handler, fakes, files)
+    seed_s = time.perf_counter() - started
+
+    client = Client(handler, fakes, file_ids, file_hashes, random.Random(seed_value))
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for username in USERS:
+            client.login(username)
+        client.run(min(requests // 10, 2000))  # warm-up: caches, first signing key, lazy imports
+        client.latencies.clear()
+        client.statuses.clear()
+
+        started = time.perf_counter()
+        client.run(requests)
+        wall_s = time.perf_counter() - started
+        latencies, statuses = client.latencies, client.statuses
+
+        # Allocation pass: peak traced memory above the baseline, and what stays allocated, per request
+        allocations = {}
+
+        def record_allocations(name, event):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            response = handler.lambda_handler(event, None)
+            current, peak = tracemalloc.get_traced_memory()
+            allocations.setdefault(name, []).append((peak - baseline, current - baseline))
+            return response
+
+        client.recorder = record_allocations
+        client.statuses = {}
+        tracemalloc.start()
+        client.run(alloc_requests)
+        tracemalloc.stop()
+
+    total = sum(len(samples) for samples in latencies.values())
+    routes = {}
+    for name, samples in sorted(latencies.items()):
+        samples.sort()
+        traced = allocations.get(name, [])
+        routes[name] = {
+            'requests': len(samples),
+            'statuses': {str(status): count for status, count in sorted(statuses[name].items())},
+            'rps': round(len(samples) / sum(samples), 1),
+            'mean_ms': round(statistics.fmean(samples) * 1000, 4),
+            'p50_ms': round(percentile(samples, 0.5) * 1000, 4),
+            'p90_ms': round(percentile(samples, 0.9) * 1000, 4),
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 4),
+            'max_ms': round(samples[-1] * 1000, 4),
+            'alloc_samples': len(traced),
+            'alloc_peak_kib': round(statistics.fmean(peak for peak, _ in traced) / 1024, 2) if traced else None,
+            'alloc_retained_bytes': round(statistics.fmean(kept for _, kept in traced)) if traced else None,
+        }
+    return {
+        'files': files,
+        'seed_s': round(seed_s, 2),
+        'requests': total,
+        'wall_s': round(wall_s, 3),
+        'rps': round(total / sum(sum(samples) for samples in latencies.values()), 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'routes': routes,
+    }
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=LOCAL_DIR, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--', '../lambda'], cwd=LOCAL_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_scale(result):
+    print(f"\n{result['files']:,} files: {result['requests']} requests, {result['rps']:.0f} req/s in the handler, "
+          f"peak RSS {result['peak_rss_mb']:.0f} MiB (seeded in {result['seed_s']:.1f}s)")
+    print(f"  {'route':28} {'count':>6} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'peak KiB':>9} {'kept B':>7}")
+    for name, route in result['routes'].items():
+        peak = f"{route['alloc_peak_kib']:9.1f}" if route['alloc_peak_kib'] is not None else f"{'-':>9}"
+        kept = f"{route['alloc_retained_bytes']:7d}" if route['alloc_retained_bytes'] is not None else f"{'-':>7}"
+        print(f"  {name:28} {route['requests']:6d} {route['rps']:8.0f} {route['p50_ms']:8.3f} {route['p90_ms']:8.3f} "
+              f"{route['p99_ms']:8.3f} {route['max_ms']:8.2f} {peak} {kept}")
+
+
+def compare(results, baseline):
+    """Change in p50, p99 and req/s per route against an earlier results file"""
+    print(f"\nAgainst {baseline['revision']} (negative latency change is faster):")
+    earlier = {scale['files']: scale for scale in baseline['scales']}
+    for scale in results['scales']:
+        before = earlier.get(scale['files'])
+        if not before:
+            continue
+        print(f"\n  {scale['files']:,} files: req/s {before['rps']:.0f} -> {scale['rps']:.0f} "
+              f"({(scale['rps'] / before['rps'] - 1) * 100:+.1f}%)")
+        for name, route in scale['routes'].items():
+            old = before['routes'].get(name)
+            if not old:
+                continue
+            print(f"    {name:28} p50 {(route['p50_ms'] / old['p50_ms'] - 1) * 100:+6.1f}%  "
+                  f"p99 {(route['p99_ms'] / old['p99_ms'] - 1) * 100:+6.1f}%  "
+                  f"req/s {(route['rps'] / old['rps'] - 1) * 100:+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--files', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--alloc-requests', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='results JSON (default: local/bench-results/handler-<commit>.json)')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_scale(args.files[0], args.requests, args.alloc_requests, args.seed)
+        with open(args.worker, 'w') as output:
+            json.dump(result, output)
+        return
+
+    results = {
+        'revision': git_revision(),
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'requests': args.requests,
+        'mix': MIX,
+        'scales': [],
+    }
+    print(f"Handler benchmark at {results['revision']}: {args.requests} timed requests per archive size")
+    for files in args.files:
+        with tempfile.NamedTemporaryFile(suffix='.json') as worker_output:
+            subprocess.run([
+                sys.executable, __file__, '--files', str(files), '--requests', str(args.requests),
+                '--alloc-requests', str(args.alloc_requests), '--seed', str(args.seed), '--worker', worker_output.name
+            ], check=True)
+            result = json.load(worker_output)
+        results['scales'].append(result)
+        print_scale(result)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"handler-{results['revision']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as handle:
+        json.dump(results, handle, indent=2)
+    print(f"\nSaved {output}")
+
+    if args.compare:
+        with open(args.compare) as handle:
+            compare(results, json.load(handle))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Check the fast presigner against botocore and measure URLs per second.
+Runs offline: presigning needs credentials but makes no AWS calls.
+"""
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda'))
+
+import boto3
+from botocore.config import Config
+from presign import Presigner
+
+CLIENT_SETUPS = [
+    {'region_name': 'us-east-1'},
+    {'region_name': 'eu-west-1'},
+    {'region_name': 'us-east-1', 'endpoint_url': 'http://localhost:4566'},
+]
+
+CASES = [
+    ('put_object', {'Bucket': 'fileserver-files', 'Key': 'alice/2024-05-01T10:00:00_Movie (2019) ü+.mkv', 'ContentType': 'video/x-matroska'}),
+    ('put_object', {'Bucket': 'fileserver-files', 'Key': 'alice/plain.txt'}),
+    ('put_object', {'Bucket': 'fileserver-files', 'Key': 'blobs/ab12', 'ContentType': 'text/plain', 'ChecksumSHA256': 'uU0nuZNNPgilLlLX2n2r+sSE7+N6U4DukIj3rOLvzek='}),
+    ('upload_part', {'Bucket': 'fileserver-files', 'Key': 'bob/big~file.mp4', 'UploadId': 'abc/+=XYZ', 'PartNumber': 7}),
+    ('upload_part', {'Bucket': 'fileserver-files', 'Key': 'blobs/ab12', 'UploadId': 'abc', 'PartNumber': 2, 'ChecksumSHA256': 'uU0nuZNNPgilLlLX2n2r+sSE7+N6U4DukIj3rOLvzek='}),
+    ('get_object', {'Bucket': 'fileserver-files', 'Key': 'bob/Фильм.mp4', 'ResponseContentDisposition': "attachment; filename*=UTF-8''%D0%A4.mp4"}),
+]
+
+
+def signing_time(url):
+    amz_date = parse_qs(urlsplit(url).query)['X-Amz-Date'][0]
+    return datetime.strptime(amz_date, '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+
+
+def check_parity():
+    failures = 0
+    for setup in CLIENT_SETUPS:
+        for token in (None, 'session/token+=='):
+            client = boto3.client(
+                's3',
+                aws_access_key_id='AKIDEXAMPLE',
+                aws_secret_access_key='wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY',
+                aws_session_token=token,
+                config=Config(signature_version='s3v4'),
+                **setup
+            )
+            presigner = Presigner(client)
+            for method, params in CASES:
+                expected = client.generate_presigned_url(method, Params=params, ExpiresIn=3600)
+                actual = presigner.generate_presigned_url(method, Params=params, ExpiresIn=3600, now=signing_time(expected))
+                if actual != expected:
+                    failures += 1
+                    print(f"✗ {method} {setup} token={token is not None}")
+                    print(f"    botocore: {expected}")
+                    print(f"    fast:     {actual}")
+    return failures
+
+
+def benchmark(count=2000):
+    client = boto3.client(
+        's3',
+        region_name='us-east-1',
+        aws_access_key_id='AKIDEXAMPLE',
+        aws_secret_access_key='wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY',
+        config=Config(signature_version='s3v4')
+    )
+    presigner = Presigner(client)
+    part_numbers = range(1, count + 1)
+
+    start = time.perf_counter()
+    for part_num in part_numbers:
+        client.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': 'fileserver-files', 'Key': 'alice/big.mkv', 'UploadId': 'upload-id', 'PartNumber': part_num},
+            ExpiresIn=3600
+        )
+    botocore_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    presigner.presign_parts('fileserver-files', 'alice/big.mkv', 'upload-id', part_numbers)
+    fast_elapsed = time.perf_counter() - start
+
+    print(f"botocore: {count / botocore_elapsed:10.0f} URLs/s")
+    print(f"fast:     {count / fast_elapsed:10.0f} URLs/s  ({botocore_elapsed / fast_elapsed:.1f}x)")
+
+
+if __name__ == '__main__':
+    print("Checking presigned URLs against botocore...")
+    failures = check_parity()
+    if failures:
+        print(f"\n✗ {failures} mismatch(es)")
+        sys.exit(1)
+    print(f"✓ {len(CLIENT_SETUPS) * 2 * len(CASES)} URLs identical\n")
+
+    print("Benchmarking upload_part presigning...")
+    benchmark()
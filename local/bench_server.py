@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Benchmark serve.py over HTTP: requests per second and latency for several
+worker counts, against the in-memory AWS fakes. Runs offline.
+
+The bench_handler.py client mix is recorded once in process (replay.py's
+format), then each worker count gets a fresh server, seeded with the same
+archive before it forks, and the recording is replayed against it as fast
+as --concurrency keep-alive connections allow. Each worker has its own
+copy of the fakes, so writes made through one worker aren't seen by the
+others; the status match rate shows how much that matters. The load
+generator shares the machine, so compare worker counts on the same host.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+LOCAL_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, LOCAL_DIR)
+
+from bench_handler import ENV, RESULTS_DIR, USERS, Client, git_revision, seed
+from replay import CaptureWriter, HttpTarget, read_records, replay, summarize
+
+
+def fake_handler(files):
+    os.environ.update(ENV)
+    import fakeaws
+    import handler
+
+    fakes = fakeaws.install(handler)
+    handler.BUNDLE_FUNCTION = 'bench-bundler'
+    file_ids, file_hashes = seed(handler, fakes, files)
+    return handler, fakes, file_ids, file_hashes
+
+
+def record(path, files, requests, seed_value):
+    """Record the client mix, as served by one in-process handler, to path"""
+    handler, fakes, file_ids, file_hashes = fake_handler(files)
+    capture = CaptureWriter(path)
+
+    def capture_call(name, event):
+        started = time.perf_counter()
+        response = handler.lambda_handler(event, None)
+        capture.record(event, response['statusCode'], (time.perf_counter() - started) * 1000)
+        return response
+
+    client = Client(handler, fakes, file_ids, file_hashes, random.Random(seed_value))
+    client.recorder = capture_call
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for username in USERS:
+            client.login(username)
+        client.run(requests)
+    capture.close()
+
+
+def run_server(port, workers, files):
+    """--serve: seed the fakes, then serve them (stdout, the handler's logs, is discarded)"""
+    fake_handler(files)
+    sys.stdout = open(os.devnull, 'w')
+    from serve import serve
+    serve('127.0.0.1', port, workers)
+
+
+def wait_for_port(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f'server on port {port} did not start')
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def bench_workers(recording, workers, files, concurrency):
+    port = free_port()
+    server = subprocess.Popen([
+        sys.executable, __file__, '--serve', '--port', str(port), '--workers', str(workers), '--files', str(files)
+    ])
+    try:
+        wait_for_port(port)
+        results, elapsed = replay(read_records(recording), HttpTarget(f'http://127.0.0.1:{port}'), concurrency, 0)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+    return summarize(results, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--files', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated worker counts')
+    parser.add_argument('--concurrency', type=int, default=16, help='keep-alive connections replaying')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        run_server(args.port, int(args.workers), args.files)
+        return
+
+    with tempfile.TemporaryDirectory() as scratch:
+        recording = os.path.join(scratch, 'mix.jsonl')
+        record(recording, args.files, args.requests, args.seed)
+        print(f"{args.files} files, {args.requests}+ requests, {args.concurrency} connections, "
+              f"{os.cpu_count()} CPUs\n")
+        print(f"{'workers':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'matched':>8}")
+        results = {}
+        for workers in [int(count) for count in args.workers.split(',')]:
+            summary = bench_workers(recording, workers, args.files, args.concurrency)
+            print(f"{workers:7d} {summary['rps']:8.0f} {summary['service_p50_ms']:8.2f} "
+                  f"{summary['service_p99_ms']:8.2f} {summary['status_matches'] / summary['requests']:8.1%}")
+            results[workers] = summary
+
+    revision = git_revision()
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f'server-{revision}.json')
+    with open(path, 'w') as handle:
+        json.dump({
+            'revision': revision,
+            'files': args.files,
+            'concurrency': args.concurrency,
+            'cpus': os.cpu_count(),
+            'workers': results,
+        }, handle, indent=2)
+    print(f"\nSaved {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+"""
+In-memory stand-ins for the AWS services handler.py uses, fast enough to
+hold a million-file archive and answer thousands of requests per second.
+
+FakeTable behaves like a boto3 resource Table (plain Python values; ints
+where boto3 would return Decimals). FakeDynamoClient answers the low-level
+calls the handler makes through dynamocodec, over the same tables.
+FakeS3 keeps object sizes and checksums only. Expressions are evaluated
+by the functions lambda/localstore.py uses, for the same forms, and
+anything else raises NotImplementedError, so a new query shape fails loudly
+instead of returning wrong results.
+
+install() swaps them into an imported handler module.
+"""
+import bisect
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from dynamocodec import decode_item, encode_item
+from localstore import (
+    EXCEPTIONS, ConditionalCheckFailedException, NoSuchKey, NoSuchUpload, apply_update, check_condition,
+    composite_checksum, key_condition, project, projection
+)
+
+
+class FakeTable:
+    """A DynamoDB table keyed on one hash key, with optional GSIs.
+
+    indexes maps index name -> (hash attribute, range attribute or None).
+    Hash-only indexes keep {value: {key: None}}; indexes with a range key
+    keep one sorted list of (range value, key) per hash value.
+    """
+
+    def __init__(self, name, key, indexes=None):
+        self.name = name
+        self.key = key
+        self.items = {}
+        self.indexes = indexes or {}
+        self._index_data = {index: {} for index in self.indexes}
+        self.meta = SimpleNamespace(client=SimpleNamespace(exceptions=EXCEPTIONS))
+
+    # Index maintenance
+
+    def _index(self, item):
+        for index, (hash_attr, range_attr) in self.indexes.items():
+            if hash_attr not in item or (range_attr and range_attr not in item):
+                continue
+            bucket = self._index_data[index]
+            if range_attr:
+                bisect.insort(bucket.setdefault(item[hash_attr], []), (item[range_attr], item[self.key]))
+            else:
+                bucket.setdefault(item[hash_attr], {})[item[self.key]] = None
+
+    def _unindex(self, item):
+        for index, (hash_attr, range_attr) in self.indexes.items():
+            if hash_attr not in item or (range_attr and range_attr not in item):
+                continue
+            bucket = self._index_data[index].get(item[hash_attr])
+            if bucket is None:
+                continue
+            if range_attr:
+                entry = (item[range_attr], item[self.key])
+                position = bisect.bisect_left(bucket, entry)
+                if position < len(bucket) and bucket[position] == entry:
+                    del bucket[position]
+            else:
+                bucket.pop(item[self.key], None)
+
+    def load(self, items):
+        """Bulk insert, sorting range indexes once instead of per item"""
+        for item in items:
+            self.items[item[self.key]] = item
+        self._index_data = {index: {} for index in self.indexes}
+        for index, (hash_attr, range_attr) in self.indexes.items():
+            bucket = self._index_data[index]
+            for key, item in self.items.items():
+                if hash_attr not in item or (range_attr and range_attr not in item):
+                    continue
+                if range_attr:
+                    bucket.setdefault(item[hash_attr], []).append((item[range_attr], key))
+                else:
+                    bucket.setdefault(item[hash_attr], {})[key] = None
+            if range_attr:
+                for entries in bucket.values():
+                    entries.sort()
+
+    # Table API
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, ConsistentRead=False):
+        item = self.items.get(Key[self.key])
+        if item is None:
+            return {}
+        return {'Item': project(item, projection(ProjectionExpression, ExpressionAttributeNames))}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None):
+        old = self.items.get(Item[self.key])
+        if ConditionExpression and not check_condition(old, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+            raise ConditionalCheckFailedException(ConditionExpression)
+        if old is not None:
+            self._unindex(old)
+        item = dict(Item)
+        self.items[item[self.key]] = item
+        self._index(item)
+        return {}
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE'):
+        old = self.items.get(Key[self.key])
+        if ConditionExpression and not check_condition(old, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+            raise ConditionalCheckFailedException(ConditionExpression)
+        if old is None:
+            return {}
+        del self.items[Key[self.key]]
+        self._unindex(old)
+        return {'Attributes': dict(old)} if ReturnValues == 'ALL_OLD' else {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE'):
+        names, values = ExpressionAttributeNames, ExpressionAttributeValues or {}
+        old = self.items.get(Key[self.key])
+        if ConditionExpression and not check_condition(old, ConditionExpression, names, values):
+            raise ConditionalCheckFailedException(ConditionExpression)
+        item = dict(old) if old else dict(Key)
+        updated = apply_update(item, UpdateExpression, names, values)
+
+        if old is not None:
+            self._unindex(old)
+        self.items[item[self.key]] = item
+        self._index(item)
+        if ReturnValues == 'UPDATED_NEW':
+            return {'Attributes': {name: item[name] for name in updated if name in item}}
+        if ReturnValues == 'ALL_NEW':
+            return {'Attributes': dict(item)}
+        return {}
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, IndexName=None, ExpressionAttributeNames=None,
+              ProjectionExpression=None, ScanIndexForward=True, Limit=None, ExclusiveStartKey=None):
+        names = ExpressionAttributeNames
+        attribute, value = key_condition(KeyConditionExpression, names, ExpressionAttributeValues)
+        attributes = projection(ProjectionExpression, names)
+
+        if IndexName is None:
+            keys = [value] if value in self.items else []
+            return {'Items': [project(self.items[key], attributes) for key in keys], 'Count': len(keys)}
+
+        hash_attr, range_attr = self.indexes[IndexName]
+        if attribute != hash_attr:
+            raise NotImplementedError(f'{IndexName} is keyed on {hash_attr}, not {attribute}')
+        bucket = self._index_data[IndexName].get(value)
+        if not bucket:
+            return {'Items': [], 'Count': 0}
+        if not range_attr:
+            keys = list(bucket)[:Limit]
+            return {'Items': [project(self.items[key], attributes) for key in keys], 'Count': len(keys)}
+
+        # Walk the sorted (range, key) list from the start key in either direction
+        if ExclusiveStartKey:
+            start = (ExclusiveStartKey[range_attr], ExclusiveStartKey[self.key])
+            if ScanIndexForward:
+                indexes = range(bisect.bisect_right(bucket, start), len(bucket))
+            else:
+                indexes = range(bisect.bisect_left(bucket, start) - 1, -1, -1)
+        else:
+            indexes = range(len(bucket) - 1, -1, -1) if not ScanIndexForward else range(len(bucket))
+        limit = Limit or len(bucket)
+        page = [bucket[index] for index in indexes[:limit]]
+        response = {'Items': [project(self.items[key], attributes) for _, key in page], 'Count': len(page)}
+        if len(page) == limit and indexes[limit:limit + 1]:
+            range_value, key = page[-1]
+            response['LastEvaluatedKey'] = {self.key: key, hash_attr: value, range_attr: range_value}
+        return response
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return _BatchWriter(self)
+
+
+class _BatchWriter:
+    def __init__(self, table):
+        self._table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def put_item(self, Item):
+        self._table.put_item(Item=Item)
+
+    def delete_item(self, Key):
+        self._table.delete_item(Key=Key)
+
+
+class FakeDynamoResource:
+    def __init__(self, tables):
+        self.tables = tables
+        self.meta = SimpleNamespace(client=SimpleNamespace(exceptions=EXCEPTIONS))
+
+    def Table(self, name):
+        return self.tables[name]
+
+
+class FakeDynamoClient:
+    """The low-level calls handler.py makes, in wire format, over FakeTables"""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.exceptions = EXCEPTIONS
+
+    def get_item(self, TableName, Key, **options):
+        response = self.tables[TableName].get_item(Key=decode_item(Key), **options)
+        return {'Item': encode_item(response['Item'])} if 'Item' in response else {}
+
+    def query(self, TableName, ExpressionAttributeValues, ExclusiveStartKey=None, **options):
+        response = self.tables[TableName].query(
+            ExpressionAttributeValues=decode_item(ExpressionAttributeValues),
+            ExclusiveStartKey=decode_item(ExclusiveStartKey) if ExclusiveStartKey else None,
+            **options
+        )
+        encoded = {'Items': [encode_item(item) for item in response['Items']], 'Count': response['Count']}
+        if 'LastEvaluatedKey' in response:
+            encoded['LastEvaluatedKey'] = encode_item(response['LastEvaluatedKey'])
+        return encoded
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        for table_name, request in RequestItems.items():
+            table = self.tables[table_name]
+            attributes = projection(request.get('ProjectionExpression'), request.get('ExpressionAttributeNames'))
+            items = responses.setdefault(table_name, [])
+            for key in request['Keys']:
+                item = table.items.get(decode_item(key)[table.key])
+                if item is not None:
+                    items.append(encode_item(project(item, attributes)))
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+class FakeS3:
+    """Object sizes and checksums as (size, checksum) tuples, and multipart uploads with their parts"""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.exceptions = EXCEPTIONS
+        self._upload_ids = 0
+
+    def put(self, key, size, checksum=None):
+        """What a client's PUT to a presigned URL would leave behind"""
+        self.objects[key] = (size, checksum)
+
+    def head_object(self, Bucket, Key, ChecksumMode=None):
+        entry = self.objects.get(Key)
+        if entry is None:
+            raise NoSuchKey(Key)
+        size, checksum = entry
+        response = {'ContentLength': size}
+        if ChecksumMode == 'ENABLED' and checksum:
+            response['ChecksumSHA256'] = checksum
+        return response
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete):
+        for entry in Delete['Objects']:
+            self.objects.pop(entry['Key'], None)
+        return {'Deleted': [{'Key': entry['Key']} for entry in Delete['Objects']]}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._upload_ids += 1
+        upload_id = f'upload-{self._upload_ids}'
+        self.uploads[upload_id] = {'key': Key, 'parts': {}}
+        return {'UploadId': upload_id}
+
+    def put_part(self, upload_id, part_number, size, checksum):
+        """What a client's PUT to a presigned part URL would leave behind"""
+        self.uploads[upload_id]['parts'][part_number] = {
+            'PartNumber': part_number, 'ETag': f'"{upload_id}-{part_number}"', 'Size': size, 'ChecksumSHA256': checksum
+        }
+
+    def list_parts(self, Bucket, Key, UploadId, PartNumberMarker=0, MaxParts=1000):
+        if UploadId not in self.uploads:
+            raise NoSuchUpload(UploadId)
+        parts = sorted(self.uploads[UploadId]['parts'].values(), key=lambda part: part['PartNumber'])
+        parts = [part for part in parts if part['PartNumber'] > PartNumberMarker]
+        response = {'Parts': parts[:MaxParts], 'IsTruncated': len(parts) > MaxParts}
+        if response['IsTruncated']:
+            response['NextPartNumberMarker'] = parts[MaxParts - 1]['PartNumber']
+        return response
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        upload = self.uploads.pop(UploadId)
+        parts = sorted(upload['parts'].values(), key=lambda part: part['PartNumber'])
+        size = sum(part['Size'] for part in parts)
+        self.objects[Key] = (size, composite_checksum([part['ChecksumSHA256'] for part in parts]))
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+        return {}
+
+
+class FakeLambda:
+    def __init__(self):
+        self.invocations = []
+
+    def invoke(self, **kwargs):
+        self.invocations.append(kwargs)
+        return {'StatusCode': 202}
+
+
+def make_tables(handler):
+    """Empty FakeTables under the handler's table names, with the GSIs terraform defines"""
+    return {
+        handler.USERS_TABLE: FakeTable(handler.USERS_TABLE, 'username'),
+        handler.FILES_TABLE: FakeTable(handler.FILES_TABLE, 'file_id', {
+            handler.OWNER_INDEX: ('username', 'uploaded_at'),
+            'HashIndex': ('file_hash', None),
+            handler.LISTING_INDEX: ('listing', 'uploaded_at'),
+        }),
+        handler.META_TABLE: FakeTable(handler.META_TABLE, 'name'),
+        handler.UPLOADS_TABLE: FakeTable(handler.UPLOADS_TABLE, 'upload_id'),
+        handler.BLOBS_TABLE: FakeTable(handler.BLOBS_TABLE, 'file_hash'),
+        handler.SEARCH_TABLE: FakeTable(handler.SEARCH_TABLE, 'posting', {
+            handler.SEARCH_INDEX: ('gram', 'uploaded_at'),
+        }),
+    }
+
+
+def install(handler, region='us-east-1'):
+    """Point an imported handler module at fresh fakes; returns them as a namespace.
+
+    URLs are still signed by the real presigner (a botocore S3 client with
+    dummy credentials, which never makes a request), so signing cost counts.
+    """
+    import boto3
+    from botocore.config import Config
+    from presign import Presigner
+
+    tables = make_tables(handler)
+    fakes = SimpleNamespace(
+        tables=tables,
+        s3=FakeS3(),
+        dynamodb=FakeDynamoResource(tables),
+        dynamodb_client=FakeDynamoClient(tables),
+        lambda_client=FakeLambda(),
+    )
+    signing_client = boto3.client(
+        's3', region_name=region, aws_access_key_id='fake', aws_secret_access_key='fake',
+        config=Config(signature_version='s3v4')
+    )
+
+    handler.s3 = fakes.s3
+    handler.presigner = Presigner(signing_client)
+    handler.dynamodb = fakes.dynamodb
+    handler.dynamodb_client = fakes.dynamodb_client
+    handler.lambda_client = fakes.lambda_client
+    handler.users_table = tables[handler.USERS_TABLE]
+    handler.files_table = tables[handler.FILES_TABLE]
+    handler.meta_table = tables[handler.META_TABLE]
+    handler.uploads_table = tables[handler.UPLOADS_TABLE]
+    handler.blobs_table = tables[handler.BLOBS_TABLE]
+    handler.search_table = tables[handler.SEARCH_TABLE]
+    return fakes
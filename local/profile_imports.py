@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Profile what a cold start imports: runs `python -X importtime` on the
+handler in a fresh interpreter several times, reports the median cost per
+module and per top-level package, and exits non-zero if importing the
+handler exceeds the budget or if a CORS preflight or 404 pulls in boto3.
+
+Bytecode is compiled first, as scripts/deploy.sh does for the package.
+Runs offline: the handler is configured with dummy table names.
+"""
+import argparse
+import compileall
+import os
+import py_compile
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda')
+
+ENV = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'BUCKET_NAME': 'profile-bucket',
+    'USERS_TABLE': 'profile-users',
+    'FILES_TABLE': 'profile-files',
+    'META_TABLE': 'profile-meta',
+    'UPLOADS_TABLE': 'profile-uploads',
+    'BLOBS_TABLE': 'profile-blobs',
+    'SEARCH_TABLE': 'profile-search',
+    'TOKEN_SIGNING_KEYS': 'profile:profile-signing-key',
+}
+
+# Requests that must be served without touching AWS
+SNIPPET = """
+import sys
+import handler
+handler.lambda_handler({'httpMethod': 'OPTIONS', 'path': '/files'}, None)
+handler.lambda_handler({'httpMethod': 'GET', 'path': '/nope', 'headers': {}}, None)
+print('boto3' in sys.modules)
+"""
+
+
+def run_once(module):
+    env = dict(os.environ, **ENV)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', SNIPPET.replace('handler', module)],
+        cwd=LAMBDA_DIR, env=env, capture_output=True, text=True, check=True
+    )
+
+    lines = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        lines.append((depth, name.strip(), int(self_us), int(cumulative_us)))
+
+    # importtime prints children before their parent, so the handler's
+    # subtree is everything since the previous top-level import
+    end = max(index for index, line in enumerate(lines) if line[0] == 0 and line[1] == module)
+    start = max((index for index in range(end) if lines[index][0] == 0), default=-1) + 1
+    subtree = {name: (self_us, cumulative_us) for depth, name, self_us, cumulative_us in lines[start:end + 1]}
+    return subtree, result.stdout.strip() == 'True'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('IMPORT_BUDGET_MS', 50)))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--module', default='handler')
+    args = parser.parse_args()
+
+    compileall.compile_dir(
+        LAMBDA_DIR, quiet=1, maxlevels=0, invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH
+    )
+
+    runs = [run_once(args.module) for _ in range(args.runs)]
+    boto3_loaded = any(loaded for _, loaded in runs)
+    modules = defaultdict(list)
+    for subtree, _ in runs:
+        for name, (self_us, _cumulative) in subtree.items():
+            modules[name].append(self_us)
+    total_ms = statistics.median(subtree[args.module][1] for subtree, _ in runs) / 1000
+
+    self_ms = {name: statistics.median(samples) / 1000 for name, samples in modules.items()}
+    packages = defaultdict(float)
+    for name, ms in self_ms.items():
+        packages[name.split('.')[0]] += ms
+
+    print(f"Median of {args.runs} cold imports of '{args.module}': {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)\n")
+    print("By package (self time):")
+    for name, ms in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {ms:8.2f} ms  {name}")
+    print("\nSlowest modules (self time):")
+    for name, ms in sorted(self_ms.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {ms:8.2f} ms  {name}")
+
+    failures = []
+    if total_ms > args.budget_ms:
+        failures.append(f"import took {total_ms:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+    if boto3_loaded:
+        failures.append("a CORS preflight or 404 imported boto3")
+    for failure in failures:
+        print(f"\n✗ {failure}")
+    if failures:
+        sys.exit(1)
+    print("\n✓ Within budget; preflights and 404s don't import boto3")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Replay recorded API Gateway events against the handler, in process or over
+HTTP against local/run_local.py, keeping the recording's timing (scaled by
+--speed) or as fast as the workers go (--speed 0).
+
+Recordings are JSONL, one request per line:
+
+    {"at": 1.25, "event": {...API Gateway event...}, "status": 200, "ms": 3.1}
+
+where "at" is seconds since the recording started and "status"/"ms" are
+what was observed then. `run_local.py --capture FILE` writes this format.
+Lines holding a bare API Gateway event are accepted too, timed from
+requestContext.requestTimeEpoch when present. The file is read as it is
+replayed, so recordings of any length use constant memory.
+
+In process, the handler runs against the in-memory fakes from fakeaws.py
+(seeded with --files files) unless --no-fakes is given, in which case it
+uses whatever AWS the environment points at (e.g. AWS_ENDPOINT_URL for
+LocalStack). The fakes aren't thread-safe, so in-process calls are made
+one at a time, like a single Lambda container, and --concurrency only
+controls how many requests may queue for it. Over HTTP, each worker keeps
+one keep-alive connection.
+
+Recorded bearer tokens expire or were signed with other keys;
+--reissue-tokens replaces each with a fresh token for the same user,
+signed with --signing-keys (the target's TOKEN_SIGNING_KEYS).
+"""
+import argparse
+import base64
+import http.client
+import json
+import os
+import queue
+import statistics
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+LOCAL_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCAL_SIGNING_KEYS = 'local:local-dev-signing-key'  # run_local.py's
+
+
+class CaptureWriter:
+    """Appends handled requests to a JSONL recording; safe to share between threads and forked workers"""
+
+    def __init__(self, path):
+        # Each line goes out in one write() to an O_APPEND file, so lines from concurrent writers never interleave
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self._started = time.monotonic()
+
+    def record(self, event, status, ms):
+        line = json.dumps({
+            'at': round(time.monotonic() - self._started, 6),
+            'event': event,
+            'status': status,
+            'ms': round(ms, 3),
+        }, separators=(',', ':'))
+        os.write(self._fd, (line + '\n').encode())
+
+    def close(self):
+        os.close(self._fd)
+
+
+def read_records(path, limit=None):
+    """Yield {'at', 'event', 'status'} from a recording, one line at a time"""
+    first_epoch = None
+    with open(path) as lines:
+        for count, line in enumerate(lines):
+            if limit is not None and count >= limit:
+                return
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'event' not in record:
+                # A bare API Gateway event
+                epoch = (record.get('requestContext') or {}).get('requestTimeEpoch')
+                if epoch is not None and first_epoch is None:
+                    first_epoch = epoch
+                record = {'at': (epoch - first_epoch) / 1000 if epoch is not None else 0, 'event': record}
+            yield record
+
+
+def token_subject(authorization):
+    """The 'sub' of a bearer token, read without checking its signature"""
+    try:
+        payload = authorization.split(' ', 1)[1].split('.')[0]
+        return json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['sub']
+    except (IndexError, KeyError, ValueError):
+        return None
+
+
+class TokenReissuer:
+    """Swaps recorded bearer tokens for fresh ones for the same users"""
+
+    def __init__(self, issue_token):
+        self._issue_token = issue_token
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def apply(self, event):
+        headers = dict(event.get('headers') or {})
+        for name in ('Authorization', 'authorization'):
+            if name in headers and headers[name].startswith('Bearer '):
+                subject = token_subject(headers[name])
+                if subject:
+                    with self._lock:
+                        if subject not in self._tokens:
+                            self._tokens[subject] = self._issue_token(subject)
+                    headers[name] = f'Bearer {self._tokens[subject]}'
+        return dict(event, headers=headers)
+
+
+class InProcessTarget:
+    def __init__(self, handler):
+        self._handler = handler
+        self._lock = threading.Lock()
+
+    def connect(self):
+        return self
+
+    def send(self, event):
+        with self._lock:
+            return self._handler.lambda_handler(event, None)['statusCode']
+
+    def close(self):
+        pass
+
+
+class HttpTarget:
+    """One keep-alive connection per worker"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self._scheme, self._host, self._prefix = parts.scheme, parts.netloc, parts.path.rstrip('/')
+
+    def connect(self):
+        target = HttpTarget.__new__(HttpTarget)
+        target._scheme, target._host, target._prefix = self._scheme, self._host, self._prefix
+        connection_class = http.client.HTTPSConnection if self._scheme == 'https' else http.client.HTTPConnection
+        target._connection = connection_class(self._host, timeout=60)
+        return target
+
+    def send(self, event):
+        path = self._prefix + event['path']
+        if event.get('queryStringParameters'):
+            path += '?' + urlencode(event['queryStringParameters'])
+        body = event.get('body')
+        if body is not None:
+            body = base64.b64decode(body) if event.get('isBase64Encoded') else body.encode()
+        headers = {
+            name: value for name, value in (event.get('headers') or {}).items()
+            if name.lower() not in ('host', 'content-length', 'connection', 'transfer-encoding')
+        }
+        try:
+            self._connection.request(event['httpMethod'], path, body=body, headers=headers)
+        except (http.client.HTTPException, OSError):
+            # The server closed the kept-alive connection; reconnect once
+            self._connection.close()
+            self._connection.request(event['httpMethod'], path, body=body, headers=headers)
+        response = self._connection.getresponse()
+        response.read()
+        return response.status
+
+    def close(self):
+        self._connection.close()
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)] if sorted_values else 0
+
+
+def replay(records, target, concurrency, speed, reissuer=None):
+    """Issue records against target; returns per-request (route, status, recorded status, service s, response s, lag s)"""
+    pending = queue.Queue(maxsize=concurrency * 4)
+    results = []
+    results_lock = threading.Lock()
+
+    def worker():
+        connection = target.connect()
+        try:
+            while True:
+                item = pending.get()
+                if item is None:
+                    return
+                record, due = item
+                event = reissuer.apply(record['event']) if reissuer else record['event']
+                started = time.perf_counter()
+                try:
+                    status = connection.send(event)
+                except Exception as e:
+                    print(f"  {event.get('httpMethod')} {event.get('path')}: {type(e).__name__}: {e}", file=sys.stderr)
+                    status = None
+                finished = time.perf_counter()
+                with results_lock:
+                    results.append((
+                        f"{event.get('httpMethod')} {event.get('path')}", status, record.get('status'),
+                        finished - started, finished - due, max(started - due, 0)
+                    ))
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in workers:
+        thread.start()
+
+    started = time.perf_counter()
+    for record in records:
+        due = started + record['at'] / speed if speed else time.perf_counter()
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        pending.put((record, due))
+    for _ in workers:
+        pending.put(None)
+    for thread in workers:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(results, elapsed):
+    service_times = sorted(result[3] for result in results)
+    response_times = sorted(result[4] for result in results)
+    routes = {}
+    for route, status, recorded, service, response, lag in results:
+        routes.setdefault(route, []).append((status, recorded, service, response, lag))
+    summary = {
+        'requests': len(results),
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(len(results) / elapsed, 1) if elapsed else 0,
+        'status_matches': sum(1 for _, status, recorded, *_ in results if recorded is None or status == recorded),
+        'lag_p99_ms': round(percentile(sorted(lag for *_, lag in results), 0.99) * 1000, 3),
+        'service_p50_ms': round(percentile(service_times, 0.5) * 1000, 3),
+        'service_p99_ms': round(percentile(service_times, 0.99) * 1000, 3),
+        'response_p50_ms': round(percentile(response_times, 0.5) * 1000, 3),
+        'response_p99_ms': round(percentile(response_times, 0.99) * 1000, 3),
+        'routes': {},
+    }
+    for route, entries in sorted(routes.items()):
+        service = sorted(entry[2] for entry in entries)
+        response = sorted(entry[3] for entry in entries)
+        statuses = {}
+        for status, *_ in entries:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        summary['routes'][route] = {
+            'requests': len(entries),
+            'statuses': statuses,
+            'mismatched': sum(1 for status, recorded, *_ in entries if recorded is not None and status != recorded),
+            'service_mean_ms': round(statistics.fmean(service) * 1000, 3),
+            'service_p50_ms': round(percentile(service, 0.5) * 1000, 3),
+            'service_p99_ms': round(percentile(service, 0.99) * 1000, 3),
+            'response_p50_ms': round(percentile(response, 0.5) * 1000, 3),
+            'response_p99_ms': round(percentile(response, 0.99) * 1000, 3),
+        }
+    return summary
+
+
+def in_process_handler(args):
+    """Import the handler configured for replay; with fakes unless --no-fakes"""
+    sys.path.insert(0, LOCAL_DIR)
+    if args.no_fakes:
+        os.environ.setdefault('TOKEN_SIGNING_KEYS', args.signing_keys)
+        sys.path.insert(0, os.path.join(LOCAL_DIR, '..', 'lambda'))
+        import handler
+        return handler
+
+    from bench_handler import ENV, seed
+    import fakeaws
+    os.environ.update(ENV, TOKEN_SIGNING_KEYS=args.signing_keys)
+    import handler
+    fakes = fakeaws.install(handler)
+    handler.BUNDLE_FUNCTION = 'replay-bundler'
+    seed(handler, fakes, args.files)
+    return handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('recording', help='JSONL recording (run_local.py --capture)')
+    parser.add_argument('--target', default='inprocess', help="'inprocess' or a base URL such as http://localhost:5000")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--speed', type=float, default=1.0, help='time scale: 2 replays twice as fast; 0 ignores timing')
+    parser.add_argument('--limit', type=int, help='replay only the first N lines')
+    parser.add_argument('--files', type=int, default=1000, help='files to seed the in-process fakes with')
+    parser.add_argument('--no-fakes', action='store_true', help='in process, use the AWS the environment points at')
+    parser.add_argument('--reissue-tokens', action='store_true', help='replace recorded bearer tokens with fresh ones')
+    parser.add_argument('--signing-keys', default=os.environ.get('TOKEN_SIGNING_KEYS', LOCAL_SIGNING_KEYS),
+                        help="the target's TOKEN_SIGNING_KEYS (default: run_local.py's)")
+    parser.add_argument('--output', help='write the summary as JSON here')
+    args = parser.parse_args()
+
+    if args.target == 'inprocess':
+        handler = in_process_handler(args)
+        target = InProcessTarget(handler)
+        log = open(os.devnull, 'w')
+        sys.stdout, stdout = log, sys.stdout  # the handler's structured logs
+    else:
+        target = HttpTarget(args.target)
+        stdout = sys.stdout
+        handler = None
+
+    reissuer = None
+    if args.reissue_tokens:
+        if handler is None:
+            # Only issue_token is used; the handler needs its configuration to import
+            for name in ('BUCKET_NAME', 'USERS_TABLE', 'FILES_TABLE', 'META_TABLE', 'UPLOADS_TABLE', 'BLOBS_TABLE',
+                         'SEARCH_TABLE'):
+                os.environ.setdefault(name, 'replay')
+            os.environ['TOKEN_SIGNING_KEYS'] = args.signing_keys
+            sys.path.insert(0, os.path.join(LOCAL_DIR, '..', 'lambda'))
+            from handler import issue_token
+        else:
+            issue_token = handler.issue_token
+        reissuer = TokenReissuer(issue_token)
+
+    try:
+        results, elapsed = replay(read_records(args.recording, args.limit), target, args.concurrency, args.speed, reissuer)
+    finally:
+        sys.stdout = stdout
+    summary = summarize(results, elapsed)
+
+    print(f"Replayed {summary['requests']} requests in {summary['elapsed_s']:.2f}s ({summary['rps']:.0f} req/s), "
+          f"{summary['status_matches']} with the recorded status; schedule lag p99 {summary['lag_p99_ms']:.1f} ms")
+    print(f"  {'route':28} {'count':>6} {'statuses':24} {'svc p50':>8} {'svc p99':>8} {'resp p50':>8} {'resp p99':>8}")
+    for route, stats in summary['routes'].items():
+        statuses = ' '.join(f'{status}x{count}' for status, count in stats['statuses'].items())
+        print(f"  {route:28} {stats['requests']:6d} {statuses:24} {stats['service_p50_ms']:8.2f} "
+              f"{stats['service_p99_ms']:8.2f} {stats['response_p50_ms']:8.2f} {stats['response_p99_ms']:8.2f}")
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(summary, handle, indent=2)
+        print(f"\nSaved {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 """Local development server for testing Lambda functions"""
+import argparse
+import hashlib
 import os
 import sys
-import json
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('--workers', type=int, default=4, help='worker processes (requests handled at once)')
+parser.add_argument('--storage', metavar='DIR',
+                    help='keep files and metadata in DIR (files + SQLite) instead of LocalStack')
+parser.add_argument('--capture', metavar='FILE',
+                    help='append every request to FILE for replay.py (includes tokens and passwords)')
+args = parser.parse_args()
 
 # Set environment variables for local testing
 os.environ['AWS_ACCESS_KEY_ID'] = 'test'
@@ -13,67 +20,61 @@ os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
 os.environ['BUCKET_NAME'] = 'fileserver-files-local'
 os.environ['USERS_TABLE'] = 'fileserver-users'
 os.environ['FILES_TABLE'] = 'fileserver-files'
+os.environ['META_TABLE'] = 'fileserver-meta'
+os.environ['UPLOADS_TABLE'] = 'fileserver-uploads'
+os.environ['BLOBS_TABLE'] = 'fileserver-blobs'
+os.environ['SEARCH_TABLE'] = 'fileserver-search'
+os.environ['TOKEN_SIGNING_KEYS'] = 'local:local-dev-signing-key'
 
-# Configure boto3 to use LocalStack
-import boto3
-boto3.setup_default_session(
-    aws_access_key_id='test',
-    aws_secret_access_key='test',
-    region_name='us-east-1'
-)
-
-# Patch boto3 clients to use LocalStack endpoint
-original_client = boto3.client
-def patched_client(service_name, **kwargs):
-    kwargs['endpoint_url'] = 'http://localhost:4566'
-    return original_client(service_name, **kwargs)
-boto3.client = patched_client
-
-original_resource = boto3.resource
-def patched_resource(service_name, **kwargs):
-    kwargs['endpoint_url'] = 'http://localhost:4566'
-    return original_resource(service_name, **kwargs)
-boto3.resource = patched_resource
+if args.storage:
+    # No LocalStack: localstore.py serves S3 and DynamoDB from DIR, and this server the presigned URLs
+    os.environ['STORAGE_BACKEND'] = 'local'
+    os.environ['LOCAL_STORAGE_DIR'] = os.path.abspath(args.storage)
+    os.environ['LOCAL_STORAGE_URL'] = 'http://localhost:5000/_storage'
+else:
+    # Configure boto3 to use LocalStack
+    import boto3
+    boto3.setup_default_session(
+        aws_access_key_id='test',
+        aws_secret_access_key='test',
+        region_name='us-east-1'
+    )
 
-# Import Lambda handler
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda'))
-from handler import lambda_handler
+    # Patch boto3 clients to use LocalStack endpoint
+    original_client = boto3.client
+    def patched_client(service_name, **kwargs):
+        kwargs['endpoint_url'] = 'http://localhost:4566'
+        return original_client(service_name, **kwargs)
+    boto3.client = patched_client
 
-app = Flask(__name__)
-CORS(app)
+    original_resource = boto3.resource
+    def patched_resource(service_name, **kwargs):
+        kwargs['endpoint_url'] = 'http://localhost:4566'
+        return original_resource(service_name, **kwargs)
+    boto3.resource = patched_resource
 
-@app.route('/<path:path>', methods=['GET', 'POST', 'OPTIONS'])
-def proxy(path):
-    """Proxy requests to Lambda handler"""
-    
-    # Build Lambda event from Flask request
-    event = {
-        'path': f'/{path}',
-        'httpMethod': request.method,
-        'headers': dict(request.headers),
-        'queryStringParameters': dict(request.args) if request.args else None,
-        'body': request.get_data(as_text=True) if request.data else None
-    }
-    
-    # Call Lambda handler
-    response = lambda_handler(event, {})
-    
-    # Convert Lambda response to Flask response
-    return (
-        response.get('body', ''),
-        response.get('statusCode', 200),
-        response.get('headers', {})
-    )
+from serve import serve
 
 if __name__ == '__main__':
+    if args.storage:
+        # What setup_local.sh creates in LocalStack
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda'))
+        import handler
+        if not handler.users_table.get_item(Key={'username': 'test'}).get('Item'):
+            handler.users_table.put_item(Item={'username': 'test', 'password_hash': hashlib.sha256(b'test123').hexdigest()})
+
     print("=" * 60)
     print("Local File Server Running")
     print("=" * 60)
-    print("API Server: http://localhost:5000")
+    print(f"API Server: http://localhost:5000 ({args.workers} workers)")
     print("Web UI: http://localhost:8080")
+    if args.storage:
+        print(f"Storage: {os.environ['LOCAL_STORAGE_DIR']} (no LocalStack needed)")
     print("")
     print("Test credentials:")
     print("  Username: test")
     print("  Password: test123")
+    if args.capture:
+        print(f"Capturing requests to {args.capture}")
     print("=" * 60)
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    serve('0.0.0.0', 5000, args.workers, args.capture)
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Serve lambda_handler over HTTP without API Gateway: a pre-forked pool of
+worker processes sharing one listening socket, each like a warm Lambda
+container.
+
+Each worker handles its connections on threads (parsing, keep-alive,
+writing responses) but runs one handler invocation at a time, as Lambda
+does: the handler keeps per-invocation state in module globals (the AWS
+call recorder, route histograms) and boto3 resources aren't thread-safe.
+Requests in flight therefore scale with --workers, and an idle kept-alive
+connection never holds up a worker.
+
+The handler is imported once, before forking, so workers share its code.
+AWS clients are created lazily on first use, i.e. inside each worker after
+the fork, and then reused for every request that worker serves; a client's
+connection pool is never shared between processes.
+
+Configure it like the Lambda function (BUCKET_NAME, the table names,
+TOKEN_SIGNING_KEYS, ...). With STORAGE_BACKEND=local (see localstore.py)
+it needs no AWS at all: it also answers the presigned URLs under
+LOCAL_STORAGE_URL, streaming objects out with sendfile(). local/run_local.py
+runs it against LocalStack or, with --storage, local files.
+"""
+import argparse
+import base64
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from types import SimpleNamespace
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+LOCAL_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(LOCAL_DIR, '..', 'lambda')
+
+# Seconds an idle kept-alive connection stays open
+KEEPALIVE_TIMEOUT = 30
+MAX_BODY = 10 * 1024 * 1024  # API Gateway's payload limit
+
+# What local/cors.json allows on the bucket, for the storage route
+STORAGE_CORS_HEADERS = {'Access-Control-Allow-Origin': '*', 'Access-Control-Expose-Headers': 'ETag'}
+
+
+class LambdaRequestHandler(BaseHTTPRequestHandler):
+    """Turns each HTTP request into an API Gateway proxy event for lambda_handler"""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True
+    timeout = KEEPALIVE_TIMEOUT
+    server_version = 'fileserver'
+
+    def invoke(self):
+        if self.server.storage_prefix and self.path.startswith(self.server.storage_prefix):
+            self.transfer()
+            return
+        path, _, query = self.path.partition('?')
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            self.send_error(411)
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            self.send_error(413)
+            return
+        body, encoded = (self.rfile.read(length) if length else None), False
+        if body is not None:
+            try:
+                body = body.decode('utf-8')
+            except UnicodeDecodeError:
+                body, encoded = base64.b64encode(body).decode(), True
+
+        request_id = str(uuid.uuid4())
+        event = {
+            'resource': path,
+            'path': path,
+            'httpMethod': self.command,
+            'headers': dict(self.headers),
+            'queryStringParameters': dict(parse_qsl(query, keep_blank_values=True)) or None,
+            'body': body,
+            'isBase64Encoded': encoded,
+            'requestContext': {
+                'requestId': request_id,
+                'requestTimeEpoch': int(time.time() * 1000),
+                'httpMethod': self.command,
+                'path': path,
+                'identity': {'sourceIp': self.client_address[0]},
+            },
+        }
+
+        server = self.server
+        with server.invoke_lock:
+            started = time.perf_counter()
+            try:
+                response = server.lambda_handler(event, SimpleNamespace(aws_request_id=request_id))
+            except Exception:
+                # What API Gateway answers when the function itself fails
+                traceback.print_exc()
+                response = {'statusCode': 502, 'headers': {}, 'body': json.dumps({'message': 'Internal server error'})}
+            ms = (time.perf_counter() - started) * 1000
+        if server.capture:
+            server.capture.record(event, response.get('statusCode', 200), ms)
+
+        payload = response.get('body') or ''
+        payload = base64.b64decode(payload) if response.get('isBase64Encoded') else payload.encode()
+        self.reply(response.get('statusCode', 200), response.get('headers') or {}, payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = do_HEAD = do_OPTIONS = invoke
+
+    def reply(self, status, headers, payload=b'', length=None):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload) if length is None else length))
+        self.end_headers()
+        if payload and self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    def transfer(self):
+        """Requests to presigned URLs of the local storage backend: objects out with sendfile, objects and parts in.
+
+        These run on the connection's thread without the invocation lock, so
+        large transfers never hold up API requests.
+        """
+        storage = self.server.storage
+        path, _, query_string = self.path.partition('?')
+        key = unquote(path[len(self.server.storage_prefix):])
+        query = dict(parse_qsl(query_string, keep_blank_values=True))
+
+        if self.command == 'OPTIONS':
+            self.reply(200, dict(STORAGE_CORS_HEADERS, **{
+                'Access-Control-Allow-Methods': 'GET, PUT, HEAD',
+                'Access-Control-Allow-Headers': self.headers.get('Access-Control-Request-Headers', '*'),
+                'Access-Control-Max-Age': '3000',
+            }))
+            return
+        method = 'GET' if self.command == 'HEAD' else self.command
+        if method not in ('GET', 'PUT') or not storage.presigner.verify(method, key, query):
+            # An unread upload body can't be skipped; drop the connection instead
+            self.close_connection = True
+            self.reply(403, STORAGE_CORS_HEADERS, b'AccessDenied')
+            return
+        if method == 'PUT':
+            self.receive_object(storage.s3, key, query)
+        else:
+            self.send_object(storage.s3, key, query)
+
+    def receive_object(self, s3, key, query):
+        from localstore import BadDigest, NoSuchUpload
+
+        length = self.headers.get('Content-Length')
+        checksum = query.get('checksum-sha256')
+        header = self.headers.get('x-amz-checksum-sha256')
+        if length is None or (checksum and header and header != checksum):
+            self.close_connection = True
+            self.reply(411 if length is None else 400, STORAGE_CORS_HEADERS, b'BadRequest')
+            return
+        try:
+            if 'uploadId' in query:
+                etag = s3.receive_part(query['uploadId'], int(query['partNumber']), self.rfile, int(length), checksum or header)
+            else:
+                etag = s3.receive_object(key, self.rfile, int(length), checksum or header, self.headers.get('Content-Type'))
+        except (BadDigest, NoSuchUpload) as e:
+            self.close_connection = True
+            self.reply(400 if isinstance(e, BadDigest) else 404, STORAGE_CORS_HEADERS, type(e).__name__.encode())
+            return
+        self.reply(200, dict(STORAGE_CORS_HEADERS, ETag=etag))
+
+    def send_object(self, s3, key, query):
+        from localstore import NoSuchKey
+
+        try:
+            path, size, content_type, etag = s3.open_object(key)
+        except NoSuchKey:
+            self.reply(404, STORAGE_CORS_HEADERS, b'NoSuchKey')
+            return
+        headers = dict(STORAGE_CORS_HEADERS, **{'Content-Type': content_type, 'Accept-Ranges': 'bytes', 'ETag': etag})
+        if query.get('response-content-disposition'):
+            headers['Content-Disposition'] = query['response-content-disposition']
+
+        status, start, length = 200, 0, size
+        requested = self.headers.get('Range', '')
+        if requested.startswith('bytes=') and ',' not in requested:
+            first, _, last = requested[6:].partition('-')
+            try:
+                if first:
+                    start, end = int(first), min(int(last), size - 1) if last else size - 1
+                else:
+                    start, end = max(size - int(last), 0), size - 1
+            except ValueError:
+                start, end = 0, size - 1
+            if start > end:
+                self.reply(416, dict(STORAGE_CORS_HEADERS, **{'Content-Range': f'bytes */{size}'}))
+                return
+            status, length = 206, end - start + 1
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+        with open(path, 'rb') as source:
+            self.reply(status, headers, length=length)
+            if self.command != 'HEAD' and length:
+                # Straight from the page cache to the socket
+                self.connection.sendfile(source, start, length)
+
+    def log_request(self, code='-', size='-'):
+        # The handler logs every request itself
+        pass
+
+
+class WorkerServer(ThreadingMixIn, HTTPServer):
+    """One worker: a thread per connection on an already-listening socket, one invocation at a time"""
+
+    daemon_threads = True
+
+    def __init__(self, listener, handler, capture):
+        super().__init__(listener.getsockname()[:2], LambdaRequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = listener
+        self.lambda_handler = handler.lambda_handler
+        self.capture = capture
+        self.invoke_lock = threading.Lock()
+        # With the local storage backend, presigned URLs point here
+        self.storage = self.storage_prefix = None
+        if handler.STORAGE_BACKEND == 'local':
+            self.storage = handler.local_storage
+            self.storage_prefix = urlsplit(handler.LOCAL_STORAGE_URL).path.rstrip('/') + '/'
+
+
+def run_worker(listener, handler, capture):
+    """Serve until SIGTERM, then finish the invocation in progress and flush route metrics"""
+    server = WorkerServer(listener, handler, capture)
+    # shutdown() waits for serve_forever(), which runs on this (the signal handling) thread
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    server.serve_forever()
+    with server.invoke_lock:
+        handler.flush_route_latency()
+
+
+def serve(host='0.0.0.0', port=5000, workers=1, capture_path=None):
+    """Listen on host:port and serve lambda_handler from `workers` pre-forked processes"""
+    sys.path.insert(0, LAMBDA_DIR)
+    import handler
+    from replay import CaptureWriter
+
+    capture = CaptureWriter(capture_path) if capture_path else None
+    listener = socket.create_server((host, port), backlog=1024)
+    if not hasattr(os, 'fork'):
+        workers = 1
+    if workers <= 1:
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        try:
+            run_worker(listener, handler, capture)
+        except KeyboardInterrupt:
+            handler.flush_route_latency()
+        return
+
+    children = set()
+    stopping = []
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            # The parent stops workers with SIGTERM; ^C reaches the whole process group
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            try:
+                run_worker(listener, handler, capture)
+            finally:
+                sys.stdout.flush()
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    while children:
+        pid, status = os.wait()
+        children.discard(pid)
+        if not stopping:
+            print(json.dumps({'worker_exited': {'pid': pid, 'status': status}}), flush=True)
+            spawn()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes, i.e. requests handled at once (default: one per CPU)')
+    parser.add_argument('--capture', metavar='FILE',
+                        help='append every request to FILE for replay.py (includes tokens and passwords)')
+    args = parser.parse_args()
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers", flush=True)
+    serve(args.host, args.port, args.workers, args.capture)
+
+
+if __name__ == '__main__':
+    main()
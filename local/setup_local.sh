@@ -54,12 +54,47 @@ aws --endpoint-url=$ENDPOINT dynamodb create-table \
         AttributeName=file_id,AttributeType=S \
         AttributeName=username,AttributeType=S \
         AttributeName=file_hash,AttributeType=S \
+        AttributeName=listing,AttributeType=S \
+        AttributeName=uploaded_at,AttributeType=S \
     --key-schema AttributeName=file_id,KeyType=HASH \
     --global-secondary-indexes \
-        "[{\"IndexName\":\"UserIndex\",\"KeySchema\":[{\"AttributeName\":\"username\",\"KeyType\":\"HASH\"}],\"Projection\":{\"ProjectionType\":\"ALL\"}},{\"IndexName\":\"HashIndex\",\"KeySchema\":[{\"AttributeName\":\"file_hash\",\"KeyType\":\"HASH\"}],\"Projection\":{\"ProjectionType\":\"ALL\"}}]" \
+        "[{\"IndexName\":\"UserIndex\",\"KeySchema\":[{\"AttributeName\":\"username\",\"KeyType\":\"HASH\"},{\"AttributeName\":\"uploaded_at\",\"KeyType\":\"RANGE\"}],\"Projection\":{\"ProjectionType\":\"INCLUDE\",\"NonKeyAttributes\":[\"filename\",\"size\",\"content_type\"]}},{\"IndexName\":\"HashIndex\",\"KeySchema\":[{\"AttributeName\":\"file_hash\",\"KeyType\":\"HASH\"}],\"Projection\":{\"ProjectionType\":\"ALL\"}},{\"IndexName\":\"UploadedAtIndex\",\"KeySchema\":[{\"AttributeName\":\"listing\",\"KeyType\":\"HASH\"},{\"AttributeName\":\"uploaded_at\",\"KeyType\":\"RANGE\"}],\"Projection\":{\"ProjectionType\":\"INCLUDE\",\"NonKeyAttributes\":[\"filename\",\"size\",\"username\",\"content_type\"]}}]" \
     --billing-mode PAY_PER_REQUEST \
     --region $REGION 2>/dev/null || echo "Table fileserver-files already exists"
 
+aws --endpoint-url=$ENDPOINT dynamodb create-table \
+    --table-name fileserver-meta \
+    --attribute-definitions AttributeName=name,AttributeType=S \
+    --key-schema AttributeName=name,KeyType=HASH \
+    --billing-mode PAY_PER_REQUEST \
+    --region $REGION 2>/dev/null || echo "Table fileserver-meta already exists"
+
+aws --endpoint-url=$ENDPOINT dynamodb create-table \
+    --table-name fileserver-uploads \
+    --attribute-definitions AttributeName=upload_id,AttributeType=S \
+    --key-schema AttributeName=upload_id,KeyType=HASH \
+    --billing-mode PAY_PER_REQUEST \
+    --region $REGION 2>/dev/null || echo "Table fileserver-uploads already exists"
+
+aws --endpoint-url=$ENDPOINT dynamodb create-table \
+    --table-name fileserver-blobs \
+    --attribute-definitions AttributeName=file_hash,AttributeType=S \
+    --key-schema AttributeName=file_hash,KeyType=HASH \
+    --billing-mode PAY_PER_REQUEST \
+    --region $REGION 2>/dev/null || echo "Table fileserver-blobs already exists"
+
+aws --endpoint-url=$ENDPOINT dynamodb create-table \
+    --table-name fileserver-search \
+    --attribute-definitions \
+        AttributeName=posting,AttributeType=S \
+        AttributeName=gram,AttributeType=S \
+        AttributeName=uploaded_at,AttributeType=S \
+    --key-schema AttributeName=posting,KeyType=HASH \
+    --global-secondary-indexes \
+        "[{\"IndexName\":\"GramIndex\",\"KeySchema\":[{\"AttributeName\":\"gram\",\"KeyType\":\"HASH\"},{\"AttributeName\":\"uploaded_at\",\"KeyType\":\"RANGE\"}],\"Projection\":{\"ProjectionType\":\"INCLUDE\",\"NonKeyAttributes\":[\"file_id\",\"filename\",\"size\",\"username\",\"content_type\"]}}]" \
+    --billing-mode PAY_PER_REQUEST \
+    --region $REGION 2>/dev/null || echo "Table fileserver-search already exists"
+
 # Create test user (username: test, password: test123)
 echo "Creating test user..."
 aws --endpoint-url=$ENDPOINT dynamodb put-item \
@@ -11,10 +11,15 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda'))
 os.environ['BUCKET_NAME'] = 'test-bucket'
 os.environ['USERS_TABLE'] = 'test-users'
 os.environ['FILES_TABLE'] = 'test-files'
+os.environ['META_TABLE'] = 'test-meta'
+os.environ['UPLOADS_TABLE'] = 'test-uploads'
+os.environ['BLOBS_TABLE'] = 'test-blobs'
+os.environ['SEARCH_TABLE'] = 'test-search'
+os.environ['TOKEN_SIGNING_KEYS'] = 'test:test-signing-key'
 
 print("Testing Lambda handler imports...")
 try:
-    from handler import lambda_handler, verify_token, handle_login
+    from handler import lambda_handler, handle_login
     print("✓ Handler imports successful")
 except Exception as e:
     print(f"✗ Import failed: {e}")
@@ -35,6 +40,57 @@ try:
 except Exception as e:
     print(f"✓ Handler routing works (AWS error expected: {type(e).__name__})")
 
+print("\nTesting bundle entry names...")
+import io
+import zipfile
+from zipstream import ZipStreamWriter
+
+archive = io.BytesIO()
+writer = ZipStreamWriter(archive)
+for name in ['../../.bashrc', '/etc/passwd', 'C:\\Windows\\x.txt', 'D:y.txt', '..', 'movie.mp4']:
+    writer.add(name, [b'data'])
+writer.close()
+names = zipfile.ZipFile(archive).namelist()
+if names != ['.bashrc', 'passwd', 'x.txt', 'y.txt', 'file', 'movie.mp4']:
+    print(f"✗ Unsafe entry names: {names}")
+    sys.exit(1)
+print("✓ Entry names stay inside the extraction directory")
+
+print("\nTesting listing cursors...")
+import base64
+import json
+from handler import LISTING_PARTITION, decode_cursor, encode_cursor
+
+
+def cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+# The archive listing (UploadedAtIndex) and one owner's files (UserIndex)
+for attribute, value in [('listing', LISTING_PARTITION), ('username', 'alice')]:
+    key = {'file_id': 'alice/1_a.mp4', 'uploaded_at': '2024-01-01T00:00:00', attribute: value}
+    valid = encode_cursor({name: {'S': part} for name, part in key.items()})
+    if decode_cursor(valid, attribute, value) != {name: {'S': part} for name, part in key.items()}:
+        print(f"✗ Valid {attribute} cursor rejected")
+        sys.exit(1)
+    malformed = [
+        cursor({attribute: value}),
+        cursor(dict(key, extra='x')),
+        cursor(dict(key, uploaded_at={'S': 'x'})),
+        cursor(dict(key, file_id=1)),
+        cursor(dict(key, **{attribute: 'bob'})),
+        cursor([key]),
+        'not a cursor',
+    ]
+    for bad in malformed:
+        try:
+            decode_cursor(bad, attribute, value)
+        except ValueError:
+            continue
+        print(f"✗ Malformed {attribute} cursor accepted: {bad}")
+        sys.exit(1)
+print("✓ Malformed cursors are rejected for both listing indexes")
+
 print("\n✓ All basic tests passed!")
 print("\nTo test with real AWS services, use LocalStack:")
 print("  make local-start")
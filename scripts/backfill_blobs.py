@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Move existing SHA-256 file records onto shared blobs so batch duplicate checks find them.
+
+Stored hashes were never checked against the bytes, so each object is
+re-hashed first; files whose content doesn't match keep their own object
+and are listed at the end.
+"""
+import boto3
+import hashlib
+import re
+import sys
+
+BLOB_PREFIX = 'blobs/'  # Must match handler.BLOB_PREFIX
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+HASH_CHUNK = 8 * 1024 * 1024
+
+bucket_name = sys.argv[1] if len(sys.argv) > 1 else 'fileserver-files'
+files_table_name = sys.argv[2] if len(sys.argv) > 2 else 'fileserver-files'
+blobs_table_name = sys.argv[3] if len(sys.argv) > 3 else 'fileserver-blobs'
+
+s3 = boto3.client('s3')
+dynamodb = boto3.resource('dynamodb')
+files_table = dynamodb.Table(files_table_name)
+blobs_table = dynamodb.Table(blobs_table_name)
+
+
+def blob_exists(blob_key):
+    try:
+        s3.head_object(Bucket=bucket_name, Key=blob_key)
+        return True
+    except s3.exceptions.ClientError:
+        return False
+
+
+def object_sha256(key):
+    digest = hashlib.sha256()
+    for chunk in s3.get_object(Bucket=bucket_name, Key=key)['Body'].iter_chunks(HASH_CHUNK):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+migrated = 0
+skipped = 0
+mismatched = []
+busy = []
+scan_kwargs = {
+    'ProjectionExpression': 'file_id, file_hash, #size',
+    'FilterExpression': 'attribute_not_exists(blob_key)',
+    'ExpressionAttributeNames': {'#size': 'size'}
+}
+
+while True:
+    response = files_table.scan(**scan_kwargs)
+    for item in response.get('Items', []):
+        file_id = item['file_id']
+        file_hash = item.get('file_hash', '')
+        if not SHA256_PATTERN.match(file_hash):
+            skipped += 1
+            continue
+
+        # A wrong hash would hand these bytes out as another file's duplicate
+        if object_sha256(file_id) != file_hash:
+            mismatched.append(file_id)
+            continue
+
+        # Count the reference before copying, as handler.acquire_blob does,
+        # so a concurrent release can't delete the blob under us
+        blob_key = f"{BLOB_PREFIX}{file_hash}"
+        try:
+            blobs_table.update_item(
+                Key={'file_hash': file_hash},
+                UpdateExpression='ADD ref_count :one, refs :ref SET blob_key = :key, #size = :size',
+                ConditionExpression='NOT contains(refs, :file_id) AND attribute_not_exists(deleting)',
+                ExpressionAttributeNames={'#size': 'size'},
+                ExpressionAttributeValues={
+                    ':one': 1,
+                    ':ref': {file_id},
+                    ':file_id': file_id,
+                    ':key': blob_key,
+                    ':size': item['size']
+                }
+            )
+        except blobs_table.meta.client.exceptions.ConditionalCheckFailedException:
+            blob = blobs_table.get_item(Key={'file_hash': file_hash}, ConsistentRead=True).get('Item')
+            if not blob or file_id not in blob.get('refs', ()):
+                # Being deleted by a release; run again later
+                busy.append(file_id)
+                continue
+            # Already referenced by an earlier, interrupted run
+        if not blob_exists(blob_key):
+            s3.copy({'Bucket': bucket_name, 'Key': file_id}, bucket_name, blob_key)
+
+        files_table.update_item(
+            Key={'file_id': file_id},
+            UpdateExpression='SET blob_key = :key',
+            ExpressionAttributeValues={':key': blob_key}
+        )
+        s3.delete_object(Bucket=bucket_name, Key=file_id)
+        migrated += 1
+
+    if 'LastEvaluatedKey' not in response:
+        break
+    scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+print(f"Moved {migrated} file(s) onto shared blobs, left {skipped} without a SHA-256 hash")
+for file_id in mismatched:
+    print(f"Left {file_id} in place: its content does not match its file_hash")
+for file_id in busy:
+    print(f"Left {file_id} in place: its blob was being deleted, run again to move it")
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""Tag existing file records so they appear in the UploadedAtIndex listing"""
+import boto3
+import sys
+
+LISTING_PARTITION = 'archive'  # Must match handler.LISTING_PARTITION
+
+table_name = sys.argv[1] if len(sys.argv) > 1 else 'fileserver-files'
+
+dynamodb = boto3.resource('dynamodb')
+table = dynamodb.Table(table_name)
+
+updated = 0
+scan_kwargs = {
+    'ProjectionExpression': 'file_id',
+    'FilterExpression': 'attribute_not_exists(listing) AND attribute_exists(uploaded_at)'
+}
+
+while True:
+    response = table.scan(**scan_kwargs)
+    for item in response.get('Items', []):
+        table.update_item(
+            Key={'file_id': item['file_id']},
+            UpdateExpression='SET listing = :listing',
+            ExpressionAttributeValues={':listing': LISTING_PARTITION}
+        )
+        updated += 1
+
+    if 'LastEvaluatedKey' not in response:
+        break
+    scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+print(f"Tagged {updated} file(s) in '{table_name}'")
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Index existing file records for /search"""
+import boto3
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+from search import filename_grams, posting_key
+
+ATTRIBUTES = ('file_id', 'filename', 'size', 'uploaded_at', 'username', 'content_type')  # handler.SEARCH_ATTRIBUTES
+
+files_table_name = sys.argv[1] if len(sys.argv) > 1 else 'fileserver-files'
+search_table_name = sys.argv[2] if len(sys.argv) > 2 else 'fileserver-search'
+
+dynamodb = boto3.resource('dynamodb')
+files_table = dynamodb.Table(files_table_name)
+search_table = dynamodb.Table(search_table_name)
+
+indexed = 0
+postings = 0
+scan_kwargs = {
+    'ProjectionExpression': 'file_id, filename, #size, uploaded_at, username, content_type',
+    'ExpressionAttributeNames': {'#size': 'size'},
+    'FilterExpression': 'attribute_exists(uploaded_at)'
+}
+
+with search_table.batch_writer(overwrite_by_pkeys=['posting']) as batch:
+    while True:
+        response = files_table.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            entry = {name: item[name] for name in ATTRIBUTES if name in item}
+            for gram in filename_grams(item['filename']):
+                batch.put_item(Item=dict(entry, posting=posting_key(gram, item['file_id']), gram=gram))
+                postings += 1
+            indexed += 1
+
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+print(f"Indexed {indexed} file(s) from '{files_table_name}' as {postings} posting(s) in '{search_table_name}'")
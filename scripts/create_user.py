@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import boto3
 import hashlib
+import os
 import sys
 
 if len(sys.argv) != 3:
@@ -13,9 +14,17 @@ password = sys.argv[2]
 # Hash password
 password_hash = hashlib.sha256(password.encode()).hexdigest()
 
-# Store in DynamoDB
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('fileserver-users')  # Update with your table name
+table_name = os.environ.get('USERS_TABLE', 'fileserver-users')  # Update with your table name
+if os.environ.get('STORAGE_BACKEND') == 'local':
+    # Self-hosted with local storage: the users table lives in LOCAL_STORAGE_DIR/metadata.db
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+    from localstore import LocalStorage
+    storage = LocalStorage(os.environ.get('LOCAL_STORAGE_DIR', 'storage'), '', b'', {table_name: ('username', {})})
+    table = storage.dynamodb.Table(table_name)
+else:
+    # Store in DynamoDB
+    dynamodb = boto3.resource('dynamodb')
+    table = dynamodb.Table(table_name)
 
 table.put_item(Item={
     'username': username,
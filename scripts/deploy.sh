@@ -2,10 +2,17 @@
 set -e
 
 echo "Building Lambda deployment package..."
-cd lambda
-pip install -r requirements.txt -t .
-zip -r ../terraform/lambda_function.zip . -x "*.pyc" "__pycache__/*"
-cd ..
+# boto3 and its dependencies ship with the Lambda Python runtime, so the
+# package is just our modules. Bytecode is included (checked against the
+# source hash) so cold starts don't recompile handler.py; it is only used
+# if the build Python matches the runtime (3.11).
+BUILD_DIR=$(mktemp -d)
+cp lambda/*.py "$BUILD_DIR"/
+PYTHON=$(command -v python3.11 || command -v python3)
+"$PYTHON" -m compileall -q --invalidation-mode checked-hash "$BUILD_DIR"
+rm -f terraform/lambda_function.zip
+(cd "$BUILD_DIR" && zip -qr "$OLDPWD/terraform/lambda_function.zip" .)
+rm -rf "$BUILD_DIR"
 
 echo "Deploying infrastructure..."
 cd terraform
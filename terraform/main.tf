@@ -29,6 +29,36 @@ resource "aws_s3_bucket_public_access_block" "files" {
   restrict_public_buckets = true
 }
 
+# Abort multipart uploads that were never completed (matches UPLOAD_SESSION_TTL)
+resource "aws_s3_bucket_lifecycle_configuration" "files" {
+  bucket = aws_s3_bucket.files.id
+
+  rule {
+    id     = "abort-incomplete-multipart-uploads"
+    status = "Enabled"
+
+    filter {}
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 7
+    }
+  }
+
+  # ZIP bundles are one-off downloads (matches BUNDLE_TTL)
+  rule {
+    id     = "expire-bundles"
+    status = "Enabled"
+
+    filter {
+      prefix = "bundles/"
+    }
+
+    expiration {
+      days = 1
+    }
+  }
+}
+
 # CORS configuration for file uploads from browser
 resource "aws_s3_bucket_cors_configuration" "files" {
   bucket = aws_s3_bucket.files.id
@@ -98,10 +128,23 @@ resource "aws_dynamodb_table" "files" {
     type = "S"
   }
 
+  attribute {
+    name = "listing"
+    type = "S"
+  }
+
+  attribute {
+    name = "uploaded_at"
+    type = "S"
+  }
+
+  # One user's files, newest first (/files?owner=)
   global_secondary_index {
-    name            = "UserIndex"
-    hash_key        = "username"
-    projection_type = "ALL"
+    name               = "UserIndex"
+    hash_key           = "username"
+    range_key          = "uploaded_at"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["filename", "size", "content_type"]
   }
 
   global_secondary_index {
@@ -109,6 +152,114 @@ resource "aws_dynamodb_table" "files" {
     hash_key        = "file_hash"
     projection_type = "ALL"
   }
+
+  # Archive listing, newest first (listing is a constant partition key)
+  global_secondary_index {
+    name               = "UploadedAtIndex"
+    hash_key           = "listing"
+    range_key          = "uploaded_at"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["filename", "size", "username", "content_type"]
+  }
+}
+
+# Small key/value table for shared counters (e.g. the archive version) and the change log
+resource "aws_dynamodb_table" "meta" {
+  name           = "${var.project_name}-meta"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "name"
+
+  attribute {
+    name = "name"
+    type = "S"
+  }
+
+  # Bundle jobs and change log records carry expires_at
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+# Content-addressed blobs (S3 key blobs/<sha256>) and their reference counts
+resource "aws_dynamodb_table" "blobs" {
+  name           = "${var.project_name}-blobs"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "file_hash"
+
+  attribute {
+    name = "file_hash"
+    type = "S"
+  }
+}
+
+# Filename search postings: one item per (n-gram of the filename, file),
+# queried newest first through GramIndex (see lambda/search.py)
+resource "aws_dynamodb_table" "search" {
+  name           = "${var.project_name}-search"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "posting"
+
+  attribute {
+    name = "posting"
+    type = "S"
+  }
+
+  attribute {
+    name = "gram"
+    type = "S"
+  }
+
+  attribute {
+    name = "uploaded_at"
+    type = "S"
+  }
+
+  global_secondary_index {
+    name               = "GramIndex"
+    hash_key           = "gram"
+    range_key          = "uploaded_at"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["file_id", "filename", "size", "username", "content_type"]
+  }
+}
+
+# In-progress multipart uploads, so interrupted uploads can be resumed
+resource "aws_dynamodb_table" "uploads" {
+  name           = "${var.project_name}-uploads"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "upload_id"
+
+  attribute {
+    name = "upload_id"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+# Secret used to sign session tokens. To rotate, prepend a new kid:secret
+# pair to TOKEN_SIGNING_KEYS and drop the old one after TOKEN_TTL has passed.
+resource "random_password" "token_signing_key" {
+  length  = 48
+  special = false
+}
+
+locals {
+  lambda_environment = {
+    BUCKET_NAME  = aws_s3_bucket.files.id
+    USERS_TABLE  = aws_dynamodb_table.users.name
+    FILES_TABLE  = aws_dynamodb_table.files.name
+    META_TABLE   = aws_dynamodb_table.meta.name
+    UPLOADS_TABLE = aws_dynamodb_table.uploads.name
+    BLOBS_TABLE  = aws_dynamodb_table.blobs.name
+    SEARCH_TABLE = aws_dynamodb_table.search.name
+    TOKEN_SIGNING_KEYS = "k1:${random_password.token_signing_key.result}"
+    AWS_TRACE_SAMPLE_RATE = tostring(var.aws_trace_sample_rate)
+  }
 }
 
 # Lambda function
@@ -122,11 +273,25 @@ resource "aws_lambda_function" "api" {
   memory_size     = 256
 
   environment {
-    variables = {
-      BUCKET_NAME  = aws_s3_bucket.files.id
-      USERS_TABLE  = aws_dynamodb_table.users.name
-      FILES_TABLE  = aws_dynamodb_table.files.name
-    }
+    variables = merge(local.lambda_environment, {
+      BUNDLE_FUNCTION = aws_lambda_function.bundler.function_name
+      BUNDLE_TIMEOUT  = tostring(aws_lambda_function.bundler.timeout)
+    })
+  }
+}
+
+# Builds ZIP bundles in the background; same code, long timeout
+resource "aws_lambda_function" "bundler" {
+  filename         = "lambda_function.zip"
+  function_name    = "${var.project_name}-bundler"
+  role            = aws_iam_role.lambda.arn
+  handler         = "handler.bundle_handler"
+  runtime         = "python3.11"
+  timeout         = 900
+  memory_size     = 1024
+
+  environment {
+    variables = local.lambda_environment
   }
 }
 
@@ -160,7 +325,9 @@ resource "aws_iam_role_policy" "lambda" {
         Action = [
           "s3:GetObject",
           "s3:PutObject",
-          "s3:DeleteObject"
+          "s3:DeleteObject",
+          "s3:ListMultipartUploadParts",
+          "s3:AbortMultipartUpload"
         ]
         Resource = "${aws_s3_bucket.files.arn}/*"
       },
@@ -183,15 +350,30 @@ resource "aws_iam_role_policy" "lambda" {
         Action = [
           "dynamodb:GetItem",
           "dynamodb:PutItem",
+          "dynamodb:UpdateItem",
           "dynamodb:Query",
           "dynamodb:Scan",
-          "dynamodb:DeleteItem"
+          "dynamodb:DeleteItem",
+          "dynamodb:BatchGetItem",
+          "dynamodb:BatchWriteItem"
         ]
         Resource = [
           aws_dynamodb_table.users.arn,
           aws_dynamodb_table.files.arn,
-          "${aws_dynamodb_table.files.arn}/index/*"
+          "${aws_dynamodb_table.files.arn}/index/*",
+          aws_dynamodb_table.meta.arn,
+          aws_dynamodb_table.uploads.arn,
+          aws_dynamodb_table.blobs.arn,
+          aws_dynamodb_table.search.arn,
+          "${aws_dynamodb_table.search.arn}/index/*"
+        ]
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "lambda:InvokeFunction"
         ]
+        Resource = aws_lambda_function.bundler.arn
       },
       {
         Effect = "Allow"
@@ -214,7 +396,8 @@ resource "aws_apigatewayv2_api" "api" {
   cors_configuration {
     allow_origins = ["*"]
     allow_methods = ["GET", "POST", "OPTIONS"]
-    allow_headers = ["Content-Type", "Authorization"]
+    allow_headers = ["Content-Type", "Authorization", "If-None-Match"]
+    expose_headers = ["ETag"]
   }
 }
 
@@ -225,7 +408,7 @@ resource "aws_apigatewayv2_integration" "lambda" {
 }
 
 resource "aws_apigatewayv2_route" "routes" {
-  for_each = toset(["/login", "/files", "/upload", "/upload-complete", "/check-duplicate", "/download", "/delete"])
+  for_each = toset(["/login", "/logout", "/files", "/files/changes", "/search", "/upload", "/upload-parts", "/upload-status", "/upload-complete", "/upload-complete-batch", "/check-duplicate", "/check-duplicate-batch", "/download", "/download-batch", "/bundle", "/bundle-status", "/delete", "/delete-batch"])
 
   api_id    = aws_apigatewayv2_api.api.id
   route_key = "ANY ${each.value}"
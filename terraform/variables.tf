@@ -21,3 +21,9 @@ variable "hosted_zone_id" {
   type        = string
   default     = "Z04008502BKUSRFDXT5NP"
 }
+
+variable "aws_trace_sample_rate" {
+  description = "Fraction of Lambda invocations that log a full trace of their AWS calls (0 to 1)"
+  type        = number
+  default     = 0
+}